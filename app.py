@@ -7,12 +7,30 @@ Flask-based web interface for managing CP4I component downloads
 from flask import Flask, render_template, request, jsonify, send_file
 from flask_cors import CORS
 import subprocess
+import asyncio
+import concurrent.futures
 import os
+import random
+import sys
+import re
 import json
+import logging
+import shutil
+import signal
 import threading
 import time
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
 import glob
+import gzip
+import bisect
+import base64
+import hashlib
+import hmac
+import socket
+import urllib.error
+import urllib.request
 
 app = Flask(__name__)
 CORS(app)
@@ -22,805 +40,5489 @@ HOME_DIR = "/opt/cp4i"
 SCRIPT_PATH = os.path.join(os.path.dirname(__file__), "cp4i_downloader.sh")
 CONFIG_FILE = os.path.join(HOME_DIR, ".cp4i-downloader.conf")
 
+# Disk capacity planning (sizes in GB, overridable from the environment)
+GB = 1024 * 1024 * 1024
+DISK_HEADROOM_BYTES = int(float(os.environ.get("CP4I_DISK_HEADROOM_GB", 10)) * GB)
+DISK_PAUSE_FREE_BYTES = int(float(os.environ.get("CP4I_DISK_PAUSE_FREE_GB", 5)) * GB)
+DISK_RESUME_FREE_BYTES = int(float(os.environ.get("CP4I_DISK_RESUME_FREE_GB", 15)) * GB)
+DEFAULT_ESTIMATE_BYTES = int(float(os.environ.get("CP4I_DEFAULT_ESTIMATE_GB", 20)) * GB)
+DRY_RUN_ESTIMATE_BYTES = 256 * 1024 * 1024
+ESTIMATE_SAFETY_FACTOR = 1.1
+CAPACITY_CHECK_INTERVAL = 15  # seconds between free-space checks
+MONITOR_INTERVAL = 10  # seconds between log follow passes per download
+SUPERVISOR_WORKERS = int(os.environ.get("CP4I_SUPERVISOR_WORKERS", 4))  # threads for blocking supervisor work
+SPAWN_TIMEOUT = 10  # seconds an API call waits for a job's process to be spawned
+OUTPUT_TAIL_LINES = 200  # lines of script stdout/stderr kept per download
+FINISHED_STATUSES = ("completed", "failed", "stopped", "dismissed")
+
+# Block-compressed archival of completed download logs
+LOG_ARCHIVE_ENABLED = os.environ.get("CP4I_LOG_ARCHIVE", "true").lower() == "true"
+LOG_ARCHIVE_BLOCK_SIZE = 1024 * 1024  # uncompressed bytes per independently readable block
+LOG_ARCHIVE_MIN_BYTES = 64 * 1024  # smaller logs are left as they are
+LOG_ARCHIVE_LEVEL = 6
+LOG_RANGE_MAX_BYTES = 16 * 1024 * 1024  # largest range returned by one /api/logs request
+
+# Distributed workers: a server started with CP4I_COORDINATOR_URL runs jobs for that coordinator
+SERVER_PORT = int(os.environ.get("CP4I_PORT", 5000))
+COORDINATOR_URL = os.environ.get("CP4I_COORDINATOR_URL")
+WORKER_NAME = os.environ.get("CP4I_WORKER_NAME", socket.gethostname())
+WORKER_URL = os.environ.get("CP4I_WORKER_URL", f"http://{socket.gethostname()}:{SERVER_PORT}")  # as seen by the coordinator
+WORKER_SLOTS = int(os.environ.get("CP4I_WORKER_SLOTS", 2))  # concurrent downloads before a host counts as busy
+WORKER_TOKEN = os.environ.get("CP4I_WORKER_TOKEN")  # shared secret, required for coordinator and worker mode
+COORDINATOR_RUNS_JOBS = os.environ.get("CP4I_COORDINATOR_RUNS_JOBS", "true").lower() == "true"
+WORKER_HEARTBEAT_INTERVAL = 10  # seconds
+WORKER_TIMEOUT = 3 * WORKER_HEARTBEAT_INTERVAL  # a worker without heartbeats for this long is offline
+WORKER_HTTP_TIMEOUT = 10  # seconds per call to a worker or coordinator
+
+# Conditional, delta and compressed responses for GET /api/downloads
+DOWNLOADS_FEED_MAX_REMOVED = 1000  # removed ids remembered for ?since= deltas
+GZIP_MIN_BYTES = 4096
+GZIP_LEVEL = 5
+
+# Per-download index of log errors and warnings
+ERROR_INDEX_MAX_ENTRIES = 5000
+ERROR_INDEX_MAX_CAUSES = 200  # later distinct messages are counted under "other errors/warnings"
+ERROR_INDEX_SUFFIX = ".errors.json"  # sidecar next to the log, written when a download finishes
+ERROR_CONTEXT_MAX_LINES = 20
+ERROR_CONTEXT_LINE_BYTES = 1024  # bytes read per context line requested
+ERROR_SIGNATURE_MASK = re.compile(r"sha256:[0-9a-f]+|\b[0-9a-f]{12,}\b|\d+(\.\d+)?")
+
+# Retention of finished download directories (quota and version count 0 = disabled)
+RETENTION_QUOTA_BYTES = int(float(os.environ.get("CP4I_RETENTION_QUOTA_GB", 0)) * GB)
+RETENTION_KEEP_VERSIONS = int(os.environ.get("CP4I_RETENTION_KEEP_VERSIONS", 0))
+RETENTION_INTERVAL = int(os.environ.get("CP4I_RETENTION_INTERVAL", 600))  # seconds between passes
+RETENTION_STATE_FILE = os.environ.get("CP4I_RETENTION_STATE", os.path.join(HOME_DIR, ".cp4i-retention.json"))
+RETENTION_DELETE_BATCH = 200  # files unlinked between pauses
+RETENTION_DELETE_PAUSE = 0.05  # seconds
+
+# Scheduled downloads, off-peak windows and prefetch of new catalog versions
+SCHEDULE_STATE_FILE = os.environ.get("CP4I_SCHEDULE_STATE", os.path.join(HOME_DIR, ".cp4i-schedule.json"))
+SCHEDULE_CHECK_INTERVAL = int(os.environ.get("CP4I_SCHEDULE_INTERVAL", 30))  # seconds between checks
+SCHEDULE_KEEP_FINISHED = 100  # started, failed and cancelled schedules kept in the state file
+CATALOG_FILE = os.environ.get("CP4I_CATALOG_FILE", os.path.join(HOME_DIR, "versions.json"))  # {component: [versions]}
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+# Download notifications, sent by the server in batches (the script then leaves them to it)
+NOTIFY_WEBHOOK_URL = os.environ.get("CP4I_WEBHOOK_URL")
+NOTIFY_EMAIL = os.environ.get("CP4I_NOTIFICATION_EMAIL")
+NOTIFY_EVENTS = set(os.environ.get(
+    "CP4I_NOTIFY_EVENTS", "started,queued,retrying,milestone,completed,failed,stopped").split(","))
+NOTIFY_MILESTONES = [int(p) for p in os.environ.get("CP4I_NOTIFY_MILESTONES", "25,50,75").split(",") if p]  # percent
+NOTIFY_BATCH_WINDOW = float(os.environ.get("CP4I_NOTIFY_BATCH_SECONDS", 5))  # events collected into one delivery
+NOTIFY_MAX_BATCH = 50  # notifications per webhook call or email
+NOTIFY_QUEUE_MAX = 1000  # undelivered notifications kept; later ones are dropped
+NOTIFY_MAX_ATTEMPTS = 5
+NOTIFY_RETRY_BASE_DELAY = 10  # seconds
+NOTIFY_RETRY_MAX_DELAY = 600
+NOTIFY_HTTP_TIMEOUT = 10  # seconds per webhook call or mail command
+NOTIFY_RECENT_DELIVERIES = 50
+
+# POST /api/downloads:batch
+BATCH_MAX_ITEMS = 200
+BATCH_WORKERS = 8  # items of one batch processed concurrently
+
+# Registry logins shared between jobs (the script then skips its own podman login)
+REGISTRY_SESSIONS_ENABLED = os.environ.get("CP4I_REGISTRY_SESSIONS", "true").lower() == "true"
+REGISTRY_SESSION_DIR = os.environ.get("CP4I_REGISTRY_SESSION_DIR", os.path.join(HOME_DIR, ".cp4i-sessions"))
+REGISTRY_SESSION_TTL = int(os.environ.get("CP4I_REGISTRY_SESSION_TTL", 12 * 3600))  # seconds before logging in again
+REGISTRY_LOGIN_HOST = "cp.icr.io"
+REGISTRY_LOGIN_TIMEOUT = 60  # seconds per podman login
+REGISTRY_LOGIN_ATTEMPTS = 3
+REGISTRY_LOGIN_RETRY_DELAY = 5  # seconds, doubled after each failed attempt
+
+# Per-job cgroup v2 isolation (used when CP4I_CGROUP_ROOT can be created on a cgroup2 mount)
+CGROUP_ROOT = os.environ.get("CP4I_CGROUP_ROOT", "/sys/fs/cgroup/cp4i")
+JOB_IO_WEIGHT = int(os.environ.get("CP4I_JOB_IO_WEIGHT", 100))  # 1-10000, relative to other jobs
+JOB_CPU_LIMIT = os.environ.get("CP4I_JOB_CPU_LIMIT")  # cores, e.g. "2"
+JOB_MEMORY_LIMIT = os.environ.get("CP4I_JOB_MEMORY_LIMIT")  # e.g. "8G"
+
+# Sampling of each job's process tree from /proc (interval 0 = disabled)
+PROFILE_INTERVAL = float(os.environ.get("CP4I_PROFILE_INTERVAL", 10))  # seconds between samples
+PROFILE_MAX_SAMPLES = int(os.environ.get("CP4I_PROFILE_SAMPLES", 360))  # per job; older samples are dropped
+PROFILE_STATUS_SAMPLES = 60  # latest samples in a download's status; /profile returns all
+PROFILE_SUFFIX = ".profile.json"  # sidecar next to the log, written when a download finishes
+HUNG_TIMEOUT = float(os.environ.get("CP4I_HUNG_TIMEOUT_MINUTES", 0)) * 60  # no IO progress before restart, 0 = never
+
+# Automatic retries of transient mirror failures
+AUTO_RETRY_MAX_ATTEMPTS = int(os.environ.get("CP4I_AUTO_RETRY_MAX_ATTEMPTS", 3))  # retries after the first run
+AUTO_RETRY_BASE_DELAY = float(os.environ.get("CP4I_AUTO_RETRY_BASE_SECONDS", 30))
+AUTO_RETRY_MAX_DELAY = float(os.environ.get("CP4I_AUTO_RETRY_MAX_SECONDS", 900))
+
+# Default component catalog
+DEFAULT_COMPONENTS = [
+    {
+        "name": "ibm-integration-platform-navigator",
+        "description": "Platform Navigator",
+        "typical_size": "~15GB",
+        "versions": ["7.3.2", "7.3.1", "7.3.0"]
+    },
+    {
+        "name": "ibm-apiconnect",
+        "description": "API Connect",
+        "typical_size": "~25GB",
+        "versions": ["10.0.8", "10.0.7", "10.0.6"]
+    },
+    {
+        "name": "ibm-mq",
+        "description": "MQ Advanced",
+        "typical_size": "~8GB",
+        "versions": ["9.3.5", "9.3.4", "9.3.3"]
+    },
+    {
+        "name": "ibm-eventstreams",
+        "description": "Event Streams",
+        "typical_size": "~12GB",
+        "versions": ["11.4.0", "11.3.2", "11.3.1"]
+    },
+    {
+        "name": "ibm-app-connect",
+        "description": "App Connect Enterprise",
+        "typical_size": "~10GB",
+        "versions": ["12.0.11", "12.0.10", "12.0.9"]
+    },
+    {
+        "name": "ibm-datapower-operator",
+        "description": "DataPower Gateway",
+        "typical_size": "~5GB",
+        "versions": ["1.11.0", "1.10.3", "1.10.2"]
+    }
+]
+
 # In-memory storage for active downloads
 active_downloads = {}
 download_history = []
 
-class DownloadManager:
-    """Manages download processes and their status"""
-    
-    def __init__(self):
-        self.downloads = {}
+# Server logging
+LOG_LEVEL = os.environ.get("CP4I_LOG_LEVEL", "INFO").upper()
+LOG_BUFFER_SIZE = int(os.environ.get("CP4I_LOG_BUFFER_SIZE", 5000))
+LOG_RATE_LIMIT_SECONDS = float(os.environ.get("CP4I_LOG_RATE_LIMIT_SECONDS", 60))
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_STANDARD_LOG_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Formats log records as one JSON object per line"""
+
+    @staticmethod
+    def to_dict(record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_LOG_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = logging.Formatter().formatException(record.exc_info)
+        return entry
+
+    def format(self, record):
+        return json.dumps(self.to_dict(record), default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Drops repeats of the same message template per download within a time window
+
+    The first record after the window closes carries a `suppressed` count. The
+    decision is cached on the record so the filter can be shared by several handlers.
+    """
+
+    def __init__(self, window_seconds):
+        super().__init__()
+        self.window_seconds = window_seconds
+        self.last_seen = {}
         self.lock = threading.Lock()
-    
-    def _generate_summary_report(self, download):
-        """Generate a comprehensive summary report for a download"""
+
+    def filter(self, record):
+        decision = getattr(record, "_rate_limit_decision", None)
+        if decision is not None:
+            return decision
+        if record.levelno >= logging.ERROR or self.window_seconds <= 0:
+            record._rate_limit_decision = True
+            return True
+        key = (record.name, getattr(record, "download_id", None), record.msg)
+        with self.lock:
+            last, suppressed = self.last_seen.get(key, (0.0, 0))
+            if record.created - last < self.window_seconds:
+                self.last_seen[key] = (last, suppressed + 1)
+                record._rate_limit_decision = False
+                return False
+            self.last_seen[key] = (record.created, 0)
+            if len(self.last_seen) > 10000:
+                cutoff = record.created - self.window_seconds
+                self.last_seen = {k: v for k, v in self.last_seen.items() if v[0] >= cutoff}
+        if suppressed:
+            record.suppressed = suppressed
+        record._rate_limit_decision = True
+        return True
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the most recent log records in memory for the server logs API"""
+
+    def __init__(self, capacity):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+        self.seq = 0
+
+    def emit(self, record):
         try:
-            home_dir = download.get('home_dir', HOME_DIR)
-            name = download.get('name')
-            component = download.get('component')
-            version = download.get('version')
-            status = download.get('status')
-            start_time = download.get('start_time')
-            end_time = download.get('end_time')
-            final_registry = download.get('final_registry', 'N/A')
-            registry_auth_file = download.get('registry_auth_file', 'N/A')
-            filter_pattern = download.get('filter', 'None')
-            pid = download.get('pid', 'N/A')
-            return_code = download.get('return_code', 'N/A')
-            
-            # Calculate duration
+            entry = JsonLogFormatter.to_dict(record)
+            with self.lock:
+                self.seq += 1
+                entry["seq"] = self.seq
+                self.records.append(entry)
+        except Exception:
+            self.handleError(record)
+
+    def query(self, level=None, download_id=None, logger_name=None, contains=None, since=0, limit=200):
+        """Return matching records, oldest first, limited to the newest `limit`"""
+        min_level = logging.getLevelName(level.upper()) if level else 0
+        if not isinstance(min_level, int):
+            raise ValueError(f"Unknown log level: {level}")
+        with self.lock:
+            records = list(self.records)
+        matches = [r for r in records
+                   if r["seq"] > since
+                   and logging.getLevelName(r["level"]) >= min_level
+                   and (download_id is None or r.get("download_id") == download_id)
+                   and (logger_name is None or r["logger"].startswith(logger_name))
+                   and (contains is None or contains.lower() in r["message"].lower())]
+        return matches[-limit:] if limit else matches
+
+
+logger = logging.getLogger("cp4i")
+log_buffer = RingBufferHandler(LOG_BUFFER_SIZE)
+
+
+def _configure_logging():
+    """Attach the JSON console handler and the in-memory ring buffer once"""
+    if getattr(logger, "_cp4i_configured", False):
+        return
+    rate_limit = RateLimitFilter(LOG_RATE_LIMIT_SECONDS)
+    console = logging.StreamHandler()
+    console.setFormatter(JsonLogFormatter())
+    for handler in (console, log_buffer):
+        handler.addFilter(rate_limit)
+        logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    logger._cp4i_configured = True
+
+
+_configure_logging()
+
+
+def job_logger(download_id, name="cp4i.manager"):
+    """Logger that tags every record with the download it belongs to"""
+    return logging.LoggerAdapter(logging.getLogger(name), {"download_id": download_id})
+
+
+def _parse_size(size_str):
+    """Parse a human readable size such as '~15GB' into bytes"""
+    match = re.match(r'~?\s*([\d.]+)\s*([KMGT]?)i?B?', str(size_str or "").strip(), re.IGNORECASE)
+    if not match:
+        return None
+    units = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    return int(float(match.group(1)) * units[match.group(2).upper()])
+
+
+def _format_bytes(num_bytes):
+    """Format a byte count for display"""
+    if num_bytes is None:
+        return "N/A"
+    value = float(num_bytes)
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(value) < 1024:
+            return f"{value:.2f} {unit}" if unit != "B" else f"{int(value)} B"
+        value /= 1024
+    return f"{value:.2f} TB"
+
+
+def _version_key(version):
+    """Sort key ordering versions naturally, so 16.1.10 sorts after 16.1.9"""
+    return [(0, int(part), "") if part.isdigit() else (1, 0, part)
+            for part in re.split(r'[.\-+]', str(version))]
+
+
+def _dir_size_bytes(path):
+    """Return the apparent size of a directory tree in bytes"""
+    total = 0
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+    return total
+
+
+def _file_size(path):
+    """Size of a file in bytes, 0 if it does not exist"""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _existing_parent(path):
+    """Walk up from path to the closest directory that exists"""
+    path = os.path.abspath(path or HOME_DIR)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def _remove_file(path):
+    """Delete a file if it exists; returns the bytes it used"""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return 0
+    return size
+
+
+def _hardlink_tree(src, dst, rename=None, copy=False):
+    """Recreate the tree under src at dst with hard links; returns the number of files linked
+
+    Files already present at dst are left alone. rename=(old, new) renames
+    top-level files starting with old, such as a source download's log and its
+    sidecars. With copy, files are copied instead, for a tree that another
+    process will write into. On failure, e.g. src and dst on different
+    filesystems, whatever was created is removed again and the OSError is raised.
+    """
+    created_dirs, created_files = [], []
+    missing = os.path.abspath(dst)
+    while not os.path.exists(missing):
+        created_dirs.insert(0, missing)
+        missing = os.path.dirname(missing)
+    try:
+        for root, dirs, files in os.walk(src):
+            relative = os.path.relpath(root, src)
+            target_root = os.path.abspath(os.path.join(dst, relative))
+            if not os.path.isdir(target_root):
+                os.makedirs(target_root)
+                if target_root not in created_dirs:
+                    created_dirs.append(target_root)
+            for filename in files:
+                target_name = filename
+                if rename and relative == "." and filename.startswith(rename[0]):
+                    target_name = rename[1] + filename[len(rename[0]):]
+                target = os.path.join(target_root, target_name)
+                if copy:
+                    if os.path.lexists(target):
+                        continue
+                    created_files.append(target)
+                    shutil.copy2(os.path.join(root, filename), target, follow_symlinks=False)
+                    continue
+                try:
+                    os.link(os.path.join(root, filename), target, follow_symlinks=False)
+                    created_files.append(target)
+                except FileExistsError:
+                    pass
+    except OSError:
+        for path in reversed(created_files):
             try:
-                start_dt = datetime.fromisoformat(start_time)
-                end_dt = datetime.fromisoformat(end_time)
-                duration = str(end_dt - start_dt)
-                duration_seconds = (end_dt - start_dt).total_seconds()
-            except:
-                duration = "N/A"
-                duration_seconds = 0
+                os.remove(path)
+            except OSError:
+                pass
+        for path in reversed(created_dirs):
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+        raise
+    return len(created_files)
+
+
+class CapacityPlanner:
+    """Estimates disk usage per job and reserves space across concurrent jobs"""
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def estimate_bytes(self, component, version, filter_pattern=None, dry_run=False):
+        """Estimate the bytes a job will write, returning (bytes, source)"""
+        if dry_run:
+            return DRY_RUN_ESTIMATE_BYTES, "dry_run"
+
+        # Prefer sizes from previous completed runs of the same job
+        exact = run_metrics.completed_sizes(component, version, filter_pattern)
+        same_component = run_metrics.completed_sizes(component)
+
+        if exact:
+            return int(max(exact[-5:]) * ESTIMATE_SAFETY_FACTOR), "history"
+        if same_component and not filter_pattern:
+            return int(max(same_component[-5:]) * ESTIMATE_SAFETY_FACTOR), "history_component"
+
+        for comp in DEFAULT_COMPONENTS:
+            if comp["name"] == component:
+                typical = _parse_size(comp.get("typical_size"))
+                if typical:
+                    return int(typical * ESTIMATE_SAFETY_FACTOR), "catalog"
+
+        return DEFAULT_ESTIMATE_BYTES, "default"
+
+    def filesystem_of(self, home_dir):
+        """Return (device id, mount probe path) for the filesystem holding home_dir"""
+        probe = _existing_parent(home_dir)
+        return os.stat(probe).st_dev, probe
+
+    def free_bytes(self, home_dir):
+        """Free bytes available to unprivileged writers on home_dir's filesystem"""
+        _, probe = self.filesystem_of(home_dir)
+        return shutil.disk_usage(probe).free
+
+    def outstanding_bytes(self, download):
+        """Bytes a started job is still expected to write"""
+        return max(0, download.get("estimated_bytes", 0) - download.get("written_bytes", 0))
+
+    def reserved_bytes(self, device, exclude_id=None):
+        """Total outstanding reservations of running or paused jobs on a filesystem
+
+        Caller must hold the manager lock.
+        """
+        reserved = 0
+        for download_id, download in self.manager.downloads.items():
+            if download_id == exclude_id or download.get("status") == "queued":
+                continue
+            if download.get("fs_device") != device:
+                continue
+            reserved += self.outstanding_bytes(download)
+        return reserved
+
+    def check_fit(self, home_dir, estimated_bytes, exclude_id=None):
+        """Check whether a job of estimated_bytes fits next to current reservations
+
+        Caller must hold the manager lock.
+        """
+        device, _ = self.filesystem_of(home_dir)
+        free = self.free_bytes(home_dir)
+        reserved = self.reserved_bytes(device, exclude_id)
+        available = free - reserved - DISK_HEADROOM_BYTES
+        return {
+            "fits": estimated_bytes <= available,
+            "free_bytes": free,
+            "reserved_bytes": reserved,
+            "headroom_bytes": DISK_HEADROOM_BYTES,
+            "available_bytes": max(0, available),
+            "required_bytes": estimated_bytes,
+            "fs_device": device
+        }
+
+
+# Script log lines look like "[2024-01-01 10:00:00] [INFO] message"
+SCRIPT_LOG_LINE = re.compile(r'^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\] \[(\w+)\] (.*)$')
+
+# Messages logged by cp4i_downloader.sh when it enters each phase
+PHASE_MARKERS = [
+    ("prerequisites", "Validating prerequisites"),
+    ("authentication", "Authenticating to IBM registry"),
+    ("ibm_pak_get", "Fetching operator:"),
+    ("manifest_generation", "Generating mirror manifests"),
+    ("mirror", "Starting image mirror process"),
+    ("mirror", "Simulating image mirror process"),
+    ("mirror", "Resuming mirror from:"),
+]
+PHASE_END_MARKERS = ("info: Mirroring completed", "Image mirror simulation completed")
+# Dry runs prefix their messages, e.g. "[Dry Run Mode] Simulating image mirror process..."
+DRY_RUN_PREFIX = re.compile(r'^\[Dry Run(?: Mode)?\] ', re.I)
+
+RUN_METRICS_FILE = os.environ.get("CP4I_METRICS_FILE", os.path.join(HOME_DIR, ".cp4i-run-metrics.jsonl"))
+IMAGE_SIZE_CACHE_FILE = os.environ.get("CP4I_IMAGE_SIZE_CACHE", os.path.join(HOME_DIR, ".cp4i-image-sizes.json"))
+PLAN_IMAGE_LIMIT = 500  # images listed in a plan response
+MAPPING_SOURCE_FILE = "mapping-source.json"  # filter and CASE digest, written by the script next to the mapping
+
+
+def _percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers"""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    rank = (len(values) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def _mapping_file_path(home_dir, component, version):
+    """Path of the ibm-pak mapping file used by oc image mirror"""
+    return os.path.join(home_dir, ".ibm-pak", "data", "mirror", component, version,
+                        "images-mapping-to-filesystem.txt")
+
+
+def _case_digest(home_dir, component, version):
+    """Digest of the CASE files ibm-pak fetched for a version, computed as cp4i_downloader.sh records it
+
+    Returns None when the CASE directory does not exist.
+    """
+    case_dir = os.path.join(home_dir, ".ibm-pak", "data", "cases", component, version)
+    if not os.path.isdir(case_dir):
+        return None
+    paths = []
+    for root, _, files in os.walk(case_dir):
+        paths.extend("./" + os.path.relpath(os.path.join(root, name), case_dir) for name in files
+                     if not os.path.islink(os.path.join(root, name)))
+    listing = hashlib.sha256()
+    for path in sorted(paths, key=os.fsencode):
+        file_hash = hashlib.sha256()
+        with open(os.path.join(case_dir, path), 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                file_hash.update(block)
+        listing.update(f"{file_hash.hexdigest()}  {path}\n".encode())
+    return listing.hexdigest()
+
+
+def _final_registry_target(destination, final_registry):
+    """Where an image mirrored to file://<prefix>/<path> lands once pushed to the final registry"""
+    path = destination.split("://", 1)[-1]
+    return f"{final_registry.rstrip('/')}/{path.split('/', 1)[-1]}"
+
+
+# oc image mirror output, matched only after a cheap prefix check on each line
+MIRROR_BLOB_LINE = re.compile(r'^(?:uploading|mounted): (\S+) (sha256:[0-9a-f]+) ([\d.]+)\s*([KMGT]?i?B)\b')
+MIRROR_MANIFEST_LINE = re.compile(r'^sha256:[0-9a-f]{64} (\S+)')
+MIRROR_PLANNED_IMAGE_LINE = re.compile(r'^\s+(\S+) (\S+) blobs=(\d+) mounts=\d+ manifests=(\d+)')
+MIRROR_IMAGE_ERROR_LINE = re.compile(
+    r'^error: unable to (?:retrieve source image|push manifest to|upload blob \S+ to|copy|read image|push) (\S+?):? (.*)$')
+MIRROR_PID_LINE = re.compile(r'Image mirroring started.*\(PID:\s*(\d+)\)')
+MIRROR_EXIT_LINE = re.compile(r'^oc image mirror failed with exit code (\d+)')
+SIZE_UNITS = {"B": 1, "KB": 1000, "MB": 1000**2, "GB": 1000**3, "TB": 1000**4,
+              "KIB": 1024, "MIB": 1024**2, "GIB": 1024**3, "TIB": 1024**4}
+
+
+class EventKind:
+    """Kinds of events parsed from download logs"""
+    PHASE = "phase"
+    IMAGE_STARTED = "image_started"
+    IMAGE_FINISHED = "image_finished"
+    IMAGE_FAILED = "image_failed"
+    BLOB_COPIED = "blob_copied"
+    MIRROR_COMPLETED = "mirror_completed"
+    FATAL_ERROR = "fatal_error"
+    ERROR = "error"
+    WARNING = "warning"
+    MIRROR_PID = "mirror_pid"
+    DRY_RUN = "dry_run"
+
+
+class LogEvent(NamedTuple):
+    """A typed event parsed from one line of a download log"""
+    kind: str
+    offset: int
+    message: str = ""
+    image: Optional[str] = None
+    size: Optional[int] = None
+    phase: Optional[str] = None
+    timestamp: Optional[str] = None
+    seq: int = 0
+
+    def to_dict(self):
+        return {k: v for k, v in self._asdict().items() if v is not None}
+
+
+def _error_signature(message, image=None):
+    """Message with image names, digests and numbers masked, so repeats of one cause match"""
+    if image:
+        message = message.replace(image, "<image>")
+    return ERROR_SIGNATURE_MASK.sub("#", message)[:200]
+
+
+class ErrorIndex:
+    """Byte offsets of the errors and warnings in a log, grouped into distinct causes
+
+    Entries are kept up to ERROR_INDEX_MAX_ENTRIES; causes keep counting after
+    that, so the report can still list every distinct failure. Messages beyond
+    ERROR_INDEX_MAX_CAUSES distinct causes share one "other" cause per severity,
+    whose failure class is MIXED and which counts the class of each message.
+    """
+    KINDS = (EventKind.FATAL_ERROR, EventKind.IMAGE_FAILED, EventKind.ERROR, EventKind.WARNING)
+    MIXED = "mixed"
+
+    def __init__(self):
+        self.entries = []
+        self.dropped = 0
+        self.causes = {}
+
+    def add(self, event):
+        severity = "warning" if event.kind == EventKind.WARNING else "error"
+        signature = _error_signature(event.message, event.image)
+        cause = self.causes.get(signature)
+        if cause is None and len(self.causes) >= ERROR_INDEX_MAX_CAUSES:
+            signature = f"other {severity}s"
+            cause = self.causes.get(signature)
+            if cause is None:
+                cause = self.causes[signature] = {
+                    "id": len(self.causes) + 1,
+                    "signature": signature,
+                    "severity": severity,
+                    "failure_class": self.MIXED if severity == "error" else None,
+                    "failure_classes": {},
+                    "count": 0,
+                    "first_offset": event.offset,
+                    "example": f"{severity.capitalize()}s beyond the first {ERROR_INDEX_MAX_CAUSES} distinct causes",
+                    "images": []
+                }
+        elif cause is None:
+            cause = self.causes[signature] = {
+                "id": len(self.causes) + 1,
+                "signature": signature,
+                "severity": severity,
+                "failure_class": classify_failure_message(event.message) if severity == "error" else None,
+                "count": 0,
+                "first_offset": event.offset,
+                "example": event.message[:500],
+                "images": []
+            }
+        failure_class = cause["failure_class"]
+        if failure_class == self.MIXED:
+            failure_class = classify_failure_message(event.message)
+            cause["failure_classes"][failure_class] = cause["failure_classes"].get(failure_class, 0) + 1
+        cause["count"] += 1
+        cause["last_offset"] = event.offset
+        if event.image and event.image not in cause["images"] and len(cause["images"]) < 20:
+            cause["images"].append(event.image)
+        if len(self.entries) >= ERROR_INDEX_MAX_ENTRIES:
+            self.dropped += 1
+            return
+        self.entries.append({
+            "seq": event.seq,
+            "offset": event.offset,
+            "kind": event.kind,
+            "severity": severity,
+            "failure_class": failure_class,
+            "cause": cause["id"],
+            "image": event.image,
+            "timestamp": event.timestamp,
+            "message": event.message[:500]
+        })
+
+    def distinct_causes(self, severity=None):
+        """Causes, most severe failure class first, then in order of first appearance; mixed causes last"""
+        causes = [c for c in self.causes.values() if severity is None or c["severity"] == severity]
+        order = FailureClass.SEVERITY + (self.MIXED,)
+        return sorted(causes, key=lambda c: (c["severity"] != "error",
+                                             order.index(c["failure_class"] or FailureClass.UNKNOWN),
+                                             c["first_offset"]))
+
+    def query(self, severity=None, cause=None, failure_class=None, since=0, limit=100):
+        """Entries after seq `since` matching the filters"""
+        matched = [e for e in self.entries if e["seq"] > since
+                   and (severity is None or e["severity"] == severity)
+                   and (cause is None or e["cause"] == cause)
+                   and (failure_class is None or e["failure_class"] == failure_class)]
+        return matched[:limit]
+
+    def to_dict(self):
+        return {"entries": self.entries, "dropped": self.dropped, "causes": list(self.causes.values())}
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls()
+        index.entries = data.get("entries", [])
+        index.dropped = data.get("dropped", 0)
+        index.causes = {c["signature"]: c for c in data.get("causes", [])}
+        return index
+
+
+class LogEventParser:
+    """Single-pass parser turning script and oc image mirror log lines into events
+
+    Feed raw bytes as they are appended to the log; partial lines are buffered
+    until their newline arrives. Aggregate state (phase, image counts, failures,
+    bytes copied) is maintained as events are produced.
+    """
+
+    def __init__(self, base_offset=0, keep_events=500):
+        self.offset = base_offset
+        self._partial = b""
+        self.seq = 0
+        self.events = deque(maxlen=keep_events)
+        self.phase = None
+        self.phase_boundaries = []  # (phase or None for end, datetime)
+        self.images_planned = {}
+        self.images_finished = 0
+        self.failed_images = {}
+        self.blobs_copied = 0
+        self.bytes_copied = 0
+        self.image_bytes = {}
+        self.errors = 0
+        self.warnings = 0
+        self.fatal_error = None
+        self.mirror_errors = 0  # errors logged during the mirror phase
+        self.first_mirror_error = None
+        self.mirror_completed = False
+        self.dry_run = False
+        self.mirror_pid = None
+        self.last_line = ""
+        self.error_index = ErrorIndex()
+
+    def feed(self, data):
+        """Parse a chunk of raw log bytes and return the events it produced"""
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        events = []
+        parse_line = self.parse_line
+        offset = self.offset
+        for raw in lines:
+            event = parse_line(raw.decode("utf-8", "replace"), offset)
+            offset += len(raw) + 1
+            if event is not None:
+                events.append(event)
+        self.offset = offset
+        return events
+
+    def finish(self):
+        """Parse a trailing line without newline, e.g. once the writer has exited"""
+        if not self._partial:
+            return []
+        raw, self._partial = self._partial, b""
+        event = self.parse_line(raw.decode("utf-8", "replace"), self.offset)
+        self.offset += len(raw)
+        return [event] if event is not None else []
+
+    def _emit(self, kind, offset, message="", **fields):
+        self.seq += 1
+        event = LogEvent(kind, offset, message, seq=self.seq, **fields)
+        self.events.append(event)
+        if kind in ErrorIndex.KINDS:
+            self.error_index.add(event)
+        return event
+
+    def parse_line(self, line, offset):
+        """Parse one log line, update aggregate state and return an event or None"""
+        line = line.rstrip("\r")
+        if not line:
+            return None
+        self.last_line = line
+        first = line[0]
+
+        if first == "[":
+            match = SCRIPT_LOG_LINE.match(line)
+            if not match:
+                if DRY_RUN_PREFIX.match(line):
+                    self.dry_run = True
+                return None
+            return self._parse_script_line(match.group(1), match.group(2), match.group(3), offset)
+
+        if first == "s" and line.startswith("sha256:"):
+            match = MIRROR_MANIFEST_LINE.match(line)
+            if match:
+                self.images_finished += 1
+                return self._emit(EventKind.IMAGE_FINISHED, offset, line, image=match.group(1))
+            return None
+
+        if first in "um" and (line.startswith("uploading: ") or line.startswith("mounted: ")):
+            match = MIRROR_BLOB_LINE.match(line)
+            if match:
+                size = int(float(match.group(3)) * SIZE_UNITS.get(match.group(4).upper(), 1))
+                self.blobs_copied += 1
+                self.bytes_copied += size
+                image = match.group(1)
+                self.image_bytes[image] = self.image_bytes.get(image, 0) + size
+                return self._emit(EventKind.BLOB_COPIED, offset, line, image=image, size=size)
+            return None
+
+        if first == "e" and line.startswith("error:"):
+            return self._parse_mirror_error(line, offset)
+
+        if first == "i" and line.startswith("info: Mirroring completed"):
+            return self._mirror_finished(offset, line)
+
+        # "warning: ..." from oc, or klog style "W1019 12:00:00.000000 ..." lines
+        if (first == "w" and line.startswith("warning:")) or (first == "W" and line[1:5].isdigit()):
+            self.warnings += 1
+            return self._emit(EventKind.WARNING, offset, line)
+
+        if first in " \t" and "blobs=" in line:
+            match = MIRROR_PLANNED_IMAGE_LINE.match(line)
+            if match:
+                image = f"{match.group(1)}/{match.group(2)}"
+                self.images_planned[image] = int(match.group(4))
+                return self._emit(EventKind.IMAGE_STARTED, offset, line.strip(), image=image)
+        return None
+
+    def _parse_script_line(self, timestamp, level, message, offset):
+        """Handle a timestamped line written by cp4i_downloader.sh"""
+        prefix = DRY_RUN_PREFIX.match(message)
+        if prefix:
+            self.dry_run = True
+            message = message[prefix.end():]
+        for phase, marker in PHASE_MARKERS:
+            if message.startswith(marker):
+                self.phase = phase
+                self.phase_boundaries.append((phase, datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")))
+                if "Simulating" in marker:
+                    self.dry_run = True
+                return self._emit(EventKind.PHASE, offset, message, phase=phase, timestamp=timestamp)
+        if message.startswith(PHASE_END_MARKERS):
+            self.phase_boundaries.append((None, datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")))
+            return self._mirror_finished(offset, message, timestamp)
+        if level == "ERROR" and MIRROR_EXIT_LINE.match(message) and not self.fatal_error:
+            self.errors += 1
+            self.fatal_error = message
+            return self._emit(EventKind.FATAL_ERROR, offset, message, timestamp=timestamp, phase=self.phase)
+        if "(PID:" in message:
+            match = MIRROR_PID_LINE.search(message)
+            if match:
+                self.mirror_pid = int(match.group(1))
+                return self._emit(EventKind.MIRROR_PID, offset, message, timestamp=timestamp)
+        if level == "ERROR":
+            self.errors += 1
+            if self.phase == "mirror":
+                self._mirror_error(message)
+            return self._emit(EventKind.ERROR, offset, message, timestamp=timestamp, phase=self.phase)
+        if level == "WARN":
+            self.warnings += 1
+            return self._emit(EventKind.WARNING, offset, message, timestamp=timestamp, phase=self.phase)
+        return None
+
+    def _mirror_error(self, message):
+        self.mirror_errors += 1
+        self.first_mirror_error = self.first_mirror_error or message
+
+    def _mirror_finished(self, offset, message, timestamp=None):
+        """A completion message (from oc, then from the script): success only if the mirror logged no errors"""
+        if self.fatal_error or self.mirror_completed:
+            return None
+        if self.mirror_errors:
+            # The script logs completion after oc exits, whatever oc reported
+            self.fatal_error = f"Mirror finished with {self.mirror_errors} errors, first: {self.first_mirror_error}"
+            return self._emit(EventKind.FATAL_ERROR, offset, self.fatal_error, timestamp=timestamp, phase=self.phase)
+        self.mirror_completed = True
+        return self._emit(EventKind.MIRROR_COMPLETED, offset, message, timestamp=timestamp)
+
+    def _parse_mirror_error(self, line, offset):
+        """Classify an 'error:' line from oc image mirror"""
+        self.errors += 1
+        if self.phase == "mirror":
+            self._mirror_error(line)
+        if line.startswith("error: one or more errors occurred"):
+            self.fatal_error = line
+            return self._emit(EventKind.FATAL_ERROR, offset, line, phase=self.phase)
+        match = MIRROR_IMAGE_ERROR_LINE.match(line)
+        if match:
+            image = match.group(1)
+            self.failed_images.setdefault(image, line)
+            return self._emit(EventKind.IMAGE_FAILED, offset, line, image=image, phase=self.phase)
+        return self._emit(EventKind.ERROR, offset, line, phase=self.phase)
+
+    def phase_durations(self, end_time=None):
+        """Seconds spent in each phase, the last one running until end_time"""
+        boundaries = list(self.phase_boundaries)
+        if end_time:
+            try:
+                boundaries.append((None, datetime.fromisoformat(end_time)))
+            except ValueError:
+                pass
+        phases = {}
+        for (phase, started), (_, ended) in zip(boundaries, boundaries[1:]):
+            if phase is None:
+                continue
+            phases[phase] = phases.get(phase, 0) + max(0.0, (ended - started).total_seconds())
+        return phases
+
+    def state(self):
+        """Summary of the mirror as seen so far"""
+        return {
+            "phase": self.phase,
+            "images_planned": len(self.images_planned),
+            "images_finished": self.images_finished,
+            "images_failed": len(self.failed_images),
+            "failed_images": [{"image": image, "error": message}
+                              for image, message in list(self.failed_images.items())[:50]],
+            "blobs_copied": self.blobs_copied,
+            "bytes_copied": self.bytes_copied,
+            "errors": self.errors,
+            "warnings": self.warnings,
+            "fatal_error": self.fatal_error,
+            "mirror_completed": self.mirror_completed,
+            "dry_run": self.dry_run,
+            "last_event_seq": self.seq
+        }
+
+
+class LogFollower:
+    """Reads only the bytes appended to a log since the last poll and parses them"""
+
+    READ_CHUNK = 4 * 1024 * 1024
+
+    def __init__(self, path, start_offset=0):
+        self.path = path
+        self.parser = LogEventParser(start_offset)
+
+    def poll(self, final=False):
+        """Parse newly appended log content and return the resulting events"""
+        events = []
+        try:
+            with open(self.path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < self.parser.offset:
+                    # Log was truncated or replaced, start over from the beginning
+                    self.parser = LogEventParser(0)
+                f.seek(self.parser.offset + len(self.parser._partial))
+                while True:
+                    chunk = f.read(self.READ_CHUNK)
+                    if not chunk:
+                        break
+                    LOG_READ_BYTES.inc(len(chunk), reader="monitor")
+                    events.extend(self.parser.feed(chunk))
+        except FileNotFoundError:
+            pass
+        if final:
+            events.extend(self.parser.finish())
+        return events
+
+
+class LogArchive:
+    """Random-access reads of a download log, whether plain or archived
+
+    Finished logs are archived as `<log>.gz`: independent gzip members of
+    about LOG_ARCHIVE_BLOCK_SIZE uncompressed bytes, each ending on a line
+    boundary, so the archive still works with zcat. `<log>.gz.idx` holds the
+    uncompressed and compressed offset of every member, so range and tail
+    reads only decompress the blocks they touch. A plain log, when present,
+    always wins over an archive.
+    """
+    SUFFIX = ".gz"
+    INDEX_SUFFIX = ".gz.idx"
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.archive_file = log_file + self.SUFFIX
+        self.index_file = log_file + self.INDEX_SUFFIX
+        self.index = None
+        if not os.path.exists(log_file):
+            try:
+                with open(self.index_file, 'r') as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    @property
+    def archived(self):
+        return self.index is not None
+
+    def exists(self):
+        return self.archived or os.path.exists(self.log_file)
+
+    def size(self):
+        """Uncompressed size in bytes"""
+        return self.index["size"] if self.archived else _file_size(self.log_file)
+
+    def stored_size(self):
+        """Bytes the log takes on disk"""
+        return _file_size(self.archive_file) if self.archived else _file_size(self.log_file)
+
+    def _blocks(self, first=0, reverse=False):
+        """Yield (uncompressed offset, data) for each block from index `first`"""
+        if not self.archived:
+            size = _file_size(self.log_file)
+            offsets = range(first * LOG_ARCHIVE_BLOCK_SIZE, size, LOG_ARCHIVE_BLOCK_SIZE)
+            with open(self.log_file, 'rb') as f:
+                for offset in (reversed(offsets) if reverse else offsets):
+                    f.seek(offset)
+                    yield offset, f.read(LOG_ARCHIVE_BLOCK_SIZE)
+            return
+        blocks = self.index["blocks"][first:]
+        with open(self.archive_file, 'rb') as f:
+            for offset, compressed_offset, compressed_length in (reversed(blocks) if reverse else blocks):
+                f.seek(compressed_offset)
+                yield offset, gzip.decompress(f.read(compressed_length))
+
+    def _block_containing(self, offset):
+        if not self.archived:
+            return offset // LOG_ARCHIVE_BLOCK_SIZE
+        return max(bisect.bisect_right([b[0] for b in self.index["blocks"]], offset) - 1, 0)
+
+    def read(self, offset=0, length=None):
+        """Bytes from offset, up to length (the rest of the log when None)"""
+        end = self.size() if length is None else offset + length
+        parts = []
+        for block_offset, data in self._blocks(self._block_containing(offset)):
+            if block_offset >= end:
+                break
+            parts.append(data[max(offset - block_offset, 0):end - block_offset])
+        return b"".join(parts)
+
+    def chunks(self, offset=0):
+        """Yield the log's bytes from offset onwards, one block at a time"""
+        for block_offset, data in self._blocks(self._block_containing(offset)):
+            yield data[max(offset - block_offset, 0):]
+
+    def tail(self, lines):
+        """The last `lines` lines, with their line endings"""
+        data = b""
+        for _, block in self._blocks(reverse=True):
+            data = block + data
+            if data.count(b"\n") > lines:
+                break
+        return data.decode('utf-8', errors='replace').splitlines(keepends=True)[-lines:]
+
+
+def _archive_log(log_file):
+    """Write the block-compressed archive and index of a finished log, leaving the log in place
+
+    Returns (log bytes, archive bytes), or None if the log is too small to be worth it.
+    """
+    size = _file_size(log_file)
+    if size < LOG_ARCHIVE_MIN_BYTES:
+        return None
+    archive = LogArchive(log_file)
+    blocks, offset, compressed_offset = [], 0, 0
+    with open(log_file, 'rb') as src, open(f"{archive.archive_file}.tmp", 'wb') as dst:
+        while True:
+            data = src.read(LOG_ARCHIVE_BLOCK_SIZE)
+            if not data:
+                break
+            if not data.endswith(b"\n"):
+                data += src.readline(LOG_ARCHIVE_BLOCK_SIZE)
+            member = gzip.compress(data, compresslevel=LOG_ARCHIVE_LEVEL, mtime=0)
+            dst.write(member)
+            blocks.append([offset, compressed_offset, len(member)])
+            offset += len(data)
+            compressed_offset += len(member)
+    with open(f"{archive.index_file}.tmp", 'w') as f:
+        json.dump({"version": 1, "size": offset, "blocks": blocks}, f)
+    os.replace(f"{archive.archive_file}.tmp", archive.archive_file)
+    os.replace(f"{archive.index_file}.tmp", archive.index_file)
+    return offset, compressed_offset
+
+
+def _discard_log_archive(log_file):
+    """Remove a log's archive and index"""
+    for suffix in (LogArchive.SUFFIX, LogArchive.INDEX_SUFFIX):
+        try:
+            os.remove(log_file + suffix)
+        except FileNotFoundError:
+            pass
+
+
+# Serialises restoring archived logs with the archiver dropping plain logs
+_log_archive_lock = threading.Lock()
+
+
+def _restore_log(log_file):
+    """Turn an archived log back into a plain file, so a new run can append to it"""
+    with _log_archive_lock:
+        archive = LogArchive(log_file)
+        if archive.archived:
+            with open(f"{log_file}.tmp", 'wb') as f:
+                for data in archive.chunks():
+                    f.write(data)
+            os.replace(f"{log_file}.tmp", log_file)
+        _discard_log_archive(log_file)
+
+
+def _log_context(archive, offset, lines):
+    """Up to `lines` lines before and after the log line starting at offset"""
+    window = ERROR_CONTEXT_LINE_BYTES * (lines + 1)
+    start = max(offset - window, 0)
+    before = archive.read(start, offset - start).decode('utf-8', errors='replace').splitlines()
+    after = archive.read(offset, window).decode('utf-8', errors='replace').splitlines()
+    return {"before": before[-lines:], "line": after[0] if after else "", "after": after[1:lines + 1]}
+
+
+def _save_error_index(log_file, parser, start_offset=0):
+    """Write a finished log's error index next to the log"""
+    try:
+        with open(f"{log_file}{ERROR_INDEX_SUFFIX}.tmp", 'w') as f:
+            json.dump({"log_size": parser.offset, "start_offset": start_offset, **parser.error_index.to_dict()}, f)
+        os.replace(f"{log_file}{ERROR_INDEX_SUFFIX}.tmp", f"{log_file}{ERROR_INDEX_SUFFIX}")
+    except OSError as e:
+        logging.getLogger("cp4i.logs").warning("Could not save error index for %s: %s", log_file, e)
+
+
+def _load_error_index(log_file, start_offset=0):
+    """Error index of a finished log: the saved one while it matches the log, else rebuilt by parsing it"""
+    archive = LogArchive(log_file)
+    if not archive.exists():
+        return None
+    try:
+        with open(f"{log_file}{ERROR_INDEX_SUFFIX}", 'r') as f:
+            data = json.load(f)
+        if data.get("log_size") == archive.size():
+            return ErrorIndex.from_dict(data)
+    except (OSError, ValueError, KeyError):
+        pass
+    parser = _parse_log_file(log_file, start_offset)
+    _save_error_index(log_file, parser, start_offset)
+    return parser.error_index
+
+
+def _parse_log_file(log_file, start_offset=0):
+    """Run the event parser over a whole log file and return the parser"""
+    parser = LogEventParser(start_offset)
+    archive = LogArchive(log_file) if log_file else None
+    if archive and archive.exists():
+        for chunk in archive.chunks(start_offset):
+            parser.feed(chunk)
+        parser.finish()
+    return parser
+
+
+
+class FailureClass:
+    """Causes of a failed mirror, from most to least severe"""
+    DISK_FULL = "disk_full"
+    AUTH = "auth"
+    MANIFEST_MISSING = "manifest_missing"
+    TRANSIENT_NETWORK = "transient_network"
+    HUNG = "hung"  # killed after no IO progress for HUNG_TIMEOUT
+    UNKNOWN = "unknown"
+
+    SEVERITY = (DISK_FULL, AUTH, MANIFEST_MISSING, TRANSIENT_NETWORK, HUNG, UNKNOWN)
+    RETRYABLE = (TRANSIENT_NETWORK, HUNG)
+
+
+FAILURE_PATTERNS = [
+    (FailureClass.DISK_FULL, re.compile(
+        r"no space left on device|disk quota exceeded|insufficient disk space", re.I)),
+    (FailureClass.AUTH, re.compile(
+        r"unauthorized|authentication required|authentication failed|access denied|denied:|"
+        r"\b40[13]\b|forbidden|invalid username/password", re.I)),
+    (FailureClass.MANIFEST_MISSING, re.compile(
+        r"manifest unknown|name unknown|manifest (?:\S+ )?not found|\b404 not found", re.I)),
+    (FailureClass.TRANSIENT_NETWORK, re.compile(
+        r"\b429\b|too many requests|toomanyrequests|\b50[0234]\b|bad gateway|service unavailable|"
+        r"gateway time-?out|internal server error|tls handshake|connection reset|connection refused|"
+        r"broken pipe|i/o timeout|timeout exceeded|context deadline exceeded|unexpected eof|"
+        r"temporary failure|no route to host|network is unreachable", re.I)),
+]
+
+
+def classify_failure_message(message):
+    """Failure class of a single error message"""
+    for failure_class, pattern in FAILURE_PATTERNS:
+        if pattern.search(message):
+            return failure_class
+    return FailureClass.UNKNOWN
+
+
+def classify_failure(parser, output_lines=()):
+    """Classify a failed mirror from its parsed log and script output
+
+    Returns the overall (most severe) failure class and the class of each
+    failed image.
+    """
+    images = {image: classify_failure_message(message) for image, message in parser.failed_images.items()}
+    classes = set(images.values())
+    for cause in parser.error_index.distinct_causes("error"):
+        if cause["failure_class"] == ErrorIndex.MIXED:
+            classes.update(cause["failure_classes"])
+        else:
+            classes.add(cause["failure_class"])
+    classes.discard(FailureClass.UNKNOWN)
+    for message in (line for line in output_lines if "error" in line.lower()):
+        failure_class = classify_failure_message(message)
+        if failure_class != FailureClass.UNKNOWN:
+            classes.add(failure_class)
+    if not classes:
+        return FailureClass.UNKNOWN, images
+    return min(classes, key=FailureClass.SEVERITY.index), images
+
+
+def _image_repository(ref):
+    """Repository part of an image reference, without scheme, tag or digest"""
+    ref = ref.split("://", 1)[-1].split("@", 1)[0]
+    name, _, tag = ref.rpartition(":")
+    return name if name and "/" not in tag else ref
+
+
+def _write_retry_mapping(mapping_file, images, target):
+    """Write the mapping lines for the given images to target; returns the number of lines"""
+    wanted = {_image_repository(image) for image in images}
+    count = 0
+    with open(mapping_file) as src, open(target, "w") as dst:
+        for line in src:
+            if not line.strip() or line.startswith("#"):
+                continue
+            repos = {_image_repository(ref) for ref in line.strip().split("=", 1)}
+            if any(repo == want or repo.endswith("/" + want) or want.endswith("/" + repo)
+                   for repo in repos for want in wanted):
+                dst.write(line)
+                count += 1
+    return count
+
+class RunMetricsStore:
+    """Persists structured timing and throughput for every finished download"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.runs = None
+
+    def _load(self):
+        """Load recorded runs from disk on first use. Caller must hold the lock."""
+        if self.runs is not None:
+            return
+        self.runs = []
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    for line in f:
+                        line = line.strip()
+                        if line:
+                            try:
+                                self.runs.append(json.loads(line))
+                            except ValueError:
+                                pass
+            except OSError as e:
+                logging.getLogger("cp4i.metrics").warning("Could not load run metrics from %s: %s", self.path, e)
+
+    def record(self, run):
+        """Append a run record to memory and to the metrics file"""
+        with self.lock:
+            self._load()
+            self.runs.append(run)
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(run) + "\n")
+            except OSError as e:
+                logging.getLogger("cp4i.metrics").warning("Could not persist run metrics to %s: %s", self.path, e)
+
+    def all_runs(self):
+        """Return a snapshot of all recorded runs"""
+        with self.lock:
+            self._load()
+            return list(self.runs)
+
+    def completed_sizes(self, component, version=None, filter_pattern=None):
+        """Bytes written by completed real (non dry-run) runs, oldest first"""
+        return [r["bytes"] for r in self.all_runs()
+                if r.get("status") == "completed" and not r.get("dry_run") and r.get("bytes")
+                and r.get("component") == component
+                and (version is None or (r.get("version") == version
+                                         and (r.get("filter") or None) == (filter_pattern or None)))]
+
+    def median_throughput(self, component=None):
+        """Median bytes/sec of completed real runs of a component, falling back to all components"""
+        runs = [r for r in self.all_runs()
+                if r.get("status") == "completed" and not r.get("dry_run") and r.get("throughput_bytes_per_sec")]
+        for source, candidates in (("component", [r for r in runs if r.get("component") == component]),
+                                   ("all", runs)):
+            if candidates:
+                return _percentile([r["throughput_bytes_per_sec"] for r in candidates], 50), source
+        return None, None
+
+    def aggregate(self, component=None, version=None, status="completed", since=None, bucket="day",
+                  include_dry_run=False):
+        """Aggregate recorded runs into per component/version percentiles and a throughput trend"""
+        runs = []
+        for r in self.all_runs():
+            if component and r.get("component") != component:
+                continue
+            if version and r.get("version") != version:
+                continue
+            if status and status != "all" and r.get("status") != status:
+                continue
+            if r.get("dry_run") and not include_dry_run:
+                continue
+            if since and (r.get("end_time") or "") < since:
+                continue
+            runs.append(r)
+
+        groups = {}
+        for r in runs:
+            groups.setdefault((r.get("component"), r.get("version")), []).append(r)
+
+        by_component_version = []
+        for (comp, ver), group in sorted(groups.items(), key=lambda item: (str(item[0][0]), str(item[0][1]))):
+            durations = [r.get("duration_seconds") for r in group]
+            throughputs = [r.get("throughput_bytes_per_sec") for r in group]
+            phase_names = sorted({p for r in group for p in (r.get("phases") or {})})
+            latest = max(group, key=lambda r: r.get("end_time") or "")
+            duration_p50 = _percentile(durations, 50)
+            by_component_version.append({
+                "component": comp,
+                "version": ver,
+                "runs": len(group),
+                "duration_seconds": {"p50": duration_p50, "p95": _percentile(durations, 95)},
+                "throughput_bytes_per_sec": {"p50": _percentile(throughputs, 50),
+                                             "p95": _percentile(throughputs, 95)},
+                "bytes": {"p50": _percentile([r.get("bytes") for r in group], 50),
+                          "max": max([r.get("bytes") or 0 for r in group])},
+                "images_total": {"p50": _percentile([r.get("images_total") for r in group], 50)},
+                "phases": {
+                    phase: {
+                        "p50": _percentile([(r.get("phases") or {}).get(phase) for r in group], 50),
+                        "p95": _percentile([(r.get("phases") or {}).get(phase) for r in group], 95)
+                    } for phase in phase_names
+                },
+                "latest": {
+                    "id": latest.get("id"),
+                    "end_time": latest.get("end_time"),
+                    "duration_seconds": latest.get("duration_seconds"),
+                    # > 1 means the latest run was slower than the typical one
+                    "duration_vs_p50": (latest["duration_seconds"] / duration_p50
+                                        if latest.get("duration_seconds") and duration_p50 else None)
+                }
+            })
+
+        trend_buckets = {}
+        for r in runs:
+            end = r.get("end_time")
+            if not end:
+                continue
+            try:
+                end_dt = datetime.fromisoformat(end)
+            except ValueError:
+                continue
+            if bucket == "week":
+                year, week, _ = end_dt.isocalendar()
+                key = f"{year}-W{week:02d}"
+            elif bucket == "month":
+                key = end_dt.strftime("%Y-%m")
+            else:
+                key = end_dt.strftime("%Y-%m-%d")
+            trend_buckets.setdefault(key, []).append(r)
+
+        trend = [{
+            "period": key,
+            "runs": len(group),
+            "bytes_total": sum(r.get("bytes") or 0 for r in group),
+            "duration_seconds_p50": _percentile([r.get("duration_seconds") for r in group], 50),
+            "throughput_bytes_per_sec_p50": _percentile([r.get("throughput_bytes_per_sec") for r in group], 50),
+            "throughput_bytes_per_sec_p95": _percentile([r.get("throughput_bytes_per_sec") for r in group], 95)
+        } for key, group in sorted(trend_buckets.items())]
+
+        return {
+            "runs": len(runs),
+            "bucket": bucket,
+            "by_component_version": by_component_version,
+            "trend": trend
+        }
+
+
+run_metrics = RunMetricsStore(RUN_METRICS_FILE)
+
+
+class ImageSizeCache:
+    """Bytes per mirrored repository learned from completed downloads, persisted as JSON"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.sizes = None
+
+    def _load(self):
+        """Load the cache from disk on first use. Caller must hold the lock."""
+        if self.sizes is not None:
+            return
+        self.sizes = {}
+        try:
+            with open(self.path, 'r') as f:
+                self.sizes = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.getLogger("cp4i.planner").warning("Could not load image sizes from %s: %s", self.path, e)
+
+    def lookup(self, repository):
+        """Estimated bytes of one image of a repository, or None if it was never mirrored"""
+        with self.lock:
+            self._load()
+            entry = self.sizes.get(repository)
+        return entry["bytes"] // entry["images"] if entry else None
+
+    def average(self):
+        """Mean bytes per image over every cached repository, or None when empty"""
+        with self.lock:
+            self._load()
+            images = sum(e["images"] for e in self.sizes.values())
+            return sum(e["bytes"] for e in self.sizes.values()) // images if images else None
+
+    def update(self, repo_bytes, repo_images):
+        """Record the bytes a completed download copied per repository"""
+        with self.lock:
+            self._load()
+            now = datetime.now().isoformat()
+            for repository, size in repo_bytes.items():
+                if size > 0:
+                    self.sizes[repository] = {"bytes": size, "images": max(1, repo_images.get(repository, 1)),
+                                              "updated": now}
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(self.sizes, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logging.getLogger("cp4i.planner").warning("Could not persist image sizes to %s: %s", self.path, e)
+
+
+image_sizes = ImageSizeCache(IMAGE_SIZE_CACHE_FILE)
+
+
+class MirrorPlanner:
+    """Previews what a download would mirror from the cached ibm-pak mapping file
+
+    Parsed mapping files are kept in memory until the file changes, so a plan
+    is a regex pass over a list and a few dictionary lookups.
+    """
+
+    def __init__(self, metrics, sizes):
+        self.metrics = metrics
+        self.sizes = sizes
+        self.lock = threading.Lock()
+        self._mapping_cache = {}
+
+    def mapping_entries(self, mapping_file):
+        """(source, destination, repository) for each line of a mapping file, or None if missing"""
+        try:
+            st = os.stat(mapping_file)
+        except OSError:
+            return None
+        signature = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            cached = self._mapping_cache.get(mapping_file)
+        if cached and cached[0] == signature:
+            return cached[1]
+        entries = []
+        with open(mapping_file, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#') or "=" not in line:
+                    continue
+                source, destination = line.split("=", 1)
+                entries.append((source, destination, _image_repository(destination)))
+        with self.lock:
+            self._mapping_cache[mapping_file] = (signature, entries)
+        return entries
+
+    def mapping_source(self, mapping_file, home_dir, component, version, filter_pattern):
+        """The filter and CASE digest a mapping file was generated from, and why it does not fit a request
+
+        ibm-pak applies --filter when generating the mapping file, and a CASE
+        fetched again may list other images, so a cached mapping only stands in
+        for a live dry run with the same filter and CASE. `mismatch` is None
+        when it does.
+        """
+        try:
+            with open(os.path.join(os.path.dirname(mapping_file), MAPPING_SOURCE_FILE), 'r') as f:
+                recorded = json.load(f)
+        except (OSError, ValueError):
+            recorded = None
+        current = _case_digest(home_dir, component, version)
+        source = {"filter": None, "case_digest": None, "current_case_digest": current, "mismatch": None}
+        if not isinstance(recorded, dict):
+            source["mismatch"] = "Mapping file has no record of the filter and CASE it was generated from"
+            return source
+        source.update(filter=recorded.get("filter") or None, case_digest=recorded.get("case_digest") or None,
+                      generated=recorded.get("generated"))
+        if source["filter"] != (filter_pattern or None):
+            source["mismatch"] = (f"Mapping file was generated with filter {source['filter'] or '(none)'}, "
+                                  f"not {filter_pattern or '(none)'}")
+        elif not source["case_digest"] or source["case_digest"] != current:
+            source["mismatch"] = "CASE has changed since the mapping file was generated"
+        return source
+
+    def repository_counts(self, mapping_file):
+        """Number of mapping lines per destination repository"""
+        counts = {}
+        for _, _, repository in self.mapping_entries(mapping_file) or ():
+            counts[repository] = counts.get(repository, 0) + 1
+        return counts
+
+    def plan(self, component, version, filter_pattern=None, home_dir=None, final_registry=None):
+        """Images a filter selects, with estimated bytes and duration, and their targets in final_registry"""
+        home_dir = home_dir or HOME_DIR
+        try:
+            pattern = re.compile(filter_pattern) if filter_pattern else None
+        except re.error as e:
+            return {"error": f"Invalid filter pattern: {e}", "invalid_filter": True}
+        
+        mapping_file = _mapping_file_path(home_dir, component, version)
+        entries = self.mapping_entries(mapping_file)
+        if entries is None:
+            return {"error": f"No cached mapping file for {component} {version}; run a dry run first",
+                    "mapping_missing": True, "mapping_file": mapping_file}
+        
+        matched = [e for e in entries if pattern is None or pattern.search(e[0]) or pattern.search(e[1])]
+        fallback = self.sizes.average() or (DEFAULT_ESTIMATE_BYTES // len(entries) if entries else 0)
+        images, estimated_bytes, unknown = [], 0, 0
+        for source, destination, repository in matched:
+            size = self.sizes.lookup(repository)
+            if size is None:
+                size, unknown = fallback, unknown + 1
+            estimated_bytes += size
+            if len(images) < PLAN_IMAGE_LIMIT:
+                images.append({"source": source, "destination": destination, "estimated_bytes": size})
+                if final_registry:
+                    images[-1]["target"] = _final_registry_target(destination, final_registry)
+        
+        throughput, throughput_source = self.metrics.median_throughput(component)
+        warnings = []
+        if not matched:
+            warnings.append("Filter matches no images")
+        elif pattern is not None and len(matched) == len(entries):
+            warnings.append("Filter matches every image")
+        if unknown:
+            warnings.append(f"{unknown} images have no cached size, estimated from the average image size")
+        mapping_updated = datetime.fromtimestamp(os.path.getmtime(mapping_file)).isoformat()
+        source = self.mapping_source(mapping_file, home_dir, component, version, filter_pattern)
+        if source["mismatch"]:
+            warnings.append(source["mismatch"])
+        
+        return {
+            "component": component,
+            "version": version,
+            "filter": filter_pattern,
+            "final_registry": final_registry,
+            "mapping_file": mapping_file,
+            "mapping_updated": mapping_updated,
+            "mapping_source": source,
+            "images_total": len(entries),
+            "images_matched": len(matched),
+            "images": images,
+            "images_truncated": len(matched) > len(images),
+            "estimated_bytes": estimated_bytes,
+            "estimated_seconds": round(estimated_bytes / throughput) if throughput else None,
+            "throughput_source": throughput_source,
+            "sizes_cached": len(matched) - unknown,
+            "warnings": warnings
+        }
+
+
+mirror_planner = MirrorPlanner(run_metrics, image_sizes)
+
+
+class _Metric:
+    """Base class for Prometheus-style metrics keyed by label values"""
+
+    metric_type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Optional callback yielding (labels dict, value) pairs computed at scrape time,
+        # so series of finished jobs never go stale and hot paths pay nothing
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labelnames)
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key)) + list(extra or [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{label}="{_escape_label_value(value)}"' for label, value in pairs) + "}"
+
+    def samples(self):
+        if self.callback is not None:
+            return [(self.name + self._format_labels(self._key(labels)), value)
+                    for labels, value in self.callback()]
+        with self._lock:
+            return [(self.name + self._format_labels(key), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(f"{series} {_format_sample(value)}" for series, value in self.samples())
+        return lines
+
+
+def _escape_label_value(value):
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_sample(value):
+    """Format a sample value for the Prometheus text format"""
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter"""
+
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Gauge, either set directly or computed at scrape time by a callback"""
+
+    metric_type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Cumulative histogram with fixed buckets"""
+
+    metric_type = "histogram"
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += 1
+            entry[2] += value
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(key, list(entry[0]), entry[1], entry[2]) for key, entry in self._values.items()]
+        samples = []
+        for key, bucket_counts, count, total in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                samples.append((self.name + "_bucket" + self._format_labels(key, [("le", _format_sample(float(bound)))]),
+                                cumulative))
+            samples.append((self.name + "_bucket" + self._format_labels(key, [("le", "+Inf")]), count))
+            samples.append((self.name + "_count" + self._format_labels(key), count))
+            samples.append((self.name + "_sum" + self._format_labels(key), total))
+        return samples
+
+
+class MetricsRegistry:
+    """Holds all metrics exposed on /metrics"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logging.getLogger("cp4i.metrics").error("Error rendering metric %s: %s", metric.name, e)
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedLock:
+    """threading.Lock that records how long callers wait to acquire it
+
+    Uncontended acquisitions take a non-blocking fast path and only bump a plain
+    counter; the counters are updated while the lock is held, so they need no
+    synchronisation of their own.
+    """
+
+    instances = []
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        InstrumentedLock.instances.append(self)
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            self.acquisitions += 1
+            return True
+        if not blocking:
+            return False
+        started = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        if acquired:
+            self.acquisitions += 1
+            self.contended += 1
+        LOCK_WAIT_SECONDS.observe(time.perf_counter() - started, lock=self.name)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+metrics_registry = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = metrics_registry.register(Histogram(
+    "cp4i_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")))
+MONITOR_TICK_SECONDS = metrics_registry.register(Histogram(
+    "cp4i_monitor_tick_duration_seconds", "Time spent in one download monitor iteration"))
+LOG_READ_BYTES = metrics_registry.register(Counter(
+    "cp4i_log_read_bytes_total", "Bytes of download logs read by the server", ("reader",)))
+LOG_ARCHIVE_BYTES = metrics_registry.register(Counter(
+    "cp4i_log_archive_bytes_total", "Bytes of completed download logs archived, before and after compression",
+    ("stage",)))
+LOCK_WAIT_SECONDS = metrics_registry.register(Histogram(
+    "cp4i_lock_wait_seconds", "Time spent waiting for a contended lock", ("lock",),
+    buckets=(0.0001, 0.001, 0.01, 0.1, 0.5, 1, 5, 30)))
+LOCK_ACQUISITIONS = metrics_registry.register(Counter(
+    "cp4i_lock_acquisitions_total", "Lock acquisitions", ("lock", "contended"),
+    callback=lambda: [item for lock in InstrumentedLock.instances for item in (
+        ({"lock": lock.name, "contended": "false"}, lock.acquisitions - lock.contended),
+        ({"lock": lock.name, "contended": "true"}, lock.contended))]))
+SUBPROCESS_SPAWNS = metrics_registry.register(Counter(
+    "cp4i_subprocess_spawns_total", "Subprocesses started by the server", ("kind",)))
+REGISTRY_SESSIONS = metrics_registry.register(Counter(
+    "cp4i_registry_sessions_total", "Registry session lookups by result (hit, shared, login, failed)", ("result",)))
+NOTIFICATIONS = metrics_registry.register(Counter(
+    "cp4i_notifications_total", "Download notifications by channel and delivery result", ("channel", "result")))
+HUNG_MIRRORS = metrics_registry.register(Counter(
+    "cp4i_hung_mirrors_total", "Mirrors killed after making no IO progress for the hung timeout"))
+
+
+def _run_command(kind, *args, **kwargs):
+    """subprocess.run that counts spawns by kind"""
+    SUBPROCESS_SPAWNS.inc(kind=kind)
+    return subprocess.run(*args, **kwargs)
+
+
+def _job_limits(overrides=None):
+    """Resource limits for a job, request values over the CP4I_JOB_* defaults
+
+    Raises ValueError for values of the wrong type or out of range.
+    """
+    overrides = overrides or {}
+    io_weight = overrides.get("io_weight")
+    if io_weight in (None, ""):
+        io_weight = JOB_IO_WEIGHT
+    if isinstance(io_weight, bool) or not isinstance(io_weight, (int, str)):
+        raise ValueError("io_weight must be an integer between 1 and 10000")
+    try:
+        io_weight = int(io_weight)
+    except ValueError:
+        raise ValueError("io_weight must be an integer between 1 and 10000") from None
+    if not 1 <= io_weight <= 10000:
+        raise ValueError("io_weight must be between 1 and 10000")
+    cpu_limit = overrides.get("cpu_limit") or JOB_CPU_LIMIT
+    if cpu_limit:
+        if isinstance(cpu_limit, bool) or not isinstance(cpu_limit, (int, float, str)):
+            raise ValueError("cpu_limit must be a positive number of cores")
+        try:
+            cpu_limit = float(cpu_limit)
+        except ValueError:
+            raise ValueError("cpu_limit must be a positive number of cores") from None
+    else:
+        cpu_limit = None
+    if cpu_limit is not None and not 0 < cpu_limit < float("inf"):
+        raise ValueError("cpu_limit must be a positive number of cores")
+    memory_limit = overrides.get("memory_limit") or JOB_MEMORY_LIMIT
+    if memory_limit:
+        if isinstance(memory_limit, bool) or not isinstance(memory_limit, (int, str)):
+            raise ValueError(f"Invalid memory_limit: {memory_limit}")
+        try:
+            parsed = _parse_size(memory_limit)
+        except ValueError:
+            parsed = None
+        if not parsed:
+            raise ValueError(f"Invalid memory_limit: {memory_limit}")
+        memory_limit = parsed
+    return {"io_weight": io_weight, "cpu_limit": cpu_limit, "memory_limit": memory_limit or None}
+
+
+class JobCgroup:
+    """A cgroup v2 group holding one download's whole process tree
+
+    Limits IO weight, CPU and memory, accounts for usage and kills the tree
+    reliably. When CGROUP_ROOT is not on a writable cgroup2 mount, jobs run in
+    their own process group only.
+    """
+
+    CONTROLLERS = ("cpu", "io", "memory")
+    _root_ready = None
+    _root_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def _prepare_root(cls):
+        """Create CGROUP_ROOT and enable controllers for its children, once"""
+        with cls._root_lock:
+            if cls._root_ready is None:
+                try:
+                    if not os.path.exists(os.path.join(os.path.dirname(CGROUP_ROOT), "cgroup.controllers")):
+                        raise OSError("parent is not a cgroup v2 group")
+                    os.makedirs(CGROUP_ROOT, exist_ok=True)
+                    with open(os.path.join(CGROUP_ROOT, "cgroup.controllers")) as f:
+                        available = f.read().split()
+                    for controller in cls.CONTROLLERS:
+                        if controller in available:
+                            try:
+                                with open(os.path.join(CGROUP_ROOT, "cgroup.subtree_control"), "w") as f:
+                                    f.write(f"+{controller}")
+                            except OSError as e:
+                                logging.getLogger("cp4i.cgroup").warning(
+                                    "Cannot enable %s controller: %s", controller, e)
+                    cls._root_ready = True
+                except OSError as e:
+                    logging.getLogger("cp4i.cgroup").info("Per-job cgroups disabled (%s): %s", CGROUP_ROOT, e)
+                    cls._root_ready = False
+            return cls._root_ready
+
+    @classmethod
+    def create(cls, job_id, limits):
+        """Create the cgroup for a job and apply its limits; None when cgroups are unavailable"""
+        if not cls._prepare_root():
+            return None
+        path = os.path.join(CGROUP_ROOT, re.sub(r"[^\w.-]", "_", job_id))
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as e:
+            job_logger(job_id, "cp4i.cgroup").warning("Cannot create cgroup %s: %s", path, e)
+            return None
+        cgroup = cls(path)
+        cgroup.apply_limits(limits, job_logger(job_id, "cp4i.cgroup"))
+        return cgroup
+
+    def _read(self, name):
+        with open(os.path.join(self.path, name)) as f:
+            return f.read()
+
+    def _write(self, name, value):
+        with open(os.path.join(self.path, name), "w") as f:
+            f.write(value)
+
+    def apply_limits(self, limits, log):
+        """Write the job's IO weight, CPU and memory limits"""
+        settings = []
+        if limits.get("io_weight"):
+            weight = str(limits["io_weight"])
+            settings.append(("io.weight", f"default {weight}", ("io.bfq.weight", weight)))
+        if limits.get("cpu_limit"):
+            settings.append(("cpu.max", f"{int(limits['cpu_limit'] * 100000)} 100000", None))
+        if limits.get("memory_limit"):
+            settings.append(("memory.max", str(limits["memory_limit"]), None))
+        for name, value, fallback in settings:
+            try:
+                self._write(name, value)
+            except OSError as e:
+                if fallback and os.path.exists(os.path.join(self.path, fallback[0])):
+                    try:
+                        self._write(*fallback)
+                        continue
+                    except OSError:
+                        pass
+                log.warning("Cannot set %s=%s: %s", name, value, e)
+
+    def wrap(self, cmd):
+        """Command that moves itself into the cgroup before exec'ing cmd, so every child starts inside it"""
+        return ["sh", "-c", 'echo $$ > "$0/cgroup.procs" && exec "$@"', self.path] + list(cmd)
+
+    def pids(self):
+        try:
+            return [int(pid) for pid in self._read("cgroup.procs").split()]
+        except OSError:
+            return []
+
+    def kill(self):
+        """SIGKILL every process in the cgroup; returns whether anything was signalled"""
+        pids = self.pids()
+        if not pids:
+            return False
+        try:
+            self._write("cgroup.kill", "1")
+        except OSError:
+            # Kernels before 5.14 have no cgroup.kill
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        return True
+
+    def stats(self):
+        """CPU, memory and IO used by the job so far"""
+        stats = {}
+        try:
+            cpu = dict(line.split() for line in self._read("cpu.stat").splitlines() if line.strip())
+            stats["cpu_seconds"] = int(cpu.get("usage_usec", 0)) / 1e6
+            stats["cpu_user_seconds"] = int(cpu.get("user_usec", 0)) / 1e6
+            stats["cpu_system_seconds"] = int(cpu.get("system_usec", 0)) / 1e6
+            if "throttled_usec" in cpu:
+                stats["cpu_throttled_seconds"] = int(cpu["throttled_usec"]) / 1e6
+        except (OSError, ValueError):
+            pass
+        for name, key in (("memory.current", "memory_bytes"), ("memory.peak", "memory_peak_bytes")):
+            try:
+                stats[key] = int(self._read(name))
+            except (OSError, ValueError):
+                pass
+        try:
+            events = dict(line.split() for line in self._read("memory.events").splitlines() if line.strip())
+            stats["oom_kills"] = int(events.get("oom_kill", 0))
+        except (OSError, ValueError):
+            pass
+        try:
+            io = {"rbytes": 0, "wbytes": 0, "rios": 0, "wios": 0}
+            for line in self._read("io.stat").splitlines():
+                for field in line.split()[1:]:
+                    key, _, value = field.partition("=")
+                    if key in io:
+                        io[key] += int(value)
+            stats.update(io_read_bytes=io["rbytes"], io_write_bytes=io["wbytes"],
+                         io_read_ops=io["rios"], io_write_ops=io["wios"])
+        except (OSError, ValueError):
+            pass
+        return stats
+
+    def remove(self):
+        """Remove the cgroup once its processes are gone"""
+        for _ in range(20):
+            try:
+                os.rmdir(self.path)
+                return True
+            except FileNotFoundError:
+                return True
+            except OSError:
+                time.sleep(0.1)
+        return False
+
+
+class ProcessTreeProfiler:
+    """Time series of CPU, memory and IO of one job's process tree, read from /proc
+
+    The tree is the job's cgroup when it has one, else the script and its
+    descendants, found through /proc/<pid>/task/<tid>/children (all of /proc
+    is scanned for the process group only on kernels without that file).
+    Counters of exited processes are kept, so totals cover everything the job
+    ran. Progress is judged on the mirror processes (oc) when any are running,
+    else on the whole tree: a sample in which they neither read nor wrote
+    opens a stall, "disk" when one was blocked in uninterruptible IO, else
+    "network". A stall reaching HUNG_TIMEOUT (when set) marks the mirror hung.
+    """
+
+    MIRROR_COMMANDS = ("oc", "oc-mirror", "skopeo")
+    CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+    MAX_STALLS = 50
+
+    def __init__(self, interval=PROFILE_INTERVAL, max_samples=PROFILE_MAX_SAMPLES, hung_timeout=HUNG_TIMEOUT):
+        self.interval = interval
+        self.hung_timeout = hung_timeout
+        self.samples = deque(maxlen=max_samples)
+        self.stalls = deque(maxlen=self.MAX_STALLS)
+        self.lock = threading.Lock()
+        self.pgid = None
+        self.hung = False
+        self.peak_rss_bytes = 0
+        self.peak_processes = 0
+        self._exited = {}  # counters of processes gone since
+        self._live = {}  # (pid, start ticks) -> counters at the last sample
+        self._watched = {}  # (pid, start ticks) -> IO (or CPU) of the processes progress is judged on
+        self._totals = {}
+        self._last_time = None
+        self._progress_at = None
+        self._stall = None
+
+    def attach(self, pgid):
+        """Follow a new attempt's process group; the hung timer starts again"""
+        with self.lock:
+            self.pgid = pgid
+            self.hung = False
+            self._progress_at = time.time()
+            self._stall = None
+
+    def due(self):
+        # Ticks come every MONITOR_INTERVAL with some jitter; half a tick early still counts
+        return self._last_time is None or time.time() - self._last_time >= self.interval - MONITOR_INTERVAL / 2
+
+    @classmethod
+    def _read_process(cls, pid):
+        """Command, state, start time, RSS and counters of one process; None once it is gone"""
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{pid}/statm") as f:
+                rss = int(f.read().split()[1]) * cls.PAGE_SIZE
+            command = stat[stat.index("(") + 1:stat.rindex(")")]
+            fields = stat[stat.rindex(")") + 1:].split()
+            counters = {"cpu_seconds": (int(fields[11]) + int(fields[12])) / cls.CLOCK_TICKS}
+            started = int(fields[19])
+        except (OSError, IndexError, ValueError):
+            return None
+        try:
+            with open(f"/proc/{pid}/io") as f:
+                io = dict(line.split(": ", 1) for line in f.read().splitlines() if ": " in line)
+            # rchar/wchar count every read and write, network included; *_bytes only storage IO
+            counters.update(read_chars=int(io["rchar"]), write_chars=int(io["wchar"]),
+                            disk_read_bytes=int(io["read_bytes"]), disk_write_bytes=int(io["write_bytes"]))
+        except (OSError, KeyError, ValueError):
+            pass  # another user's process, or no task IO accounting in the kernel
+        return command, fields[0], started, rss, counters
+
+    def _tree_pids(self, cgroup):
+        if cgroup:
+            return set(cgroup.pids())
+        if self.pgid is None:
+            return set()
+        if not os.path.exists(f"/proc/{self.pgid}/task/{self.pgid}/children"):
+            return self._group_pids() if os.path.exists(f"/proc/{self.pgid}") else set()
+        pids, pending = set(), [self.pgid]
+        while pending:
+            pid = pending.pop()
+            pids.add(pid)
+            try:
+                for tid in os.listdir(f"/proc/{pid}/task"):
+                    with open(f"/proc/{pid}/task/{tid}/children") as f:
+                        pending.extend(int(child) for child in f.read().split())
+            except (OSError, ValueError):
+                continue  # exited meanwhile
+        return pids
+
+    def _group_pids(self):
+        """Members of the process group, by scanning all of /proc"""
+        pids = set()
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[2]) == self.pgid:
+                        pids.add(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+        return pids
+
+    def sample(self, cgroup=None):
+        """Read the process tree once and record a sample. Blocking, runs on the worker pool."""
+        now = time.time()
+        live, watched, states, rss = {}, {}, {}, 0
+        for pid in self._tree_pids(cgroup):
+            process = self._read_process(pid)
+            if not process:
+                continue
+            command, state, started, process_rss, counters = process
+            key = (pid, started)
+            live[key] = counters
+            states[key] = state
+            rss += process_rss
+            if command in self.MIRROR_COMMANDS:
+                watched[key] = counters
+        watched = watched or live
+        activity = {key: (c["read_chars"] + c["write_chars"] if "read_chars" in c else c["cpu_seconds"])
+                    for key, c in watched.items()}
+
+        with self.lock:
+            for key, counters in self._live.items():
+                if key not in live:
+                    for name, value in counters.items():
+                        self._exited[name] = self._exited.get(name, 0) + value
+            totals = dict(self._exited)
+            for counters in live.values():
+                for name, value in counters.items():
+                    totals[name] = totals.get(name, 0) + value
+            sample = {
+                "time": datetime.fromtimestamp(now).isoformat(timespec="seconds"),
+                "processes": len(live),
+                "blocked": sum(1 for state in states.values() if state == "D"),
+                "rss_bytes": rss,
+                "cpu_seconds": round(totals.get("cpu_seconds", 0), 2)
+            }
+            if self._last_time is not None:
+                elapsed = max(now - self._last_time, 0.001)
+                sample["cpu_percent"] = round(
+                    100 * max(0, totals.get("cpu_seconds", 0) - self._totals.get("cpu_seconds", 0)) / elapsed, 1)
+                for name in ("read_chars", "write_chars", "disk_read_bytes", "disk_write_bytes"):
+                    if name in totals:
+                        sample[f"{name}_per_sec"] = int(max(0, totals[name] - self._totals.get(name, 0)) / elapsed)
+
+            # Progress: a watched process is new or moved bytes; stopped (paused) jobs are not stalled
+            progressed = any(self._watched.get(key) != value for key, value in activity.items())
+            paused = any(states[key] in "Tt" for key in watched)
+            if not live or progressed or paused or self._progress_at is None:
+                self._progress_at = now
+                self._stall = None
+            else:
+                if self._stall is None:
+                    self._stall = {"start": datetime.fromtimestamp(self._last_time or now).isoformat(timespec="seconds"),
+                                   "kind": "network"}
+                    self.stalls.append(self._stall)
+                if any(states[key] == "D" for key in watched):
+                    self._stall["kind"] = "disk"
+                self._stall["seconds"] = round(now - self._progress_at)
+                if self.hung_timeout and now - self._progress_at >= self.hung_timeout:
+                    self.hung = self._stall["hung"] = True
+            sample["stalled"] = self._stall is not None
+
+            self.samples.append(sample)
+            self._live, self._watched, self._totals, self._last_time = live, activity, totals, now
+            self.peak_rss_bytes = max(self.peak_rss_bytes, rss)
+            self.peak_processes = max(self.peak_processes, len(live))
+            return sample
+
+    def summary(self):
+        """Totals, peaks and stalls, without the time series"""
+        with self.lock:
+            totals = self._totals
+            return {
+                "interval": self.interval,
+                "samples": len(self.samples),
+                "cpu_seconds": round(totals.get("cpu_seconds", 0), 2),
+                "peak_rss_bytes": self.peak_rss_bytes,
+                "peak_processes": self.peak_processes,
+                **{name: totals[name] for name in ("read_chars", "write_chars", "disk_read_bytes",
+                                                   "disk_write_bytes") if name in totals},
+                "stalled_seconds": sum(stall.get("seconds", 0) for stall in self.stalls),
+                "stalls": [dict(stall) for stall in self.stalls],
+                "hung_restarts": sum(1 for stall in self.stalls if stall.get("hung"))
+            }
+
+    def to_dict(self, limit=None):
+        """Summary with the samples, the last `limit` of them when given"""
+        result = self.summary()
+        with self.lock:
+            samples = list(self.samples)
+        result["series"] = samples[-limit:] if limit else samples
+        return result
+
+
+def _save_profile(log_file, profile):
+    """Write a finished download's process profile next to its log"""
+    try:
+        with open(f"{log_file}{PROFILE_SUFFIX}.tmp", 'w') as f:
+            json.dump(profile, f)
+        os.replace(f"{log_file}{PROFILE_SUFFIX}.tmp", f"{log_file}{PROFILE_SUFFIX}")
+    except OSError as e:
+        logging.getLogger("cp4i.profiler").warning("Could not save process profile for %s: %s", log_file, e)
+
+
+def _load_profile(log_file):
+    try:
+        with open(f"{log_file}{PROFILE_SUFFIX}", 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class AsyncSupervisor:
+    """One asyncio event loop that supervises every download process.
+
+    The loop runs in a single daemon thread, started on first use. Blocking
+    work (log parsing, directory walks, report generation) is handed to a
+    fixed-size thread pool, so the thread count does not grow with the number
+    of jobs being supervised.
+    """
+
+    def __init__(self, workers=SUPERVISOR_WORKERS):
+        self.workers = workers
+        self._loop = None
+        self._executor = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="cp4i-supervisor")
+                loop.set_default_executor(self._executor)
+                if sys.version_info < (3, 12) and hasattr(os, "pidfd_open"):
+                    # Wait for children with pidfds instead of one waiter thread per child
+                    watcher = asyncio.PidfdChildWatcher()
+                    asyncio.set_child_watcher(watcher)
+                    watcher.attach_loop(loop)
+                threading.Thread(target=loop.run_forever, name="cp4i-supervisor-loop", daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    def submit(self, coro):
+        """Schedule a coroutine on the supervisor loop from any thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    async def run_blocking(self, fn, *args):
+        """Run a blocking call on the worker pool without stalling the loop"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def every(self, interval, fn, name):
+        """Run a blocking function on the worker pool, or await a coroutine function, every `interval` seconds"""
+        async def periodic():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    if asyncio.iscoroutinefunction(fn):
+                        await fn()
+                    else:
+                        await self.run_blocking(fn)
+                except Exception as e:
+                    logging.getLogger("cp4i.supervisor").exception("Error in %s: %s", name, e)
+        return self.submit(periodic())
+
+
+def _http_json(method, url, body=None, timeout=None):
+    """Call another server's JSON API and return (status code, parsed body)
+
+    Raises OSError when the server cannot be reached.
+    """
+    headers = {"Content-Type": "application/json"}
+    if WORKER_TOKEN:
+        headers["X-CP4I-Worker-Token"] = WORKER_TOKEN
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout or WORKER_HTTP_TIMEOUT) as response:
+            status, payload = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, payload = e.code, e.read()
+    try:
+        return status, json.loads(payload) if payload else {}
+    except ValueError:
+        return status, {"error": payload.decode('utf-8', errors='replace')[:500]}
+
+
+class WorkerPool:
+    """Worker agents registered with this server and the downloads dispatched to them
+
+    Workers are other instances of this app started with CP4I_COORDINATOR_URL.
+    They announce themselves with heartbeats carrying their load and free disk
+    space. Downloads placed on a worker are started through its API, and their
+    state is mirrored here by polling each worker's download feed in delta
+    mode, so one request per worker covers all of its jobs.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.lock = threading.Lock()
+        self.workers = {}  # name -> heartbeat info
+        self.jobs = {}  # local download id -> record mirrored from the worker
+        self._feed_versions = {}  # worker name -> last feed version seen
+        self._sync = None
+
+    def heartbeat(self, info):
+        """Register or refresh a worker"""
+        name = info.get("name")
+        url = (info.get("url") or "").rstrip("/")
+        if not name or not url.startswith(("http://", "https://")):
+            return {"error": "Heartbeat needs a name and an http(s) url"}
+        if name == "local":
+            return {"error": 'Worker name "local" is reserved for the coordinator'}
+        with self.lock:
+            worker = self.workers.setdefault(name, {"name": name, "registered_time": datetime.now().isoformat(),
+                                                    "draining": False})
+            worker.update({key: info.get(key) for key in
+                           ("slots", "running", "queued", "free_bytes", "available_bytes", "home_dir")})
+            worker["url"] = url
+            worker["last_seen"] = time.time()
+            if self._sync is None or self._sync.done():
+                self._sync = self.manager.supervisor.every(MONITOR_INTERVAL, self.sync_tick, "worker sync")
+        return {"success": True, "heartbeat_interval": WORKER_HEARTBEAT_INTERVAL}
+
+    def _online(self, worker):
+        return time.time() - worker.get("last_seen", 0) < WORKER_TIMEOUT
+
+    def has_workers(self):
+        with self.lock:
+            return any(self._online(w) for w in self.workers.values())
+
+    def list_workers(self):
+        with self.lock:
+            jobs_by_worker = {}
+            for job in self.jobs.values():
+                jobs_by_worker.setdefault(job["worker"], []).append(job["id"])
+            return [dict(w, online=self._online(w), jobs=jobs_by_worker.get(name, []))
+                    for name, w in sorted(self.workers.items())]
+
+    def set_draining(self, name, draining):
+        """Stop (or resume) placing new downloads on a worker; its running jobs are unaffected"""
+        with self.lock:
+            if name not in self.workers:
+                return {"error": "Worker not found"}
+            self.workers[name]["draining"] = draining
+            return dict(self.workers[name])
+
+    def candidates(self, requested, estimated_bytes, local_load):
+        """Hosts to try for a download, best first, by free slots, load and disk space
+
+        `local_load` describes this server like a heartbeat does; "local" stands for it.
+        """
+        with self.lock:
+            hosts = [dict(w) for w in self.workers.values() if self._online(w) and not w["draining"]]
+        if COORDINATOR_RUNS_JOBS:
+            hosts.append(dict(local_load, name="local"))
+        if requested:
+            return [h["name"] for h in hosts if h["name"] == requested]
+        
+        def load(host):
+            slots = max(host.get("slots") or 1, 1)
+            running = host.get("running") or 0
+            return ((host.get("available_bytes") or 0) < estimated_bytes, running >= slots,
+                    running / slots, -(host.get("available_bytes") or 0))
+        return [h["name"] for h in sorted(hosts, key=load)]
+
+    def dispatch(self, worker_name, download_id, request):
+        """Start a download on a worker; returns the API result or None if the worker is unreachable
+
+        The entitlement key is never sent: each worker uses its own.
+        """
+        request = {k: v for k, v in request.items() if k != "entitlement_key"}
+        with self.lock:
+            worker = self.workers.get(worker_name)
+        if not worker:
+            return None
+        try:
+            status, result = _http_json("POST", f"{worker['url']}/api/downloads", dict(request, worker="local"))
+        except OSError as e:
+            logging.getLogger("cp4i.workers").warning("Worker %s unreachable: %s", worker_name, e)
+            with self.lock:
+                worker["last_seen"] = 0
+            return None
+        if "error" in result:
+            return dict(result, worker=worker_name)
+        
+        now = datetime.now().isoformat()
+        with self.lock:
+            # Count the job now rather than at the worker's next heartbeat, so placements spread out
+            worker["running"] = (worker.get("running") or 0) + 1
+            self.jobs[download_id] = {
+                "id": download_id,
+                "remote_id": result["download_id"],
+                "worker": worker_name,
+                "component": request["component"],
+                "version": request["version"],
+                "name": request["name"],
+                "filter": request.get("filter"),
+                "home_dir": request.get("home_dir"),
+                "status": result.get("status", "starting"),
+                "start_time": now,
+                "end_time": None,
+                "progress": 0,
+                "request": request
+            }
+        job_logger(download_id, "cp4i.workers").info(
+            "Dispatched to worker %s as %s", worker_name, result["download_id"])
+        return dict(result, download_id=download_id, worker=worker_name, remote_id=result["download_id"])
+
+    def job_records(self):
+        """Dispatched downloads in the shape of DownloadManager.get_all_downloads"""
+        with self.lock:
+            return [{k: v for k, v in job.items() if k != "request"} for job in self.jobs.values()]
+
+    def owner(self, download_id):
+        """(worker, remote id) of a dispatched download, active or finished, or None"""
+        with self.lock:
+            job = self.jobs.get(download_id)
+            if job:
+                return self.workers.get(job["worker"]), job["remote_id"]
+        with self.manager.lock:
+            entry = next((h for h in reversed(download_history)
+                          if h["id"] == download_id and h.get("worker")), None)
+        if entry:
+            with self.lock:
+                return self.workers.get(entry["worker"]), entry["remote_id"]
+        return None
+
+    def worker_for_name(self, name, home_dir=None):
+        """Worker holding the directory of a dispatched download, looked up by name"""
+        with self.lock:
+            for job in self.jobs.values():
+                if job["name"] == name and (home_dir is None or job.get("home_dir") == home_dir):
+                    return self.workers.get(job["worker"])
+        with self.manager.lock:
+            entry = next((h for h in reversed(download_history) if h.get("name") == name and h.get("worker")
+                          and (home_dir is None or h.get("home_dir") == home_dir)), None)
+        if entry:
+            with self.lock:
+                return self.workers.get(entry["worker"])
+        return None
+
+    def forward(self, download_id, method, path, body=None):
+        """Call a worker's API for one of its downloads; returns (status code, result)
+
+        `path` is relative to the download on the worker, e.g. "/events?since=3".
+        """
+        owner = self.owner(download_id)
+        if not owner or not owner[0]:
+            return 404, {"error": "Worker of this download is not registered"}
+        worker, remote_id = owner
+        try:
+            status, result = _http_json(method, f"{worker['url']}/api/downloads/{remote_id}{path}", body)
+        except OSError as e:
+            return 502, {"error": f"Worker {worker['name']} unreachable: {e}"}
+        if isinstance(result, dict) and result.get("id") == remote_id:
+            result = dict(result, id=download_id, remote_id=remote_id, worker=worker["name"])
+        return status, result
+
+    def retry(self, download_id, overrides=None):
+        """Retry a dispatched download on the worker that ran it, with the worker's own entitlement key
+
+        Returns (status code, result) like forward().
+        """
+        overrides = {k: v for k, v in (overrides or {}).items() if k != "entitlement_key"}
+        status, result = self.forward(download_id, "POST", "/retry", overrides)
+        if isinstance(result, dict) and "error" in result:
+            return (status if status >= 400 else 502), result
+        owner = self.owner(download_id)
+        if not (status < 300 and isinstance(result, dict) and "download_id" in result):
+            return 502, {"error": f"Worker {owner[0]['name']} sent an invalid retry response (HTTP {status})"}
+        with self.manager.lock:
+            previous = next((h for h in reversed(download_history) if h["id"] == download_id), None)
+            download_history[:] = [h for h in download_history if h["id"] != download_id]
+            self.manager.history_generation += 1
+        with self.lock:
+            job = self.jobs.pop(download_id, None) or dict(previous or {}, request={})
+            new_id = f"{job['name']}-retry-{int(time.time())}"
+            self.jobs[new_id] = dict(job, id=new_id, remote_id=result["download_id"], status="starting",
+                                     start_time=datetime.now().isoformat(), end_time=None)
+        job_logger(new_id, "cp4i.workers").info("Retrying on worker %s as %s", owner[0]["name"], result["download_id"])
+        return status, dict(result, download_id=new_id, worker=owner[0]["name"], remote_id=result["download_id"])
+
+    def sync_tick(self):
+        """Mirror the state of dispatched downloads from each worker's download feed"""
+        with self.lock:
+            workers = {job["worker"] for job in self.jobs.values()}
+            targets = [(name, self.workers[name]["url"], self._feed_versions.get(name))
+                       for name in workers if name in self.workers]
+        for name, url, version in targets:
+            try:
+                status, feed = _http_json("GET", f"{url}/api/downloads" + (f"?since={version}" if version else ""))
+            except OSError as e:
+                logging.getLogger("cp4i.workers").warning("Cannot sync worker %s: %s", name, e)
+                continue
+            if status == 200:
+                self._apply_feed(name, feed)
+
+    def _apply_feed(self, worker_name, feed):
+        """Update dispatched downloads from a worker feed response, finishing those in its history"""
+        finished = []
+        with self.lock:
+            self._feed_versions[worker_name] = feed.get("version")
+            by_remote_id = {job["remote_id"]: job for job in self.jobs.values() if job["worker"] == worker_name}
+            for record in feed.get("active", []):
+                job = by_remote_id.get(record["id"])
+                if job:
+                    job.update({k: v for k, v in record.items() if k != "id"})
+            for record in feed.get("history", []):
+                job = by_remote_id.get(record["id"])
+                if job and record.get("status") in FINISHED_STATUSES:
+                    del self.jobs[job["id"]]
+                    finished.append(dict(record, id=job["id"], remote_id=record["id"], worker=worker_name))
+        if finished:
+            with self.manager.lock:
+                download_history.extend(finished)
+                self.manager.history_generation += 1
+            for record in finished:
+                job_logger(record["id"], "cp4i.workers").info(
+                    "Finished on worker %s: %s", worker_name, record["status"])
+
+
+class DownloadsFeed:
+    """Versioned snapshot of active downloads and history behind GET /api/downloads
+
+    Each record remembers the version at which it last changed, so a poll can
+    be answered with 304 when nothing changed, or with only the records changed
+    since a given version. Versions start at the server's start time in
+    milliseconds, so they keep increasing across restarts.
+    """
+    SECTIONS = ("active", "history")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = int(time.time() * 1000)
+        self.oldest_delta = self.version  # deltas from before this version are answered in full
+        self.records = {section: {} for section in self.SECTIONS}  # id -> (fingerprint, version)
+        self.lists = {section: [] for section in self.SECTIONS}
+        self.removed = {section: {} for section in self.SECTIONS}  # id -> version
+        self.history_generation = None
+        self._bodies = {}  # encoding -> body of the full response at self.version
+
+    def _sync(self, section, records):
+        """Record what changed in one section; returns True if anything did"""
+        current, removed = self.records[section], self.removed[section]
+        next_version = self.version + 1
+        changed = False
+        seen = set()
+        for record in records:
+            fingerprint = json.dumps(record, sort_keys=True, default=str)
+            seen.add(record["id"])
+            previous = current.get(record["id"])
+            if previous is None or previous[0] != fingerprint:
+                current[record["id"]] = (fingerprint, next_version)
+                removed.pop(record["id"], None)
+                changed = True
+        for record_id in [r for r in current if r not in seen]:
+            del current[record_id]
+            removed[record_id] = next_version
+            changed = True
+        while len(removed) > DOWNLOADS_FEED_MAX_REMOVED:
+            oldest = min(removed, key=removed.get)
+            self.oldest_delta = max(self.oldest_delta, removed.pop(oldest))
+        self.lists[section] = records
+        return changed
+
+    def refresh(self, active, history, history_generation):
+        """Bring the snapshot up to date; history is only compared when its generation moved"""
+        with self.lock:
+            changed = self._sync("active", active)
+            if history_generation != self.history_generation:
+                changed = self._sync("history", history) or changed
+                self.history_generation = history_generation
+            if changed:
+                self.version += 1
+                self._bodies = {}
+            return self.version
+
+    def full_body(self, compress=False):
+        """Full response body at the current version, serialized once per version"""
+        with self.lock:
+            encoding = "gzip" if compress else "identity"
+            if encoding not in self._bodies:
+                body = app.json.dumps({"version": self.version, "delta": False,
+                                       "active": self.lists["active"], "history": self.lists["history"]})
+                self._bodies[encoding] = gzip.compress(body.encode(), GZIP_LEVEL) if compress else body.encode()
+            return self._bodies[encoding]
+
+    def delta(self, since):
+        """Records changed and ids removed after version `since`, or None if that needs a full response"""
+        with self.lock:
+            if since < self.oldest_delta or since > self.version:
+                return None
+            result = {"version": self.version, "delta": True, "since": since, "removed": {}}
+            for section in self.SECTIONS:
+                versions = self.records[section]
+                result[section] = [r for r in self.lists[section] if versions[r["id"]][1] > since]
+                result["removed"][section] = [r for r, v in self.removed[section].items() if v > since]
+            return result
+
+
+class NotificationDispatcher:
+    """Webhook and email notifications of download events, delivered in batches off the job path
+
+    notify() only queues; a flush on the supervisor's worker pool sends
+    everything queued during NOTIFY_BATCH_WINDOW as one webhook call and one
+    email. Repeats of an event for the same download are merged, and failed
+    deliveries are retried per channel with exponential backoff.
+    """
+
+    def __init__(self, supervisor, webhook_url=NOTIFY_WEBHOOK_URL, email=NOTIFY_EMAIL):
+        self.supervisor = supervisor
+        self.webhook_url = webhook_url
+        self.email = email
+        self.lock = threading.Lock()
+        self.pending = {}  # (download_id, event) -> notification, in arrival order
+        self.outbox = []  # deliveries waiting for a retry
+        self.recent = deque(maxlen=NOTIFY_RECENT_DELIVERIES)
+        self.dropped = 0
+        self._flush_at = None
+        self._send_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.webhook_url or self.email)
+
+    def notify(self, event, download_id, download, message, force=False):
+        """Queue a notification; never blocks on delivery. Safe to call with the manager lock held."""
+        if not self.enabled or (event not in NOTIFY_EVENTS and not force):
+            return False
+        now = time.time()
+        with self.lock:
+            key = (download_id, event)
+            notification = self.pending.get(key)
+            if notification:
+                notification["repeats"] += 1
+            elif len(self.pending) >= NOTIFY_QUEUE_MAX:
+                self.dropped += 1
+                NOTIFICATIONS.inc(channel="queue", result="dropped")
+                return False
+            else:
+                notification = self.pending[key] = {
+                    "status": event.upper(),
+                    "component": download.get("component"),
+                    "version": download.get("version"),
+                    "name": download.get("name"),
+                    "download_id": download_id,
+                    "repeats": 1
+                }
+            notification["message"] = message
+            notification["timestamp"] = datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S')
+            self._schedule(now + NOTIFY_BATCH_WINDOW)
+        return True
+
+    def _schedule(self, at):
+        """Make sure a flush runs by `at`. Caller must hold the lock."""
+        if self._flush_at is not None and self._flush_at <= at:
+            return
+        self._flush_at = at
+
+        async def flush_later():
+            await asyncio.sleep(max(0, at - time.time()))
+            await self.supervisor.run_blocking(self.flush)
+        self.supervisor.submit(flush_later())
+
+    def flush(self):
+        """Send the queued notifications and the retries that are due"""
+        if not self._send_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.time()
+            with self.lock:
+                self._flush_at = None
+                batch = list(self.pending.values())
+                self.pending.clear()
+                due = [d for d in self.outbox if d["retry_at"] <= now]
+                self.outbox = [d for d in self.outbox if d["retry_at"] > now]
+            channels = [channel for channel, target in (("webhook", self.webhook_url), ("email", self.email)) if target]
+            for start in range(0, len(batch), NOTIFY_MAX_BATCH):
+                due.extend({"channel": channel, "notifications": batch[start:start + NOTIFY_MAX_BATCH], "attempt": 0}
+                           for channel in channels)
+            for delivery in due:
+                self._deliver(delivery)
+            with self.lock:
+                # A flush that came due while this one was sending found the send lock taken and did nothing
+                if self._flush_at is not None and self._flush_at <= time.time():
+                    self._flush_at = None
+                retry_at = min((d["retry_at"] for d in self.outbox), default=None)
+                if self.pending:
+                    # Queued while sending: they get a batch window of their own
+                    batch_at = time.time() + NOTIFY_BATCH_WINDOW
+                    retry_at = batch_at if retry_at is None else min(retry_at, batch_at)
+                if retry_at is not None:
+                    self._schedule(retry_at)
+        finally:
+            self._send_lock.release()
+
+    def _deliver(self, delivery):
+        """Send one batch on one channel, queueing a retry when it fails"""
+        notifications = delivery["notifications"]
+        delivery["attempt"] += 1
+        log = logging.getLogger("cp4i.notifications")
+        try:
+            if delivery["channel"] == "webhook":
+                self._send_webhook(notifications)
+            else:
+                self._send_email(notifications)
+            result, error = "sent", None
+        except (OSError, subprocess.SubprocessError, ValueError) as e:
+            error = str(e)
+            if delivery["attempt"] < NOTIFY_MAX_ATTEMPTS:
+                ceiling = min(NOTIFY_RETRY_MAX_DELAY, NOTIFY_RETRY_BASE_DELAY * 2 ** (delivery["attempt"] - 1))
+                delivery["retry_at"] = time.time() + ceiling / 2 + random.uniform(0, ceiling / 2)
+                result = "retried"
+                with self.lock:
+                    self.outbox.append(delivery)
+                log.warning("%s notification failed (attempt %d), retrying: %s",
+                            delivery["channel"], delivery["attempt"], e)
+            else:
+                result = "dropped"
+                with self.lock:
+                    self.dropped += len(notifications)
+                log.error("%s notification dropped after %d attempts: %s", delivery["channel"], delivery["attempt"], e)
+        NOTIFICATIONS.inc(len(notifications), channel=delivery["channel"], result=result)
+        with self.lock:
+            self.recent.append({
+                "time": datetime.now().isoformat(),
+                "channel": delivery["channel"],
+                "attempt": delivery["attempt"],
+                "result": result,
+                "error": error,
+                "notifications": [f"{n['status']} {n['name']}" for n in notifications]
+            })
+
+    def _send_webhook(self, notifications):
+        # A single notification keeps the payload the download script used to send
+        if len(notifications) == 1:
+            payload = notifications[0]
+        else:
+            payload = {
+                "status": "BATCH",
+                "count": len(notifications),
+                "message": self._summary(notifications),
+                "timestamp": notifications[-1]["timestamp"],
+                "notifications": notifications
+            }
+        req = urllib.request.Request(self.webhook_url, data=json.dumps(payload).encode(), method="POST",
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=NOTIFY_HTTP_TIMEOUT) as response:
+            response.read()
+
+    def _send_email(self, notifications):
+        if not shutil.which("mail"):
+            raise OSError("mail command not found")
+        if len(notifications) == 1:
+            n = notifications[0]
+            subject = f"CP4I Download {n['status']}: {n['component']} v{n['version']}"
+        else:
+            subject = f"CP4I Downloads: {self._summary(notifications)}"
+        body = "\n".join(f"[{n['timestamp']}] {n['status']} {n['name']} ({n['component']} v{n['version']}): "
+                         f"{n['message']}" for n in notifications)
+        _run_command("mail", ["mail", "-s", subject, self.email], input=body, capture_output=True, text=True,
+                     timeout=NOTIFY_HTTP_TIMEOUT, check=True)
+
+    @staticmethod
+    def _summary(notifications):
+        counts = {}
+        for n in notifications:
+            counts[n["status"].lower()] = counts.get(n["status"].lower(), 0) + 1
+        return ", ".join(f"{count} {status}" for status, count in counts.items())
+
+    def status(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "webhook": bool(self.webhook_url),
+                "email": self.email,
+                "events": sorted(NOTIFY_EVENTS),
+                "milestones": NOTIFY_MILESTONES,
+                "batch_window_seconds": NOTIFY_BATCH_WINDOW,
+                "pending": len(self.pending),
+                "retrying": len(self.outbox),
+                "dropped": self.dropped,
+                "recent": list(self.recent)[::-1]
+            }
+
+
+class RegistrySessionCache:
+    """Validated logins to the IBM registry, shared by jobs with the same entitlement key and auth file
+
+    The first job for a key logs in with podman into a private copy of its
+    auth file; later jobs are given that file until the session expires, the
+    source auth file changes or a job fails with an auth error. Jobs starting
+    while a login is in flight wait for it instead of logging in themselves.
+    """
+
+    def __init__(self, session_dir=REGISTRY_SESSION_DIR):
+        self.session_dir = session_dir
+        self.lock = threading.Lock()
+        self.sessions = {}  # fingerprint -> session
+        self.refreshing = {}  # fingerprint -> Future of the login in flight
+
+    @staticmethod
+    def _fingerprint(entitlement_key, auth_file):
+        return hashlib.sha256(f"{entitlement_key or ''}\0{auth_file}".encode()).hexdigest()[:16]
+
+    @staticmethod
+    def _key_expiry(entitlement_key):
+        """Expiry time of an entitlement key (a JWT), or None when it has none"""
+        try:
+            payload = entitlement_key.split(".")[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            return float(claims["exp"])
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+            return None
+
+    async def acquire(self, entitlement_key, auth_file, run_blocking):
+        """Path of an auth file holding a valid login, logging in only when there is no valid session
+
+        Runs on the supervisor loop: the login itself goes through run_blocking,
+        and jobs sharing a login in flight await it on the loop rather than
+        holding a pool thread. Raises OSError when the login fails and
+        asyncio.TimeoutError when a shared login takes too long.
+        """
+        fingerprint = self._fingerprint(entitlement_key, auth_file)
+        try:
+            source_mtime = os.path.getmtime(auth_file)
+        except OSError:
+            source_mtime = None
+        with self.lock:
+            session = self.sessions.get(fingerprint)
+            if (session and session["expires"] > time.time() and session["source_mtime"] == source_mtime
+                    and os.path.exists(session["auth_file"])):
+                session["uses"] += 1
+                REGISTRY_SESSIONS.inc(result="hit")
+                return session["auth_file"]
+            login = self.refreshing.get(fingerprint)
+            owner = login is None
+            if owner:
+                login = self.refreshing[fingerprint] = concurrent.futures.Future()
+        
+        if not owner:
+            REGISTRY_SESSIONS.inc(result="shared")
+            # Shielded: a waiter timing out must not cancel the owner's login
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(login)),
+                                          REGISTRY_LOGIN_TIMEOUT * REGISTRY_LOGIN_ATTEMPTS + 60)
+        try:
+            session = await run_blocking(self._login, fingerprint, entitlement_key, auth_file, source_mtime)
+        except Exception as e:
+            with self.lock:
+                self.refreshing.pop(fingerprint, None)
+                self.sessions.pop(fingerprint, None)
+            login.set_exception(e)
+            REGISTRY_SESSIONS.inc(result="failed")
+            raise
+        with self.lock:
+            self.sessions[fingerprint] = session
+            self.refreshing.pop(fingerprint, None)
+        login.set_result(session["auth_file"])
+        REGISTRY_SESSIONS.inc(result="login")
+        return session["auth_file"]
+
+    def _login(self, fingerprint, entitlement_key, auth_file, source_mtime):
+        """Log in to the registry into a new session auth file"""
+        now = time.time()
+        key_expiry = self._key_expiry(entitlement_key)
+        if key_expiry and key_expiry <= now:
+            raise OSError(f"Entitlement key expired at {datetime.fromtimestamp(key_expiry).isoformat()}")
+        if not shutil.which("podman"):
+            raise OSError("podman not found")
+        
+        os.makedirs(self.session_dir, mode=0o700, exist_ok=True)
+        path = os.path.join(self.session_dir, f"{fingerprint}.json")
+        tmp_path = f"{path}.tmp"
+        # Start from the job's auth file so credentials for other registries carry over
+        try:
+            with open(auth_file, 'rb') as f:
+                source = f.read()
+        except OSError:
+            source = b"{}"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+            f.write(source)
+        
+        cmd = ["podman", "login", "--authfile", tmp_path, REGISTRY_LOGIN_HOST]
+        if entitlement_key:
+            cmd[2:2] = ["-u", "cp", "--password-stdin"]
+        log = logging.getLogger("cp4i.registry")
+        for attempt in range(1, REGISTRY_LOGIN_ATTEMPTS + 1):
+            try:
+                _run_command("registry-login", cmd, input=entitlement_key or "", capture_output=True, text=True,
+                             timeout=REGISTRY_LOGIN_TIMEOUT, check=True)
+                break
+            except subprocess.CalledProcessError as e:
+                error = (e.stderr or e.stdout or "").strip() or f"podman login exited with {e.returncode}"
+            except subprocess.TimeoutExpired:
+                error = f"podman login timed out after {REGISTRY_LOGIN_TIMEOUT}s"
+            # Rejected credentials will not get better by trying again
+            if attempt == REGISTRY_LOGIN_ATTEMPTS or classify_failure_message(error) == FailureClass.AUTH:
+                os.unlink(tmp_path)
+                raise OSError(f"Login to {REGISTRY_LOGIN_HOST} failed: {error}")
+            log.warning("Login to %s failed (attempt %d), retrying: %s", REGISTRY_LOGIN_HOST, attempt, error)
+            time.sleep(REGISTRY_LOGIN_RETRY_DELAY * 2 ** (attempt - 1))
+        os.replace(tmp_path, path)
+        log.info("Logged in to %s for session %s in %.1fs", REGISTRY_LOGIN_HOST, fingerprint, time.time() - now)
+        
+        expires = now + REGISTRY_SESSION_TTL
+        return {
+            "fingerprint": fingerprint,
+            "auth_file": path,
+            "source_auth_file": auth_file,
+            "source_mtime": source_mtime,
+            "entitlement_key": bool(entitlement_key),
+            "created": now,
+            "expires": min(expires, key_expiry) if key_expiry else expires,
+            "login_seconds": round(time.time() - now, 2),
+            "uses": 1
+        }
+
+    def invalidate(self, entitlement_key, auth_file):
+        """Drop a session, e.g. after a job using it was refused by the registry"""
+        with self.lock:
+            return self.sessions.pop(self._fingerprint(entitlement_key, auth_file), None) is not None
+
+    def clear(self):
+        with self.lock:
+            sessions, self.sessions = self.sessions, {}
+        for session in sessions.values():
+            try:
+                os.unlink(session["auth_file"])
+            except OSError:
+                pass
+        return {"success": True, "cleared": len(sessions)}
+
+    def status(self):
+        now = time.time()
+        with self.lock:
+            sessions = [{
+                "fingerprint": s["fingerprint"],
+                "source_auth_file": s["source_auth_file"],
+                "entitlement_key": s["entitlement_key"],
+                "created": datetime.fromtimestamp(s["created"]).isoformat(),
+                "expires": datetime.fromtimestamp(s["expires"]).isoformat(),
+                "valid": s["expires"] > now,
+                "login_seconds": s["login_seconds"],
+                "uses": s["uses"]
+            } for s in self.sessions.values()]
+            refreshing = len(self.refreshing)
+        return {"enabled": REGISTRY_SESSIONS_ENABLED, "registry": REGISTRY_LOGIN_HOST, "sessions": sessions,
+                "logins_in_flight": refreshing, "ttl_seconds": REGISTRY_SESSION_TTL}
+
+
+class DownloadManager:
+    """Manages download processes and their status"""
+    
+    def __init__(self):
+        self.downloads = {}
+        self.lock = InstrumentedLock("download_manager")
+        self.capacity = CapacityPlanner(self)
+        self.supervisor = AsyncSupervisor()
+        self.feed = DownloadsFeed()
+        self.workers = WorkerPool(self)
+        self.notifier = NotificationDispatcher(self.supervisor)
+        self.sessions = RegistrySessionCache()
+        self.history_generation = 0  # bumped whenever download_history changes
+        self._capacity_watch = None
+    
+    def _history_record(self, download_id, download, status):
+        """Build the history entry kept for a finished download"""
+        return {
+            "id": download_id,
+            "component": download["component"],
+            "version": download["version"],
+            "name": download["name"],
+            "filter": download.get("filter"),
+            "status": status,
+            "start_time": download["start_time"],
+            "end_time": download["end_time"],
+            "home_dir": download.get("home_dir"),
+            "final_registry": download.get("final_registry"),
+            "registry_auth_file": download.get("registry_auth_file"),
+            "entitlement_key": download.get("entitlement_key"),
+            "dry_run": download.get("dry_run", False),
+            "estimated_bytes": download.get("estimated_bytes"),
+            "size_bytes": download.get("size_bytes"),
+            "metrics": download.get("metrics"),
+            "attempts": download.get("attempts", []),
+            "coalesced_from": download.get("coalesced_from"),
+            "limits": download.get("limits"),
+            "resources": download.get("resources"),
+            "profile": download["profiler"].summary() if download.get("profiler") else None,
+            "log_start_offset": download.get("log_start_offset", 0),
+            "dry_run_source": download.get("dry_run_source")
+        }
+
+    def _record_finished(self, download_id, download, status):
+        """Generate the summary report, record run metrics and add the download to history
+
+        Blocking disk work: call it without self.lock, which it takes only to
+        add the history entry.
+        """
+        try:
+            follower = download.get("log_follower")
+            parser = follower.parser if follower else _parse_log_file(
+                download.get("log_file"), download.get("log_start_offset", 0))
+        except Exception as e:
+            job_logger(download_id, "cp4i.metrics").warning("Could not parse log: %s", e)
+            parser = LogEventParser()
+
+        verify_started = time.time()
+        self._generate_summary_report(download, parser)
+        verification_seconds = time.time() - verify_started
+        if download.get("log_file"):
+            _save_error_index(download["log_file"], parser, download.get("log_start_offset", 0))
+            if download.get("profiler"):
+                _save_profile(download["log_file"], download["profiler"].to_dict())
+
+        phases, images_mirrored = parser.phase_durations(download.get("end_time")), parser.images_finished
+        phases["verification"] = round(verification_seconds, 3)
+
+        images_total = None
+        mapping_file = _mapping_file_path(download.get("home_dir", HOME_DIR), download["component"], download["version"])
+        if os.path.exists(mapping_file):
+            try:
+                with open(mapping_file, 'r') as f:
+                    images_total = sum(1 for line in f if line.strip() and not line.startswith('#'))
+            except OSError:
+                pass
+
+        try:
+            duration_seconds = (datetime.fromisoformat(download["end_time"]) -
+                                datetime.fromisoformat(download["start_time"])).total_seconds()
+        except (KeyError, TypeError, ValueError):
+            duration_seconds = None
+
+        size_bytes = download.get("size_bytes")
+        transfer_seconds = phases.get("mirror") or duration_seconds
+        metrics = {
+            "id": download_id,
+            "component": download["component"],
+            "version": download["version"],
+            "filter": download.get("filter"),
+            "name": download["name"],
+            "status": status,
+            "dry_run": download.get("dry_run", False),
+            "start_time": download["start_time"],
+            "end_time": download.get("end_time"),
+            "duration_seconds": duration_seconds,
+            "phases": {phase: round(seconds, 3) for phase, seconds in phases.items()},
+            "bytes": size_bytes,
+            "images_total": images_total,
+            "images_mirrored": images_mirrored,
+            "attempts": len(download.get("attempts") or ()) or 1,
+            "resources": download.get("resources"),
+            "throughput_bytes_per_sec": (size_bytes / transfer_seconds
+                                         if size_bytes and transfer_seconds else None)
+        }
+        download["metrics"] = metrics
+        run_metrics.record(metrics)
+
+        # Learn per-repository sizes from full (not resumed) runs for future plans
+        if status == "completed" and not download.get("dry_run") and not download.get("retry") and parser.image_bytes:
+            repo_bytes = {}
+            for image, size in parser.image_bytes.items():
+                repository = _image_repository(image)
+                repo_bytes[repository] = repo_bytes.get(repository, 0) + size
+            image_sizes.update(repo_bytes, mirror_planner.repository_counts(mapping_file))
+
+        record = self._history_record(download_id, download, status)
+        with self.lock:
+            download_history.append(record)
+            self.history_generation += 1
+
+    def _record_subscribers(self, download, subscribers, status):
+        """Add the requests attached to a download to history with its outcome"""
+        with self.lock:
+            for subscriber in subscribers:
+                download_history.append(self._coalesced_record(
+                    subscriber["id"], download, subscriber["name"], subscriber["home_dir"], status,
+                    subscriber["start_time"]))
+            self.history_generation += 1
+
+    def _generate_summary_report(self, download, parser=None):
+        """Generate a comprehensive summary report for a download"""
+        try:
+            home_dir = download.get('home_dir', HOME_DIR)
+            name = download.get('name')
+            component = download.get('component')
+            version = download.get('version')
+            status = download.get('status')
+            start_time = download.get('start_time')
+            end_time = download.get('end_time')
+            final_registry = download.get('final_registry', 'N/A')
+            registry_auth_file = download.get('registry_auth_file', 'N/A')
+            filter_pattern = download.get('filter', 'None')
+            pid = download.get('pid', 'N/A')
+            return_code = download.get('return_code', 'N/A')
+            
+            # Calculate duration
+            try:
+                start_dt = datetime.fromisoformat(start_time)
+                end_dt = datetime.fromisoformat(end_time)
+                duration = str(end_dt - start_dt)
+                duration_seconds = (end_dt - start_dt).total_seconds()
+            except:
+                duration = "N/A"
+                duration_seconds = 0
+            
+            # Get directory information
+            download_dir = f"{home_dir}/{name}"
+            dir_size = "N/A"
+            dir_size_bytes = 0
+            if os.path.exists(download_dir):
+                try:
+                    result = _run_command(
+                        "du",
+                        f"du -sh {download_dir}",
+                        shell=True,
+                        capture_output=True,
+                        text=True
+                    )
+                    if result.returncode == 0:
+                        dir_size = result.stdout.split()[0]
+                    
+                    # Get size in bytes
+                    result_bytes = _run_command(
+                        "du",
+                        f"du -sb {download_dir}",
+                        shell=True,
+                        capture_output=True,
+                        text=True
+                    )
+                    if result_bytes.returncode == 0:
+                        dir_size_bytes = int(result_bytes.stdout.split()[0])
+                        download['size_bytes'] = dir_size_bytes
+                except:
+                    pass
+            
+            # Count files and directories
+            file_count = 0
+            dir_count = 0
+            image_files = 0
+            mapping_files = 0
+            log_files = 0
+            if os.path.exists(download_dir):
+                try:
+                    for root, dirs, files in os.walk(download_dir):
+                        dir_count += len(dirs)
+                        file_count += len(files)
+                        for f in files:
+                            if f.endswith(('.tar', '.tar.gz', '.tgz')):
+                                image_files += 1
+                            elif 'mapping' in f.lower():
+                                mapping_files += 1
+                            elif f.endswith('.log'):
+                                log_files += 1
+                except:
+                    pass
+            
+            # Check for specific files
+            log_file = f"{download_dir}/{name}-download.log"
+            mapping_file = f"{download_dir}/mapping.txt"
+            config_file = f"{download_dir}/.image-config.json"
+            
+            log_exists = "Yes" if os.path.exists(log_file) else "No"
+            mapping_exists = "Yes" if os.path.exists(mapping_file) else "No"
+            config_exists = "Yes" if os.path.exists(config_file) else "No"
+            
+            # Get log file size
+            log_size = "N/A"
+            if os.path.exists(log_file):
+                try:
+                    log_size_bytes = os.path.getsize(log_file)
+                    if log_size_bytes < 1024:
+                        log_size = f"{log_size_bytes} B"
+                    elif log_size_bytes < 1024*1024:
+                        log_size = f"{log_size_bytes/1024:.2f} KB"
+                    else:
+                        log_size = f"{log_size_bytes/(1024*1024):.2f} MB"
+                except:
+                    pass
+            
+            # Count images in mapping file
+            image_count_from_mapping = 0
+            if os.path.exists(mapping_file):
+                try:
+                    with open(mapping_file, 'r') as f:
+                        image_count_from_mapping = len([line for line in f if line.strip() and not line.startswith('#')])
+                except:
+                    pass
+            
+            # Get system information
+            hostname = "N/A"
+            try:
+                result = _run_command("hostname", "hostname", shell=True, capture_output=True, text=True)
+                if result.returncode == 0:
+                    hostname = result.stdout.strip()
+            except:
+                pass
+            
+            # Get disk space
+            disk_space = "N/A"
+            try:
+                result = _run_command(
+                    "df",
+                    f"df -h {home_dir} | tail -1",
+                    shell=True,
+                    capture_output=True,
+                    text=True
+                )
+                if result.returncode == 0:
+                    parts = result.stdout.split()
+                    if len(parts) >= 5:
+                        disk_space = f"Total: {parts[1]}, Used: {parts[2]}, Available: {parts[3]}, Use%: {parts[4]}"
+            except:
+                pass
+            
+            # Calculate transfer rate
+            transfer_rate = "N/A"
+            if dir_size_bytes > 0 and duration_seconds > 0:
+                rate_mbps = (dir_size_bytes / (1024*1024)) / duration_seconds
+                transfer_rate = f"{rate_mbps:.2f} MB/s"
+            
+            # Get error information from the parsed log events
+            error_info = ""
+            if parser is not None:
+                # Every distinct cause in the log, not just the last lines
+                error_lines = []
+                for cause in parser.error_index.distinct_causes("error"):
+                    error_lines.append(f"[{cause['failure_class']}] x{cause['count']}, first at byte "
+                                       f"{cause['first_offset']}: {cause['example']}")
+                    images = cause["images"]
+                    if images:
+                        error_lines.append("    Images: " + ", ".join(images[:5])
+                                           + (f" (+{len(images) - 5} more)" if len(images) > 5 else ""))
+                error_info = "\n".join(error_lines)
+            elif status == "failed":
+                try:
+                    # Get last 10 lines for error context
+                    lines = LogArchive(log_file).tail(10)
+                    error_lines = [line.strip() for line in lines if 'error' in line.lower() or 'fail' in line.lower()]
+                    if error_lines:
+                        error_info = "\n".join(error_lines[:5])  # Show up to 5 error lines
+                except:
+                    pass
+            
+            # Mirror progress as seen in the log events
+            mirror_summary = ""
+            if parser is not None:
+                mirror_summary = f"""
+MIRROR ACTIVITY
+---------------
+Images Mirrored:        {parser.images_finished}
+Images Failed:          {len(parser.failed_images)}
+Blobs Copied:           {parser.blobs_copied} ({_format_bytes(parser.bytes_copied)})
+Errors / Warnings:      {parser.errors} / {parser.warnings}
+"""
+            
+            # Automatic retry history
+            attempts = download.get("attempts") or []
+            if len(attempts) > 1:
+                mirror_summary += "\nATTEMPTS\n--------\n" + "\n".join(
+                    f"#{a['attempt']}  {a['status']:<10} {a.get('failure_class') or '-':<18} "
+                    f"started {a.get('start_time') or 'N/A'}"
+                    + (f", retried {a['retry_images'] or 'all'} images after {a['retry_delay_seconds']}s"
+                       if "retry_delay_seconds" in a else "")
+                    for a in attempts
+                ) + "\n"
+            
+            # Resource usage accounted by the job's cgroup
+            resources = download.get("resources")
+            if resources:
+                mirror_summary += f"""
+RESOURCE USAGE
+--------------
+CPU Time:               {resources.get('cpu_seconds', 0):.1f}s (user {resources.get('cpu_user_seconds', 0):.1f}s, system {resources.get('cpu_system_seconds', 0):.1f}s)
+CPU Throttled:          {resources.get('cpu_throttled_seconds', 0):.1f}s
+Memory Peak:            {_format_bytes(resources.get('memory_peak_bytes', resources.get('memory_bytes')))}
+IO Read / Written:      {_format_bytes(resources.get('io_read_bytes'))} / {_format_bytes(resources.get('io_write_bytes'))}
+OOM Kills:              {resources.get('oom_kills', 0)}
+"""
+
+            # Process tree sampled from /proc
+            profiler = download.get("profiler")
+            if profiler:
+                profile = profiler.summary()
+                mirror_summary += f"""
+PROCESS PROFILE
+---------------
+Samples:                {profile['samples']} every {profile['interval']:g}s ({log_file}{PROFILE_SUFFIX})
+CPU Time:               {profile['cpu_seconds']:.1f}s
+Peak Memory (RSS):      {_format_bytes(profile['peak_rss_bytes'])} in up to {profile['peak_processes']} processes
+Read / Written:         {_format_bytes(profile.get('read_chars'))} / {_format_bytes(profile.get('write_chars'))} (disk {_format_bytes(profile.get('disk_read_bytes'))} / {_format_bytes(profile.get('disk_write_bytes'))})
+Stalls:                 {len(profile['stalls'])} ({profile['stalled_seconds']}s), hung restarts: {profile['hung_restarts']}
+""" + "".join(f"  {s['start']}  {s['kind']:<8} {s.get('seconds', 0)}s{' (hung)' if s.get('hung') else ''}\n"
+              for s in profile["stalls"][-10:])
+
+            # Generate report content
+            report_content = f"""
+================================================================================
+                    CP4I DOWNLOAD SUMMARY REPORT
+================================================================================
+
+DOWNLOAD INFORMATION
+--------------------
+Component:              {component}
+Version:                {version}
+Directory Name:         {name}
+Status:                 {status.upper()}
+Process ID:             {pid}
+Exit Code:              {return_code}
+
+TIMING DETAILS
+--------------
+Start Time:             {start_time}
+End Time:               {end_time}
+Duration:               {duration}
+Transfer Rate:          {transfer_rate}
+{mirror_summary}
+CONFIGURATION
+-------------
+Home Directory:         {home_dir}
+Download Directory:     {download_dir}
+Target Registry:        {final_registry}
+Registry Auth File:     {registry_auth_file}
+Filter Pattern:         {filter_pattern}
+
+FILE SYSTEM DETAILS
+-------------------
+Directory Exists:       {'Yes' if os.path.exists(download_dir) else 'No'}
+Directory Size:         {dir_size}
+Total Files:            {file_count}
+Total Directories:      {dir_count}
+Image Files (.tar):     {image_files}
+Mapping Files:          {mapping_files}
+Log Files:              {log_files}
+
+KEY FILES
+---------
+Download Log:           {log_file}
+  - Exists:             {log_exists}
+  - Size:               {log_size}
+
+Mapping File:           {mapping_file}
+  - Exists:             {mapping_exists}
+  - Images Listed:      {image_count_from_mapping}
+
+Config File:            {config_file}
+  - Exists:             {config_exists}
+
+SYSTEM INFORMATION
+------------------
+Hostname:               {hostname}
+Disk Space ({home_dir}):
+  {disk_space}
+"""
+            
+            # Add error information if failed
+            if error_info:
+                report_content += f"""
+ERROR DETAILS
+-------------
+Distinct failure causes (GET /api/downloads/<id>/errors for every occurrence):
+{error_info}
+"""
+            
+            report_content += f"""
+================================================================================
+Report Generated:       {datetime.now().isoformat()}
+================================================================================
+"""
+            
+            # Save report to file
+            report_file = f"{home_dir}/{name}-summary-report.txt"
+            os.makedirs(home_dir, exist_ok=True)
+            with open(report_file, 'w') as f:
+                f.write(report_content)
+            
+            job_logger(download.get("id"), "cp4i.report").info("Summary report generated: %s", report_file)
+            return report_file
+            
+        except Exception as e:
+            job_logger(download.get("id"), "cp4i.report").exception("Error generating summary report: %s", e)
+            return None
+    
+    def _new_download(self, download_id, component, version, name, filter_pattern, dry_run, home_dir,
+                      final_registry, registry_auth_file, entitlement_key, estimated_bytes, estimate_source,
+                      fs_device, retry=False):
+        """Build the active-download record for a job that has not been spawned yet"""
+        return {
+            "id": download_id,
+            "component": component,
+            "version": version,
+            "name": name,
+            "filter": filter_pattern,
+            "dry_run": dry_run,
+            "retry": retry,
+            "process": None,
+            "status": "queued",
+            "start_time": datetime.now().isoformat(),
+            "queued_time": datetime.now().isoformat(),
+            "pid": None,
+            "mirror_pid": None,  # Will be populated by monitoring
+            "log_file": f"{home_dir}/{name}/{name}-download.log",
+            "home_dir": home_dir,
+            "final_registry": final_registry,
+            "registry_auth_file": registry_auth_file,
+            "entitlement_key": entitlement_key,
+            "estimated_bytes": estimated_bytes,
+            "estimate_source": estimate_source,
+            "written_bytes": 0,
+            "fs_device": fs_device
+        }
+    
+    def start_download(self, download_id, component, version, name, filter_pattern=None, dry_run=False,
+                      home_dir=None, final_registry=None, registry_auth_file=None, entitlement_key=None,
+                      on_insufficient_space="queue", auto_retry=True, coalesce=True, limits=None, worker=None,
+                      dry_run_mode="auto"):
+        """Start a new download process, or queue it until enough disk space is free
+        
+        With coalesce, a request for the same content as an in-flight or
+        completed download is served from that download instead. When worker
+        agents are registered, the download may be dispatched to one of them;
+        `worker` names a specific host, "local" keeps it on this server.
+        Dry runs are answered from the cached mapping file when there is one,
+        unless dry_run_mode is "live"; "fast" fails instead of running the script.
+        """
+        # Use provided values or defaults
+        home_dir = home_dir or HOME_DIR
+        final_registry = final_registry or "registry.example.com:5000"
+        registry_auth_file = registry_auth_file or "/root/.docker/config.json"
+        
+        if worker != "local" and (worker or self.workers.has_workers()):
+            limits = limits or _job_limits()
+            placed = self._place_on_worker(download_id, worker, {
+                "component": component, "version": version, "name": name, "filter": filter_pattern,
+                "dry_run": dry_run, "home_dir": home_dir, "final_registry": final_registry,
+                "registry_auth_file": registry_auth_file, "entitlement_key": entitlement_key,
+                "on_insufficient_space": on_insufficient_space, "auto_retry": auto_retry, "coalesce": coalesce,
+                "dry_run_mode": dry_run_mode,
+                "io_weight": limits["io_weight"], "cpu_limit": limits["cpu_limit"],
+                "memory_limit": str(limits["memory_limit"]) if limits["memory_limit"] else None
+            })
+            if placed is not None:
+                return placed
+        
+        # Only once the job stays here: a worker answers dry runs from its own cache
+        if dry_run and dry_run_mode != "live":
+            planned = self._fast_dry_run(download_id, component, version, name, filter_pattern, home_dir,
+                                         final_registry, registry_auth_file, entitlement_key)
+            if planned is not None:
+                return planned
+            if dry_run_mode == "fast":
+                return {"error": f"No cached mapping file for {component} {version} generated with this filter "
+                                 f"from the current CASE", "mapping_missing": True}
+            job_logger(download_id).info("No usable cached mapping file, running a live dry run")
+        
+        link_source = None
+        if coalesce:
+            coalesced = self._coalesce(download_id, component, version, name, filter_pattern, dry_run,
+                                       home_dir, final_registry)
+            if coalesced and coalesced.pop("attached", False):
+                return coalesced
+            link_source = coalesced
+        
+        # The script appends to an existing log, so an archived one is unpacked first
+        try:
+            _restore_log(f"{home_dir}/{name}/{name}-download.log")
+        except OSError as e:
+            return {"error": f"Cannot restore archived log: {e}"}
+        
+        with self.lock:
+            if download_id in self.downloads:
+                return {"error": "Download already in progress"}
+            if retention.is_deleting(home_dir, name):
+                return {"error": f"Directory {name} is being deleted by retention, try again shortly"}
+            
+            if link_source:
+                # Served from a completed download's files: link them on the supervisor, no space needed
+                download = self._new_download(
+                    download_id, component, version, name, filter_pattern, dry_run, home_dir, final_registry,
+                    registry_auth_file, entitlement_key, 0, "linked", None)
+                download.update(status="linking", auto_retry=auto_retry, limits=limits or _job_limits(),
+                                linking_from=f"{link_source.get('home_dir') or HOME_DIR}/{link_source['name']}")
+                try:
+                    download["fs_device"], _ = self.capacity.filesystem_of(home_dir)
+                except OSError:
+                    pass
+                self.downloads[download_id] = download
+                self.supervisor.submit(self._link_completed(download_id, download, link_source))
+                return {"success": True, "download_id": download_id, "status": "linking",
+                        "coalesced": "linked", "source_id": link_source["id"]}
+            
+            # Estimate the job size and check it against free space and other jobs' reservations
+            estimated_bytes, estimate_source = self.capacity.estimate_bytes(
+                component, version, filter_pattern, dry_run
+            )
+            try:
+                fit = self.capacity.check_fit(home_dir, estimated_bytes)
+            except OSError as e:
+                return {"error": f"Cannot check disk space for {home_dir}: {e}"}
+            
+            if not fit["fits"] and on_insufficient_space == "reject":
+                return {
+                    "error": "Insufficient disk space for download",
+                    "insufficient_space": True,
+                    "capacity": fit,
+                    "estimate_source": estimate_source
+                }
+            
+            download = self._new_download(
+                download_id, component, version, name, filter_pattern, dry_run, home_dir, final_registry,
+                registry_auth_file, entitlement_key, estimated_bytes, estimate_source, fit["fs_device"]
+            )
+            download["auto_retry"] = auto_retry
+            download["limits"] = limits or _job_limits()
+            self.downloads[download_id] = download
+            self._ensure_capacity_watcher()
+            
+            if not fit["fits"]:
+                download["queued_reason"] = (
+                    f"Waiting for disk space: needs {_format_bytes(estimated_bytes)}, "
+                    f"{_format_bytes(fit['available_bytes'])} available after reservations"
+                )
+                job_logger(download_id, "cp4i.capacity").info("Queued: %s", download["queued_reason"])
+                self.notifier.notify("queued", download_id, download, download["queued_reason"])
+                return {"success": True, "download_id": download_id, "status": "queued",
+                        "estimated_bytes": estimated_bytes, "capacity": fit}
+            
+            spawned = self._launch_download(download_id)
+        
+        # Wait for the spawn outside the lock, the supervisor needs it to record the pid
+        result = self._await_spawn(download_id, spawned)
+        if "error" not in result:
+            result["estimated_bytes"] = estimated_bytes
+        return result
+    
+    def _fast_dry_run(self, download_id, component, version, name, filter_pattern, home_dir, final_registry,
+                      registry_auth_file, entitlement_key):
+        """Complete a dry run from the cached mapping file, without the script or network access
+
+        Returns None when there is no cached mapping file, or when it was
+        generated with another filter or from another CASE.
+        """
+        plan = mirror_planner.plan(component, version, filter_pattern, home_dir, final_registry)
+        if "error" in plan:
+            return None if plan.get("mapping_missing") else plan
+        if plan["mapping_source"]["mismatch"]:
+            job_logger(download_id).info("Cached mapping file does not apply: %s", plan["mapping_source"]["mismatch"])
+            return None
+        
+        log_file = f"{home_dir}/{name}/{name}-download.log"
+        try:
+            with self.lock:
+                if any(d["name"] == name and d["home_dir"] == home_dir for d in self.downloads.values()):
+                    return {"error": "Download already in progress"}
+                plan["capacity"] = self.capacity.check_fit(home_dir, plan["estimated_bytes"])
+            _restore_log(log_file)
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+            log_start_offset = _file_size(log_file)
+            with open(f"{home_dir}/{name}/{name}-plan.json", 'w') as f:
+                json.dump(plan, f, indent=2)
+            # Same log format as the script, so reports and the log viewer work unchanged
+            stamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            lines = [f"[INFO] [Dry Run] Plan from cached mapping file {plan['mapping_file']} "
+                     f"(updated {plan['mapping_updated']})",
+                     f"[INFO] [Dry Run] {plan['images_matched']} of {plan['images_total']} images, "
+                     f"estimated {_format_bytes(plan['estimated_bytes'])}, "
+                     f"{_format_bytes(plan['capacity']['available_bytes'])} available"]
+            lines += [f"[INFO] [Dry Run] Would mirror {image['source']} -> {image['target']}" for image in plan["images"]]
+            lines += [f"[WARN] [Dry Run] {warning}" for warning in plan["warnings"]]
+            lines.append("[SUCCESS] [Dry Run] Image mirror simulation completed successfully")
+            with open(log_file, 'a') as f:
+                f.writelines(f"[{stamp}] {line}\n" for line in lines)
+        except OSError as e:
+            return {"error": f"Cannot write dry run plan: {e}"}
+        
+        download = self._new_download(
+            download_id, component, version, name, filter_pattern, True, home_dir, final_registry,
+            registry_auth_file, entitlement_key, plan["estimated_bytes"], "plan", plan["capacity"]["fs_device"])
+        download.update(status="completed", progress=100, end_time=datetime.now().isoformat(),
+                        log_start_offset=log_start_offset, images_total=plan["images_matched"],
+                        dry_run_source="cache")
+        self._record_finished(download_id, download, "completed")
+        job_logger(download_id).info("Dry run served from the cached mapping file")
+        self.notifier.notify("completed", download_id, download, f"Dry run completed for {component} v{version}")
+        return {"success": True, "download_id": download_id, "status": "completed", "dry_run": True,
+                "dry_run_source": "cache", "plan": plan}
+    
+    def _place_on_worker(self, download_id, worker, request):
+        """Dispatch a download to the least loaded worker agent; None means run it on this server"""
+        estimated_bytes, _ = self.capacity.estimate_bytes(
+            request["component"], request["version"], request["filter"], request["dry_run"])
+        with self.lock:
+            statuses = [d["status"] for d in self.downloads.values()]
+            try:
+                available = self.capacity.check_fit(request["home_dir"], 0)["available_bytes"]
+            except OSError:
+                available = 0
+        local_load = {"slots": WORKER_SLOTS, "available_bytes": available,
+                      "running": sum(1 for s in statuses if s not in FINISHED_STATUSES and s != "queued")}
+        
+        candidates = self.workers.candidates(worker, estimated_bytes, local_load)
+        if worker and not candidates:
+            return {"error": f"Worker {worker} is not online or is draining"}
+        for name in candidates:
+            if name == "local":
+                return None
+            result = self.workers.dispatch(name, download_id, request)
+            if result is not None:
+                return result
+        if COORDINATOR_RUNS_JOBS and not worker:
+            return None
+        return {"error": "No worker could be reached to run the download"}
+    
+    def _coalesce_key(self, download):
+        """What a download mirrors; downloads with equal keys produce the same content"""
+        return (download["component"], download["version"], download.get("filter") or None,
+                download.get("final_registry"), bool(download.get("dry_run")))
+    
+    def _coalesce(self, download_id, component, version, name, filter_pattern, dry_run, home_dir, final_registry):
+        """Attach a request to an equivalent in-flight download, or find a completed one to link from
+        
+        Returns the API result of an attached request, the history entry of a
+        completed download to link from, or None when the request needs its
+        own download.
+        """
+        key = self._coalesce_key({"component": component, "version": version, "filter": filter_pattern,
+                                  "final_registry": final_registry, "dry_run": dry_run})
+        with self.lock:
+            for primary_id, primary in self.downloads.items():
+                if (primary.get("finalized") or primary["status"] in FINISHED_STATUSES + ("linking",)
+                        or self._coalesce_key(primary) != key):
+                    continue
+                if primary["name"] != name or primary["home_dir"] != home_dir:
+                    primary.setdefault("subscribers", []).append({
+                        "id": download_id, "name": name, "home_dir": home_dir,
+                        "start_time": datetime.now().isoformat()
+                    })
+                job_logger(primary_id, "cp4i.manager").info("Attached request %s (%s)", download_id, name)
+                return {"success": True, "download_id": primary_id, "status": primary["status"],
+                        "coalesced": "attached", "attached": True}
+            
+            source = None
+            if not dry_run:
+                source = next((h for h in reversed(download_history)
+                               if h.get("status") == "completed" and self._coalesce_key(h) == key
+                               and os.path.isdir(f"{h.get('home_dir') or HOME_DIR}/{h['name']}")
+                               and not retention.is_deleting(h.get('home_dir') or HOME_DIR, h['name'])), None)
+        return source
+    
+    async def _link_completed(self, download_id, download, source):
+        """Materialise a download by hard-linking a completed one's tree; download it if that fails"""
+        log = job_logger(download_id, "cp4i.manager")
+        try:
+            linked = await self.supervisor.run_blocking(
+                _hardlink_tree, download["linking_from"], f"{download['home_dir']}/{download['name']}",
+                (f"{source['name']}-download.log", f"{download['name']}-download.log"))
+        except OSError as e:
+            log.info("Cannot link from completed download %s, downloading instead: %s", source["id"], e)
+            estimated_bytes, estimate_source = self.capacity.estimate_bytes(
+                download["component"], download["version"], download.get("filter"))
+            with self.lock:
+                if self.downloads.get(download_id) is not download:
+                    return  # Dismissed meanwhile
+                download.update(estimated_bytes=estimated_bytes, estimate_source=estimate_source, status="queued",
+                                queued_reason="Linking failed, waiting for disk space to download")
+                self._ensure_capacity_watcher()
+            return
+        
+        with self.lock:
+            if self.downloads.get(download_id) is not download:
+                return
+            del self.downloads[download_id]
+            download_history.append(self._coalesced_record(
+                download_id, source, download["name"], download["home_dir"], "completed", download["start_time"]))
+            self.history_generation += 1
+        log.info("Materialised from completed download %s (%d files linked)", source["id"], linked)
+    
+    def _coalesced_record(self, download_id, source, name, home_dir, status, start_time=None):
+        """History entry for a request served by another download"""
+        now = datetime.now().isoformat()
+        record = dict(source, name=name, home_dir=home_dir, start_time=start_time or now, end_time=now,
+                      coalesced_from=source["id"], metrics=None, attempts=[], resources=None)
+        return self._history_record(download_id, record, status)
+    
+    def _settle_subscribers(self, download_id, download, status):
+        """Give requests attached to a finished download its outcome, linking completed content"""
+        with self.lock:
+            subscribers = download.pop("subscribers", [])
+        source_dir = f"{download['home_dir']}/{download['name']}"
+        for subscriber in subscribers:
+            log = job_logger(subscriber["id"], "cp4i.manager")
+            outcome = status
+            if status == "completed":
+                try:
+                    linked = _hardlink_tree(source_dir, f"{subscriber['home_dir']}/{subscriber['name']}",
+                                            (f"{download['name']}-download.log", f"{subscriber['name']}-download.log"))
+                    log.info("Materialised from %s (%d files linked)", download_id, linked)
+                except OSError as e:
+                    log.error("Cannot link from %s: %s", download_id, e)
+                    outcome = "failed"
+            with self.lock:
+                download_history.append(self._coalesced_record(
+                    subscriber["id"], download, subscriber["name"], subscriber["home_dir"], outcome,
+                    subscriber["start_time"]))
+                self.history_generation += 1
+    
+    def retry_download(self, download_id, overrides=None):
+        """Re-run a finished or failed download with the script's --retry flag"""
+        overrides = overrides or {}
+        with self.lock:
+            download = self.downloads.get(download_id)
+            if not download:
+                download = next((h for h in download_history if h["id"] == download_id), None)
+            if not download:
+                return {"error": "Download not found"}
+            download = dict(download)
+        
+        # User supplied values win over the stored configuration
+        home_dir = overrides.get("home_dir") or download.get("home_dir") or HOME_DIR
+        final_registry = (overrides.get("final_registry") or download.get("final_registry")
+                          or "registry.example.com:5000")
+        registry_auth_file = (overrides.get("registry_auth_file") or download.get("registry_auth_file")
+                              or "/root/.docker/config.json")
+        entitlement_key = overrides.get("entitlement_key") or download.get("entitlement_key")
+        prior_limits = download.get("limits") or {}
+        try:
+            limits = _job_limits({key: overrides.get(key) or prior_limits.get(key)
+                                  for key in ("io_weight", "cpu_limit", "memory_limit")})
+        except ValueError as e:
+            return {"error": str(e)}
+        name = download["name"]
+        log = job_logger(download_id, "cp4i.manager")
+        log.info("Retrying with home_dir=%s, final_registry=%s", home_dir, final_registry)
+        
+        # Reserve what is left of the original estimate; the resumed mirror skips blobs already on disk
+        estimated_bytes, estimate_source = self.capacity.estimate_bytes(
+            download["component"], download["version"], download.get("filter")
+        )
+        download_dir = f"{home_dir}/{name}"
+        written_bytes = _dir_size_bytes(download_dir) if os.path.isdir(download_dir) else 0
+        try:
+            _restore_log(f"{download_dir}/{name}-download.log")
+        except OSError as e:
+            return {"error": f"Cannot restore archived log: {e}"}
+        try:
+            fs_device, _ = self.capacity.filesystem_of(home_dir)
+        except OSError as e:
+            return {"error": f"Cannot check disk space for {home_dir}: {e}"}
+        
+        new_download_id = f"{name}-retry-{int(time.time())}"
+        reserve_bytes = max(estimated_bytes, written_bytes)
+        with self.lock:
+            # Retries pass the same admission check as new downloads, for what is left to write
+            try:
+                fit = self.capacity.check_fit(home_dir, reserve_bytes - written_bytes)
+            except OSError as e:
+                return {"error": f"Cannot check disk space for {home_dir}: {e}"}
+            if not fit["fits"] and overrides.get("on_insufficient_space") == "reject":
+                return {
+                    "error": "Insufficient disk space for download",
+                    "insufficient_space": True,
+                    "capacity": fit,
+                    "estimate_source": estimate_source
+                }
+            
+            # Remove any existing downloads and history entries for this name to avoid duplicates
+            for did in [did for did, d in self.downloads.items() if d.get("name") == name]:
+                del self.downloads[did]
+                job_logger(did, "cp4i.manager").info("Removed old download before retry")
+            download_history[:] = [h for h in download_history if h.get("name") != name]
+            self.history_generation += 1
+            log.debug("Cleaned history for %s", name)
+            
+            retry = self._new_download(
+                new_download_id, download["component"], download["version"], name, download.get("filter"),
+                False, home_dir, final_registry, registry_auth_file, entitlement_key,
+                reserve_bytes, estimate_source, fs_device, retry=True
+            )
+            retry["written_bytes"] = written_bytes
+            retry["limits"] = limits
+            self.downloads[new_download_id] = retry
+            self._ensure_capacity_watcher()
+            
+            if not fit["fits"]:
+                retry["queued_reason"] = (
+                    f"Waiting for disk space: needs {_format_bytes(fit['required_bytes'])}, "
+                    f"{_format_bytes(fit['available_bytes'])} available after reservations"
+                )
+                log.info("Retry queued: %s", retry["queued_reason"])
+                return {"success": True, "download_id": new_download_id, "status": "queued", "capacity": fit}
+            
+            spawned = self._launch_download(new_download_id)
+        
+        return self._await_spawn(new_download_id, spawned)
+    
+    def _build_command(self, download):
+        """Command line and environment for a download's script run"""
+        cmd = [
+            "bash", SCRIPT_PATH,
+            "--component", download["component"],
+            "--version", download["version"],
+            "--name", download["name"]
+        ]
+        
+        if download.get("filter"):
+            cmd.extend(["--filter", download["filter"]])
+        
+        if download.get("dry_run"):
+            cmd.append("--dry-run")
+        
+        if download.get("retry"):
+            cmd.append("--retry")  # Use the script's built-in retry mechanism
+            if download.get("mapping_file"):
+                cmd.extend(["--mapping-file", download["mapping_file"]])
+        
+        # Build environment variables
+        env = os.environ.copy()
+        env["HOME_DIR"] = download["home_dir"]
+        env["FINAL_REGISTRY"] = download["final_registry"]
+        env["REGISTRY_AUTH_FILE"] = download["registry_auth_file"]
+        if self.notifier.enabled:
+            env["CP4I_NOTIFY_VIA_SERVER"] = "true"  # the script leaves notifications to the dispatcher
+        if download.get("entitlement_key"):
+            env["ENTITLEMENT_KEY"] = download["entitlement_key"]
+        return cmd, env
+    
+    def _launch_download(self, download_id):
+        """Hand a download to the supervisor loop. Caller must hold the lock.
+        
+        Returns a future that resolves to the pid once the process is spawned.
+        """
+        download = self.downloads[download_id]
+        cmd, env = self._build_command(download)
+        
+        download.pop("queued_reason", None)
+        download["log_start_offset"] = _file_size(download["log_file"])
+        download["status"] = "starting"
+        download["start_time"] = datetime.now().isoformat()
+        
+        spawned = concurrent.futures.Future()
+        self.supervisor.submit(self._supervise(download_id, download, cmd, env, spawned))
+        return spawned
+    
+    def _await_spawn(self, download_id, spawned):
+        """Wait briefly for a launched download's pid. Caller must not hold the lock."""
+        try:
+            pid = spawned.result(timeout=SPAWN_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            return {"success": True, "download_id": download_id, "status": "starting"}
+        except Exception as e:
+            return {"error": str(e)}
+        return {"success": True, "download_id": download_id, "pid": pid, "status": "running"}
+    
+    def _ensure_capacity_watcher(self):
+        """Start the periodic disk space watcher once. Caller must hold the lock."""
+        if self._capacity_watch is None or self._capacity_watch.done():
+            self._capacity_watch = self.supervisor.every(
+                CAPACITY_CHECK_INTERVAL, self._capacity_tick, "capacity watcher"
+            )
+    
+    def _signal_download(self, download, sig):
+        """Send a signal to a download's whole process group"""
+        process = download.get("process")
+        if not process or process.returncode is not None:
+            return False
+        try:
+            os.killpg(process.pid, sig)
+            return True
+        except ProcessLookupError:
+            return False
+    
+    def _capacity_tick(self):
+        """Run one pass of the capacity watcher"""
+        with self.lock:
+            started = [(did, d["home_dir"], d["name"]) for did, d in self.downloads.items()
+                       if d["status"] != "queued"]
+        
+        # Measure written bytes outside the lock, directory walks can be slow
+        written = {did: _dir_size_bytes(f"{home_dir}/{name}") for did, home_dir, name in started}
+        
+        with self.lock:
+            now = time.time()
+            for did, size in written.items():
+                if did in self.downloads:
+                    download = self.downloads[did]
+                    last_size, last_time = download.get("_written_sample", (size, now))
+                    if now > last_time:
+                        download["throughput_bytes_per_sec"] = max(0.0, (size - last_size) / (now - last_time))
+                    download["_written_sample"] = (size, now)
+                    download["written_bytes"] = size
             
-            # Get directory information
-            download_dir = f"{home_dir}/{name}"
-            dir_size = "N/A"
-            dir_size_bytes = 0
-            if os.path.exists(download_dir):
+            free_by_device = {}
+            for did, download in list(self.downloads.items()):
+                device = download.get("fs_device")
+                if device not in free_by_device:
+                    try:
+                        free_by_device[device] = self.capacity.free_bytes(download["home_dir"])
+                    except OSError:
+                        continue
+                free = free_by_device[device]
+                
+                # Pause before ENOSPC, resume once space has been reclaimed
+                if download["status"] in ("running", "progressing") and free < DISK_PAUSE_FREE_BYTES:
+                    if self._signal_download(download, signal.SIGSTOP):
+                        download["resume_status"] = download["status"]
+                        download["status"] = "paused"
+                        download["paused_reason"] = f"Low disk space: {_format_bytes(free)} free"
+                        job_logger(did, "cp4i.capacity").warning("Paused: %s", download["paused_reason"])
+                elif download["status"] == "paused" and free >= DISK_RESUME_FREE_BYTES:
+                    if self._signal_download(download, signal.SIGCONT):
+                        download["status"] = download.pop("resume_status", "running")
+                        download.pop("paused_reason", None)
+                        job_logger(did, "cp4i.capacity").info("Resumed: %s free", _format_bytes(free))
+            
+            # Admit queued jobs in arrival order while they fit
+            for did, download in list(self.downloads.items()):
+                if download["status"] != "queued":
+                    continue
                 try:
-                    result = subprocess.run(
-                        f"du -sh {download_dir}",
-                        shell=True,
-                        capture_output=True,
-                        text=True
-                    )
-                    if result.returncode == 0:
-                        dir_size = result.stdout.split()[0]
-                    
-                    # Get size in bytes
-                    result_bytes = subprocess.run(
-                        f"du -sb {download_dir}",
-                        shell=True,
-                        capture_output=True,
-                        text=True
+                    fit = self.capacity.check_fit(download["home_dir"], self.capacity.outstanding_bytes(download),
+                                                  exclude_id=did)
+                except OSError:
+                    continue
+                if not fit["fits"]:
+                    download["queued_reason"] = (
+                        f"Waiting for disk space: needs {_format_bytes(fit['required_bytes'])}, "
+                        f"{_format_bytes(fit['available_bytes'])} available after reservations"
                     )
-                    if result_bytes.returncode == 0:
-                        dir_size_bytes = int(result_bytes.stdout.split()[0])
-                except:
-                    pass
-            
-            # Count files and directories
-            file_count = 0
-            dir_count = 0
-            image_files = 0
-            mapping_files = 0
-            log_files = 0
-            if os.path.exists(download_dir):
+                    continue
                 try:
-                    for root, dirs, files in os.walk(download_dir):
-                        dir_count += len(dirs)
-                        file_count += len(files)
-                        for f in files:
-                            if f.endswith(('.tar', '.tar.gz', '.tgz')):
-                                image_files += 1
-                            elif 'mapping' in f.lower():
-                                mapping_files += 1
-                            elif f.endswith('.log'):
-                                log_files += 1
-                except:
-                    pass
-            
-            # Check for specific files
-            log_file = f"{download_dir}/{name}-download.log"
-            mapping_file = f"{download_dir}/mapping.txt"
-            config_file = f"{download_dir}/.image-config.json"
+                    self._launch_download(did)
+                    job_logger(did, "cp4i.capacity").info("Started queued download")
+                except Exception as e:
+                    job_logger(did, "cp4i.capacity").error("Failed to start queued download: %s", e)
+    
+    def get_capacity(self, home_dir=None, component=None, version=None, filter_pattern=None, dry_run=False):
+        """Report free space, reservations and, optionally, whether a prospective job fits"""
+        home_dir = home_dir or HOME_DIR
+        with self.lock:
+            result = {
+                "home_dir": home_dir,
+                "pause_below_bytes": DISK_PAUSE_FREE_BYTES,
+                "resume_above_bytes": DISK_RESUME_FREE_BYTES,
+                "jobs": [{
+                    "id": did,
+                    "status": d["status"],
+                    "home_dir": d["home_dir"],
+                    "estimated_bytes": d.get("estimated_bytes"),
+                    "estimate_source": d.get("estimate_source"),
+                    "written_bytes": d.get("written_bytes", 0),
+                    "outstanding_bytes": self.capacity.outstanding_bytes(d),
+                    "reason": d.get("queued_reason") or d.get("paused_reason")
+                } for did, d in self.downloads.items()]
+            }
+            if component and version:
+                estimated_bytes, source = self.capacity.estimate_bytes(component, version, filter_pattern, dry_run)
+                result["estimate"] = {"estimated_bytes": estimated_bytes, "source": source}
+                result.update(self.capacity.check_fit(home_dir, estimated_bytes))
+            else:
+                result.update(self.capacity.check_fit(home_dir, 0))
+                del result["fits"], result["required_bytes"]
+            return result
+    
+    async def _supervise(self, download_id, download, cmd, env, spawned):
+        """Run a download's script until it finishes, retrying transient failures, and record the result"""
+        log = job_logger(download_id)
+        try:
+            await self._drive_download(download_id, download, cmd, env, spawned, log)
+        finally:
+            await self.supervisor.run_blocking(self._release_job, download_id, download)
+        if LOG_ARCHIVE_ENABLED and download.get("status") == "completed":
+            await self.supervisor.run_blocking(self._archive_finished_log, download_id, download)
+    
+    async def _drive_download(self, download_id, download, cmd, env, spawned, log):
+        """Attempt loop behind _supervise"""
+        while True:
+            attempt = await self._run_attempt(download_id, download, cmd, env, spawned, log)
+            if attempt is None:
+                return
+            status, exit_task, output_task = attempt
+            delay = await self.supervisor.run_blocking(self._conclude_attempt, download_id, download, status, log)
+            if delay is None:
+                break
             
-            log_exists = "Yes" if os.path.exists(log_file) else "No"
-            mapping_exists = "Yes" if os.path.exists(mapping_file) else "No"
-            config_exists = "Yes" if os.path.exists(config_file) else "No"
+            # Let the failed run exit before starting the next one
+            await exit_task
+            await asyncio.wait({output_task}, timeout=1)
+            await asyncio.sleep(delay)
+            with self.lock:
+                if self.downloads.get(download_id) is not download:
+                    return  # Dismissed while waiting
+                if download["status"] != "retrying":
+                    status = download["status"]  # Stopped while waiting
+                    break
+                cmd, env = self._prepare_auto_retry(download)
+            spawned = concurrent.futures.Future()
+        
+        await self.supervisor.run_blocking(self._finish_monitored, download_id, download, status, log)
+        
+        # Keep the finished job visible briefly, then drop it from the active list
+        await asyncio.sleep(5)
+        with self.lock:
+            if self.downloads.get(download_id) is download:
+                del self.downloads[download_id]
+                log.info("Removed from active downloads")
+        
+        # Reap the process if the mirror finished before the script exited. Leftover
+        # children may keep the output pipe open; they are killed on release.
+        await exit_task
+        await asyncio.wait({output_task}, timeout=1)
+    
+    async def _run_attempt(self, download_id, download, cmd, env, spawned, log):
+        """Spawn the script once and follow it until the outcome is known
+        
+        Returns the status with the process exit and output reader tasks, or
+        None if the first attempt could not be spawned.
+        """
+        if "cgroup" not in download:
+            download["cgroup"] = await self.supervisor.run_blocking(
+                JobCgroup.create, download_id, download.get("limits") or {})
+        if download["cgroup"]:
+            cmd = download["cgroup"].wrap(cmd)
+        if REGISTRY_SESSIONS_ENABLED:
+            try:
+                env["REGISTRY_AUTH_FILE"] = await self.sessions.acquire(
+                    download.get("entitlement_key"), download["registry_auth_file"], self.supervisor.run_blocking)
+                env["CP4I_REGISTRY_SESSION"] = "true"
+            except (OSError, asyncio.TimeoutError) as e:
+                log.warning("No shared registry session, the script logs in itself: %s", e)
+        
+        SUBPROCESS_SPAWNS.inc(kind="retry" if download.get("retry") else "download")
+        try:
+            # Own session so the whole tree can be paused, resumed and stopped together
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                env=env,
+                start_new_session=True
+            )
+        except Exception as e:
+            log.error("Failed to start download: %s", e)
+            spawned.set_exception(e)
+            if not download.get("attempts"):
+                with self.lock:
+                    if self.downloads.get(download_id) is download:
+                        del self.downloads[download_id]
+                return None
+            # The previous attempt's follower must not be classified again as this attempt's outcome
+            download["log_follower"] = None
+            download["spawn_error"] = str(e)
+            done = asyncio.get_running_loop().create_future()
+            done.set_result(None)
+            return "failed", done, done
+        
+        with self.lock:
+            download["process"] = process
+            download["pid"] = process.pid
+            download["attempt_start_time"] = datetime.now().isoformat()
+            download["attempt"] = len(download.get("attempts", ())) + 1
+            if download["status"] == "starting":
+                download["status"] = "running"
+            if download["attempt"] == 1:
+                self.notifier.notify("started", download_id, download,
+                                     f"Download started for {download['component']} v{download['version']}")
+        spawned.set_result(process.pid)
+        if PROFILE_INTERVAL > 0:
+            download.setdefault("profiler", ProcessTreeProfiler()).attach(process.pid)
+        
+        follower = LogFollower(download["log_file"], download.get("log_start_offset", 0))
+        download["log_follower"] = follower
+        log.info("Started process %s, following log file: %s", process.pid, download["log_file"])
+        
+        # Drain stdout/stderr so the script never blocks on a full pipe
+        output_task = asyncio.ensure_future(self._read_output(download, process.stdout))
+        exit_task = asyncio.ensure_future(self._wait_exit(process))
+        
+        while True:
+            finished = exit_task.done()
+            await self.supervisor.run_blocking(self._follow_tick, download_id, download, finished, log)
             
-            # Get log file size
-            log_size = "N/A"
-            if os.path.exists(log_file):
-                try:
-                    log_size_bytes = os.path.getsize(log_file)
-                    if log_size_bytes < 1024:
-                        log_size = f"{log_size_bytes} B"
-                    elif log_size_bytes < 1024*1024:
-                        log_size = f"{log_size_bytes/1024:.2f} KB"
-                    else:
-                        log_size = f"{log_size_bytes/(1024*1024):.2f} MB"
-                except:
-                    pass
+            parser = follower.parser
+            if parser.fatal_error:
+                log.error("Mirror failed: %s", parser.fatal_error)
+                status = "failed"
+                break
+            if parser.mirror_completed:
+                log.info("Mirror completion detected")
+                status = "completed"
+                break
+            if finished:
+                # Process exited without a completion or fatal error event
+                download["return_code"] = process.returncode
+                log.info("Process finished with code %s", process.returncode)
+                if download.get("status") == "stopped":
+                    status = "stopped"
+                elif parser.dry_run and process.returncode == 0:
+                    log.info("Dry run completed")
+                    status = "completed"
+                elif process.returncode != 0:
+                    log.error("Process ended with error code %s", process.returncode)
+                    status = "failed"
+                else:
+                    # Exit code 0 but no completion message - treat as completed
+                    status = "completed"
+                break
             
-            # Count images in mapping file
-            image_count_from_mapping = 0
-            if os.path.exists(mapping_file):
-                try:
-                    with open(mapping_file, 'r') as f:
-                        image_count_from_mapping = len([line for line in f if line.strip() and not line.startswith('#')])
-                except:
-                    pass
+            profiler = download.get("profiler")
+            if profiler and profiler.hung and download.get("status") != "stopped":
+                log.error("Mirror hung: no IO progress for %.0f minutes, killing it", profiler.hung_timeout / 60)
+                download["hung"] = True
+                HUNG_MIRRORS.inc()
+                await self.supervisor.run_blocking(self._kill_job_tree, download)
+                status = "failed"
+                break
             
-            # Get system information
-            hostname = "N/A"
+            # Wake early when the process exits so the final pass runs immediately
+            await asyncio.wait({exit_task}, timeout=MONITOR_INTERVAL)
+        
+        return status, exit_task, output_task
+    
+    def _kill_job_tree(self, download):
+        """SIGKILL every process of a job: its cgroup, its process group and the logged mirror pid"""
+        killed = []
+        cgroup = download.get("cgroup")
+        if cgroup and cgroup.kill():
+            killed.append(f"cgroup:{os.path.basename(cgroup.path)}")
+        for label, pid, kill in (("group", download.get("pid"), os.killpg),
+                                 ("mirror", download.get("mirror_pid"), os.kill)):
+            if not pid:
+                continue
             try:
-                result = subprocess.run("hostname", shell=True, capture_output=True, text=True)
-                if result.returncode == 0:
-                    hostname = result.stdout.strip()
-            except:
+                kill(pid, signal.SIGKILL)
+                killed.append(f"{label}:{pid}")
+            except (ProcessLookupError, PermissionError):
                 pass
+        return killed
+    
+    def _release_job(self, download_id, download):
+        """Kill anything the script left behind and remove its cgroup. Runs on the worker pool."""
+        cgroup = download.get("cgroup")
+        if cgroup:
+            leftovers = cgroup.pids()
+            if leftovers:
+                job_logger(download_id, "cp4i.cgroup").info("Killing %d leftover processes", len(leftovers))
+                cgroup.kill()
+            download["resources"] = cgroup.stats()
+            cgroup.remove()
+            download["cgroup"] = None
+        elif download.get("process") is not None:
+            try:
+                os.killpg(download["process"].pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+    
+    def _archive_finished_log(self, download_id, download):
+        """Replace a completed download's log with its block-compressed archive. Runs on the worker pool."""
+        log_file = download["log_file"]
+        log = job_logger(download_id, "cp4i.manager")
+        try:
+            archived = _archive_log(log_file)
+        except OSError as e:
+            log.warning("Could not archive log %s: %s", log_file, e)
+            _discard_log_archive(log_file)
+            return
+        if archived is None:
+            return
+        log_bytes, archive_bytes = archived
+        with _log_archive_lock, self.lock:
+            # A retry or new download may have started writing to the log meanwhile, and its
+            # restore discards the archive: then the plain log is the only copy left
+            if not all(os.path.exists(log_file + suffix) for suffix in (LogArchive.SUFFIX, LogArchive.INDEX_SUFFIX)):
+                return
+            if (any(d.get("log_file") == log_file for d in self.downloads.values())
+                    or _file_size(log_file) != log_bytes):
+                _discard_log_archive(log_file)
+                return
+            os.remove(log_file)
+        LOG_ARCHIVE_BYTES.inc(log_bytes, stage="original")
+        LOG_ARCHIVE_BYTES.inc(archive_bytes, stage="archived")
+        log.info("Archived log: %s -> %s", _format_bytes(log_bytes), _format_bytes(archive_bytes))
+    
+    def _job_resources(self, download):
+        """Resource usage of a job: live from its cgroup, else the last snapshot"""
+        cgroup = download.get("cgroup")
+        return cgroup.stats() if cgroup else download.get("resources")
+    
+    async def _wait_exit(self, process):
+        """Wait for the script to exit, even while leftover children hold its output pipe open"""
+        if sys.version_info >= (3, 12):
+            return await process.wait()
+        # Before 3.12 Process.wait() also waits for the pipes to close
+        while process.returncode is None:
+            await asyncio.sleep(0.2)
+        return process.returncode
+    
+    async def _read_output(self, download, stream):
+        """Keep the last lines of the script's stdout/stderr on the download record"""
+        tail = download["output_tail"] = deque(maxlen=OUTPUT_TAIL_LINES)
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                continue  # Over-long line, the stream has already discarded it
+            if not line:
+                return
+            tail.append(line.decode(errors="replace").rstrip())
+    
+    def _follow_tick(self, download_id, download, finished, log):
+        """Read new log output and fold it into the download record. Runs on the worker pool."""
+        tick_started = time.perf_counter()
+        try:
+            events = download["log_follower"].poll(final=finished)
+            self._apply_events(download_id, download, events, log)
+            profiler = download.get("profiler")
+            if profiler and not finished and profiler.due():
+                sample = profiler.sample(download.get("cgroup"))
+                download["tree_cpu_percent"] = sample.get("cpu_percent")
+                download["tree_rss_bytes"] = sample["rss_bytes"]
+        except Exception as e:
+            log.exception("Error monitoring download: %s", e)
+        MONITOR_TICK_SECONDS.observe(time.perf_counter() - tick_started)
+    
+    def _conclude_attempt(self, download_id, download, status, log):
+        """Record the outcome of one run and schedule a retry of transient failures. Runs on the worker pool.
+        
+        Returns the delay before the next attempt, or None once the download is finished.
+        """
+        follower = download.get("log_follower")
+        attempt = {
+            "start_time": download.get("attempt_start_time"),
+            "end_time": datetime.now().isoformat(),
+            "status": status,
+            "return_code": download.get("return_code"),
+            "mapping_file": download.get("mapping_file")
+        }
+        if download.get("spawn_error"):
+            attempt["failure_class"] = FailureClass.UNKNOWN
+            attempt["error"] = download.pop("spawn_error")
+        if status == "failed" and follower:
+            if download.pop("hung", False):
+                failure_class, images = FailureClass.HUNG, {}
+            else:
+                failure_class, images = classify_failure(follower.parser, list(download.get("output_tail", ())))
+            attempt["failure_class"] = failure_class
+            attempt["failed_images"] = len(images)
+            if failure_class == FailureClass.AUTH and self.sessions.invalidate(
+                    download.get("entitlement_key"), download["registry_auth_file"]):
+                log.warning("Registry refused the shared session, the next job logs in again")
+        with self.lock:
+            attempts = download.setdefault("attempts", [])
+            attempt["attempt"] = len(attempts) + 1
+            attempts.append(attempt)
+            if (status != "failed" or not follower or download["status"] == "stopped"
+                    or not download.get("auto_retry", True) or len(attempts) > AUTO_RETRY_MAX_ATTEMPTS):
+                return None
+        
+        # Auth and disk problems affect every image; otherwise retry only images that failed transiently
+        if failure_class in (FailureClass.DISK_FULL, FailureClass.AUTH):
+            return None
+        retry_images = [image for image, cls in images.items() if cls in FailureClass.RETRYABLE]
+        if not retry_images and failure_class not in FailureClass.RETRYABLE:
+            return None
+        
+        retry_number = attempt["attempt"]
+        mapping_file = None
+        source = _mapping_file_path(download["home_dir"], download["component"], download["version"])
+        if retry_images and os.path.exists(source) and not download.get("dry_run"):
+            target = f"{download['home_dir']}/{download['name']}/.retry-mapping-{retry_number}.txt"
+            try:
+                if _write_retry_mapping(source, retry_images, target):
+                    mapping_file = target
+            except OSError as e:
+                log.warning("Could not write retry mapping, retrying all images: %s", e)
+        
+        # Exponential backoff with jitter so parallel jobs do not hit the registry in lockstep
+        ceiling = min(AUTO_RETRY_MAX_DELAY, AUTO_RETRY_BASE_DELAY * 2 ** (retry_number - 1))
+        delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+        
+        with self.lock:
+            attempt["retry_delay_seconds"] = round(delay, 1)
+            attempt["retry_images"] = len(retry_images) if mapping_file else None
+            if download["status"] == "stopped":
+                return None
+            download["status"] = "retrying"
+            download["next_mapping_file"] = mapping_file
+            download["next_retry_time"] = datetime.fromtimestamp(time.time() + delay).isoformat()
+            download["retry_reason"] = (
+                f"{failure_class.replace('_', ' ').capitalize()} failure, retry {retry_number}/"
+                f"{AUTO_RETRY_MAX_ATTEMPTS} in {delay:.0f}s"
+                + (f" for {len(retry_images)} failed images" if mapping_file else "")
+            )
+        log.warning("Attempt %d failed (%s), %s", retry_number, failure_class, download["retry_reason"])
+        self.notifier.notify("retrying", download_id, download, download["retry_reason"])
+        return delay
+    
+    def _prepare_auto_retry(self, download):
+        """Reset a download record for its next attempt. Caller must hold the lock."""
+        # A dry run is simply run again; --retry would only resume a real mirror
+        download["retry"] = not download.get("dry_run")
+        download["mapping_file"] = download.pop("next_mapping_file", None)
+        download["log_start_offset"] = _file_size(download["log_file"])
+        download["status"] = "starting"
+        for key in ("retry_reason", "next_retry_time", "images_total", "progress", "return_code", "mirror_pid"):
+            download.pop(key, None)
+        return self._build_command(download)
+    
+    def _apply_events(self, download_id, download, events, log):
+        """Fold newly parsed log events into the download record"""
+        parser = download["log_follower"].parser
+        
+        if not download.get("images_total"):
+            mapping_file = download.get("mapping_file") or _mapping_file_path(
+                download["home_dir"], download["component"], download["version"])
+            if os.path.exists(mapping_file):
+                with open(mapping_file, 'r') as f:
+                    download["images_total"] = sum(1 for line in f if line.strip() and not line.startswith('#'))
+        
+        with self.lock:
+            if parser.mirror_pid and not download.get("mirror_pid"):
+                download["mirror_pid"] = parser.mirror_pid
+                log.info("Captured mirror PID: %s", parser.mirror_pid)
             
-            # Get disk space
-            disk_space = "N/A"
+            download["images_mirrored"] = parser.images_finished
+            download["images_failed"] = len(parser.failed_images)
+            download["bytes_copied"] = parser.bytes_copied
+            download["phase"] = parser.phase
+            
+            if events and download["status"] not in ("completed", "paused", "stopped"):
+                download["status"] = "progressing"
+                if download.get("images_total"):
+                    download["progress"] = min(99, int(parser.images_finished * 100 / download["images_total"]))
+                    reached = [m for m in NOTIFY_MILESTONES
+                               if download.get("notified_milestone", 0) < m <= download["progress"]]
+                    if reached:
+                        download["notified_milestone"] = reached[-1]
+                        self.notifier.notify("milestone", download_id, download,
+                                             f"{reached[-1]}% mirrored ({parser.images_finished}/"
+                                             f"{download['images_total']} images)")
+                else:
+                    # Calculate rough progress based on log activity
+                    download["progress"] = min(95, download.get("progress", 0) + 5)
+        
+        for event in events:
+            if event.kind == EventKind.IMAGE_FAILED:
+                log.warning("Image failed: %s", event.image)
+            elif event.kind == EventKind.PHASE:
+                log.info("Entered phase %s", event.phase)
+        if events:
+            log.debug("Parsed %d events, last line: %s", len(events), parser.last_line[:100])
+    
+    def _finish_monitored(self, download_id, download, status, log):
+        """Record the final status of a supervised download"""
+        download["resources"] = self._job_resources(download)
+        with self.lock:
+            if download_id in self.downloads and not download.get("finalized"):
+                download["finalized"] = True
+                download["status"] = status
+                if status == "completed":
+                    download["progress"] = 100
+                download["end_time"] = download.get("end_time") or datetime.now().isoformat()
+                log.info("Marked as %s", status)
+                finalized = True
+            else:
+                finalized = False
+        if finalized:
+            # Generate summary report, record run metrics and add to history
+            self._record_finished(download_id, download, status)
+            self._settle_subscribers(download_id, download, status)
+            message = f"Download {status} for {download['component']} v{download['version']}"
+            failure_class = (download.get("attempts") or [{}])[-1].get("failure_class")
+            if status == "failed" and failure_class:
+                message += f" ({failure_class.replace('_', ' ')} failure)"
+            self.notifier.notify(status, download_id, download, message)
+    
+    def dismiss_download(self, download_id):
+        """Remove a download from active list and kill background process"""
+        log = job_logger(download_id)
+        with self.lock:
+            download = self.downloads.pop(download_id, None)
+            if not download:
+                return {"error": "Download not found"}
+            
+            # Kill the whole job tree without scanning the process table
+            killed_pids = self._kill_job_tree(download)
+            download["status"] = "dismissed"
+            download["end_time"] = datetime.now().isoformat()
+            subscribers = download.pop("subscribers", [])
+        if killed_pids:
+            log.info("Killed %s", ", ".join(killed_pids))
+        download["resources"] = self._job_resources(download)
+        
+        # Generate summary report, record run metrics and add to history, outside the lock
+        self._record_finished(download_id, download, "dismissed")
+        # Requests attached to this download are dismissed with it
+        if subscribers:
+            self._record_subscribers(download, subscribers, "dismissed")
+        
+        pids_msg = f"PIDs killed: {killed_pids}" if killed_pids else "No active processes found"
+        return {"success": True, "message": f"Download dismissed. {pids_msg}"}
+    
+    def get_download_status(self, download_id):
+        """Get status of a specific download"""
+        with self.lock:
+            download = self.downloads.get(download_id)
+            if not download:
+                return {"error": "Download not found"}
+            
+            status = {
+                "id": download_id,
+                "component": download["component"],
+                "version": download["version"],
+                "name": download["name"],
+                "status": download["status"],
+                "start_time": download["start_time"],
+                "end_time": download.get("end_time"),
+                "pid": download.get("pid"),
+                "mirror": download["log_follower"].parser.state() if download.get("log_follower") else None,
+                "output_tail": list(download.get("output_tail", ())),
+                "attempts": list(download.get("attempts", ())),
+                "next_retry_time": download.get("next_retry_time"),
+                "retry_reason": download.get("retry_reason"),
+                "isolation": "cgroup" if download.get("cgroup") else "process_group",
+                "limits": download.get("limits"),
+                "profile": download["profiler"].to_dict(PROFILE_STATUS_SAMPLES) if download.get("profiler") else None
+            }
+            cgroup = download.get("cgroup")
+        
+        # Read the log and cgroup files outside the lock
+        status["log_tail"] = self._get_log_tail(download.get("log_file"))
+        status["progress"] = self._get_progress(download.get("name"))
+        # A cgroup removed meanwhile reads as empty, its final snapshot is on the record by then
+        status["resources"] = (cgroup.stats() if cgroup else None) or download.get("resources")
+        return status
+    
+    def get_download_events(self, download_id, since=0, kinds=None):
+        """Recent typed log events of an active download, newer than `since`"""
+        with self.lock:
+            download = self.downloads.get(download_id)
+            if not download:
+                return {"error": "Download not found"}
+            follower = download.get("log_follower")
+            events = list(follower.parser.events) if follower else []
+            last_seq = follower.parser.seq if follower else 0
+        return {
+            "id": download_id,
+            "events": [e.to_dict() for e in events if e.seq > since and (not kinds or e.kind in kinds)],
+            "last_seq": last_seq
+        }
+    
+    def get_download_errors(self, download_id, severity=None, cause=None, failure_class=None, since=0,
+                            limit=100, context=0):
+        """Indexed errors and warnings of a download's log with their distinct causes
+        
+        With context, each entry carries the log lines around it.
+        """
+        with self.lock:
+            download = self.downloads.get(download_id)
+            follower = download.get("log_follower") if download else None
+            if follower:
+                index = follower.parser.error_index
+                entries = index.query(severity, cause, failure_class, since, limit)
+                causes = [dict(c, images=list(c["images"])) for c in index.distinct_causes(severity)]
+                dropped = index.dropped
+            elif not download:
+                download = next((h for h in download_history if h["id"] == download_id), None)
+        if not download:
+            return {"error": "Download not found"}
+        
+        home_dir = download.get("home_dir") or HOME_DIR
+        log_file = download.get("log_file") or f"{home_dir}/{download['name']}/{download['name']}-download.log"
+        if not follower:
+            index = _load_error_index(log_file, download.get("log_start_offset", 0)) or ErrorIndex()
+            entries = index.query(severity, cause, failure_class, since, limit)
+            causes = index.distinct_causes(severity)
+            dropped = index.dropped
+        if context:
+            archive = LogArchive(log_file)
+            entries = [dict(e, context=_log_context(archive, e["offset"], context)) for e in entries]
+        return {
+            "id": download_id,
+            "causes": causes,
+            "entries": entries,
+            "dropped": dropped,
+            "last_seq": entries[-1]["seq"] if entries else since
+        }
+
+    def get_download_profile(self, download_id, since=None):
+        """CPU, memory and IO samples of a download's process tree, live or saved when it finished"""
+        with self.lock:
+            download = self.downloads.get(download_id)
+            profiler = download.get("profiler") if download else None
+            if not download:
+                download = next((h for h in download_history if h["id"] == download_id), None)
+        if not download:
+            return {"error": "Download not found"}
+        if profiler:
+            profile = profiler.to_dict()
+        else:
+            home_dir = download.get("home_dir") or HOME_DIR
+            profile = _load_profile(download.get("log_file")
+                                    or f"{home_dir}/{download['name']}/{download['name']}-download.log")
+            if profile is None:
+                return {"error": "No process profile recorded for this download"}
+        if since:
+            profile["series"] = [s for s in profile["series"] if s["time"] > since]
+        return dict(profile, id=download_id)
+
+    def refresh_feed(self):
+        """Update the versioned downloads feed from the active downloads and history; returns its version"""
+        active = self.get_all_downloads() + self.workers.job_records() + scheduler.job_records()
+        with self.lock:
+            history = list(download_history)
+            generation = self.history_generation
+        return self.feed.refresh(active, history, generation)
+    
+    def get_all_downloads(self):
+        """Get status of all downloads"""
+        with self.lock:
+            # Return serializable data only (exclude process object)
+            return [{
+                "id": d["id"],
+                "component": d["component"],
+                "version": d["version"],
+                "name": d["name"],
+                "filter": d.get("filter"),
+                "status": d["status"],
+                "start_time": d["start_time"],
+                "end_time": d.get("end_time"),
+                "pid": d.get("mirror_pid") or d.get("pid"),  # Show mirror PID if available
+                "main_pid": d.get("pid"),
+                "mirror_pid": d.get("mirror_pid"),
+                "return_code": d.get("return_code"),
+                "progress": d.get("progress", 0),
+                "estimated_bytes": d.get("estimated_bytes"),
+                "written_bytes": d.get("written_bytes", 0),
+                "phase": d.get("phase"),
+                "images_total": d.get("images_total"),
+                "images_mirrored": d.get("images_mirrored", 0),
+                "images_failed": d.get("images_failed", 0),
+                "status_reason": d.get("queued_reason") or d.get("paused_reason") or d.get("retry_reason"),
+                "attempt": d.get("attempt", 1),
+                "next_retry_time": d.get("next_retry_time"),
+                "coalesced_requests": [sub["name"] for sub in d.get("subscribers", ())]
+            } for d in self.downloads.values()]
+    
+    def stop_download(self, download_id):
+        """Stop a running download"""
+        with self.lock:
+            download = self.downloads.get(download_id)
+            if not download:
+                return {"error": "Download not found"}
+            
+            if download["status"] == "retrying":
+                # Waiting for an automatic retry, there is no process to signal
+                download["status"] = "stopped"
+                download["end_time"] = datetime.now().isoformat()
+                return {"success": True}
+            
+            if download["status"] == "queued":
+                # Waiting for disk space, nothing was spawned: drop it from the queue
+                download["status"] = "stopped"
+                download["end_time"] = datetime.now().isoformat()
+                subscribers = download.pop("subscribers", [])
+                del self.downloads[download_id]
+            elif download["status"] not in ("running", "progressing", "paused"):
+                return {"error": "Download is not running"}
+            else:
+                try:
+                    if not self._signal_download(download, signal.SIGTERM):
+                        return {"error": "Download is not running"}
+                    if download["status"] == "paused":
+                        # A stopped process group only acts on SIGTERM once it is continued
+                        self._signal_download(download, signal.SIGCONT)
+                    download["status"] = "stopped"
+                    download["end_time"] = datetime.now().isoformat()
+                    return {"success": True}
+                except Exception as e:
+                    return {"error": str(e)}
+        
+        # Dropped from the disk space queue: its report and history entry are written outside the lock
+        job_logger(download_id, "cp4i.capacity").info("Removed from the disk space queue")
+        self._record_finished(download_id, download, "stopped")
+        if subscribers:
+            self._record_subscribers(download, subscribers, "stopped")
+        return {"success": True}
+    
+    def _get_log_tail(self, log_file, lines=50):
+        """Get last N lines from log file"""
+        if not log_file:
+            return []
+        
+        try:
+            log_lines = LogArchive(log_file).tail(lines)
+            LOG_READ_BYTES.inc(sum(len(line) for line in log_lines), reader="status")
+            return log_lines
+        except:
+            return []
+    
+    def _get_progress(self, download_id):
+        """Get download progress"""
+        download = self.downloads.get(download_id)
+        if not download:
+            return None
+        
+        name = download.get('name')
+        home_dir = download.get('home_dir', HOME_DIR)
+        
+        if not name:
+            return None
+        
+        summary_file = f"{home_dir}/{name}/{name}-summary-report.txt"
+        if os.path.exists(summary_file):
             try:
-                result = subprocess.run(
-                    f"df -h {home_dir} | tail -1",
-                    shell=True,
-                    capture_output=True,
-                    text=True
-                )
-                if result.returncode == 0:
-                    parts = result.stdout.split()
-                    if len(parts) >= 5:
-                        disk_space = f"Total: {parts[1]}, Used: {parts[2]}, Available: {parts[3]}, Use%: {parts[4]}"
+                with open(summary_file, 'r') as f:
+                    content = f.read()
+                    # Parse summary for progress info
+                    return {"summary": content}
             except:
                 pass
-            
-            # Calculate transfer rate
-            transfer_rate = "N/A"
-            if dir_size_bytes > 0 and duration_seconds > 0:
-                rate_mbps = (dir_size_bytes / (1024*1024)) / duration_seconds
-                transfer_rate = f"{rate_mbps:.2f} MB/s"
-            
-            # Get error information from log if failed
-            error_info = ""
-            if status == "failed" and os.path.exists(log_file):
-                try:
-                    with open(log_file, 'r') as f:
-                        lines = f.readlines()
-                        # Get last 10 lines for error context
-                        error_lines = [line.strip() for line in lines[-10:] if 'error' in line.lower() or 'fail' in line.lower()]
-                        if error_lines:
-                            error_info = "\n".join(error_lines[:5])  # Show up to 5 error lines
-                except:
-                    pass
-            
-            # Generate report content
-            report_content = f"""
-================================================================================
-                    CP4I DOWNLOAD SUMMARY REPORT
-================================================================================
+        
+        return None
 
-DOWNLOAD INFORMATION
---------------------
-Component:              {component}
-Version:                {version}
-Directory Name:         {name}
-Status:                 {status.upper()}
-Process ID:             {pid}
-Exit Code:              {return_code}
+# Initialize download manager
+download_manager = DownloadManager()
 
-TIMING DETAILS
---------------
-Start Time:             {start_time}
-End Time:               {end_time}
-Duration:               {duration}
-Transfer Rate:          {transfer_rate}
 
-CONFIGURATION
--------------
-Home Directory:         {home_dir}
-Download Directory:     {download_dir}
-Target Registry:        {final_registry}
-Registry Auth File:     {registry_auth_file}
-Filter Pattern:         {filter_pattern}
+def _serving_process():
+    """Whether this process serves requests and should run the background services
 
-FILE SYSTEM DETAILS
--------------------
-Directory Exists:       {'Yes' if os.path.exists(download_dir) else 'No'}
-Directory Size:         {dir_size}
-Total Files:            {file_count}
-Total Directories:      {dir_count}
-Image Files (.tar):     {image_files}
-Mapping Files:          {mapping_files}
-Log Files:              {log_files}
+    Under the debug reloader the parent only watches files; the child it
+    spawns (WERKZEUG_RUN_MAIN=true) serves, so services start there alone.
+    """
+    return not (__name__ == '__main__' and os.environ.get("WERKZEUG_RUN_MAIN") != "true")
 
-KEY FILES
----------
-Download Log:           {log_file}
-  - Exists:             {log_exists}
-  - Size:               {log_size}
 
-Mapping File:           {mapping_file}
-  - Exists:             {mapping_exists}
-  - Images Listed:      {image_count_from_mapping}
+class RetentionManager:
+    """Reclaims disk space from finished download directories
 
-Config File:            {config_file}
-  - Exists:             {config_exists}
+    Each pass deletes directories of component versions older than the newest
+    RETENTION_KEEP_VERSIONS, then evicts least recently used directories until
+    the download directories fit in RETENTION_QUOTA_BYTES. Active and pinned
+    downloads are never touched. Deletion is done in small batches on the
+    supervisor's worker pool, pausing on the event loop between batches, so it
+    does not hold the manager lock, a pool thread or the IO of running mirrors.
+    """
 
-SYSTEM INFORMATION
-------------------
-Hostname:               {hostname}
-Disk Space ({home_dir}):
-  {disk_space}
-"""
-            
-            # Add error information if failed
-            if error_info:
-                report_content += f"""
-ERROR DETAILS
--------------
-Recent errors from log file:
-{error_info}
-"""
-            
-            report_content += f"""
-================================================================================
-Report Generated:       {datetime.now().isoformat()}
-================================================================================
-"""
-            
-            # Save report to file
-            report_file = f"{home_dir}/{name}-summary-report.txt"
-            os.makedirs(home_dir, exist_ok=True)
-            with open(report_file, 'w') as f:
-                f.write(report_content)
-            
-            print(f"[REPORT] Comprehensive summary report generated: {report_file}")
-            return report_file
-            
-        except Exception as e:
-            print(f"[REPORT] Error generating summary report: {e}")
-            import traceback
-            traceback.print_exc()
-            return None
-    
-    def start_download(self, download_id, component, version, name, filter_pattern=None, dry_run=False,
-                      home_dir=None, final_registry=None, registry_auth_file=None, entitlement_key=None):
-        """Start a new download process"""
+    def __init__(self, manager, state_file):
+        self.manager = manager
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.pass_lock = threading.Lock()
+        self.state = None
+        self.deleting = set()
+        self.deletions = deque(maxlen=200)
+        self._sizes = {}
+        self._watch = None
+
+    def _load(self):
+        """Load pins and access times on first use. Caller must hold the lock."""
+        if self.state is not None:
+            return
+        self.state = {"pins": [], "access": {}}
+        try:
+            with open(self.state_file, 'r') as f:
+                self.state.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.getLogger("cp4i.retention").warning("Could not load %s: %s", self.state_file, e)
+
+    def _save(self):
+        """Persist pins and access times. Caller must hold the lock."""
+        try:
+            tmp_path = f"{self.state_file}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, self.state_file)
+        except OSError as e:
+            logging.getLogger("cp4i.retention").warning("Could not save %s: %s", self.state_file, e)
+
+    def ensure_started(self):
+        """Schedule background passes, once at startup"""
+        if self._watch is None and RETENTION_INTERVAL > 0:
+            self._watch = self.manager.supervisor.every(RETENTION_INTERVAL, self._periodic_pass, "retention")
+
+    def touch(self, home_dir, name):
+        """Record that a download's files were accessed, for LRU ordering"""
         with self.lock:
-            if download_id in self.downloads:
-                return {"error": "Download already in progress"}
-            
-            # Use provided values or defaults
-            home_dir = home_dir or HOME_DIR
-            final_registry = final_registry or "registry.example.com:5000"
-            registry_auth_file = registry_auth_file or "/root/.docker/config.json"
-            
-            # Build command
-            cmd = [
-                "bash", SCRIPT_PATH,
-                "--component", component,
-                "--version", version,
-                "--name", name
-            ]
-            
-            if filter_pattern:
-                cmd.extend(["--filter", filter_pattern])
-            
-            if dry_run:
-                cmd.append("--dry-run")
-            
-            # Build environment variables
-            env = os.environ.copy()
-            env["HOME_DIR"] = home_dir
-            env["FINAL_REGISTRY"] = final_registry
-            env["REGISTRY_AUTH_FILE"] = registry_auth_file
-            if entitlement_key:
-                env["ENTITLEMENT_KEY"] = entitlement_key
-            
-            # Start process
+            self._load()
+            self.state["access"][os.path.join(home_dir, name)] = time.time()
+
+    def pin(self, home_dir, name, pinned=True):
+        """Protect a download directory from deletion, or lift the protection"""
+        path = os.path.join(home_dir, name)
+        with self.lock:
+            self._load()
+            pins = set(self.state["pins"])
+            pins.add(path) if pinned else pins.discard(path)
+            self.state["pins"] = sorted(pins)
+            self._save()
+        return {"success": True, "path": path, "pinned": pinned}
+
+    def is_deleting(self, home_dir, name):
+        with self.lock:
+            return os.path.join(home_dir, name) in self.deleting
+
+    def _active_paths(self):
+        """Directories written or read by active downloads, coalesced subscribers and link sources
+
+        Caller must hold the manager lock.
+        """
+        active = set()
+        for d in self.manager.downloads.values():
+            active.add(os.path.join(d["home_dir"], d["name"]))
+            active.update(os.path.join(s["home_dir"], s["name"]) for s in d.get("subscribers", ()))
+            if d.get("linking_from"):
+                active.add(d["linking_from"])
+        return active
+
+    def _download_dirs(self):
+        """Download directories with their metadata, from every home directory in use"""
+        runs = {os.path.join(r.get("home_dir") or HOME_DIR, r["name"]): r
+                for r in run_metrics.all_runs() if r.get("name")}
+        with self.manager.lock:
+            known = {os.path.join(h.get("home_dir") or HOME_DIR, h["name"]): h
+                     for h in download_history if h.get("name") and h.get("status") != "evicted"}
+            active = self._active_paths()
+            home_dirs = {HOME_DIR} | {d["home_dir"] for d in self.manager.downloads.values()}
+        home_dirs |= {os.path.dirname(path) for path in list(runs) + list(known)}
+        
+        dirs = []
+        for home_dir in home_dirs:
             try:
-                process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    env=env
-                )
-                
-                self.downloads[download_id] = {
-                    "id": download_id,
-                    "component": component,
-                    "version": version,
-                    "name": name,
-                    "filter": filter_pattern,
-                    "process": process,
-                    "status": "running",
-                    "start_time": datetime.now().isoformat(),
-                    "pid": process.pid,
-                    "mirror_pid": None,  # Will be populated by monitoring
-                    "log_file": f"{home_dir}/{name}/{name}-download.log",
+                entries = list(os.scandir(home_dir))
+            except OSError:
+                continue
+            for entry in entries:
+                # Only directories created by the downloader script, never .ibm-pak or other data
+                if (entry.name.startswith(".") or not entry.is_dir(follow_symlinks=False)
+                        or not LogArchive(os.path.join(entry.path, f"{entry.name}-download.log")).exists()):
+                    continue
+                meta = known.get(entry.path) or runs.get(entry.path) or {}
+                dirs.append({
+                    "path": entry.path,
                     "home_dir": home_dir,
-                    "final_registry": final_registry
-                }
-                
-                # Start monitoring thread
-                threading.Thread(
-                    target=self._monitor_download,
-                    args=(download_id,),
-                    daemon=True
-                ).start()
-                
-                return {"success": True, "download_id": download_id, "pid": process.pid}
-            
-            except Exception as e:
-                return {"error": str(e)}
-    
-    def _monitor_download(self, download_id):
-        """Monitor download process and check log for completion"""
-        download = self.downloads.get(download_id)
-        if not download:
-            return
-        
-        process = download["process"]
-        log_file = download.get("log_file")
-        last_log_size = 0
-        last_activity_time = time.time()
-        check_interval = 30  # Check every 30 seconds
+                    "name": entry.name,
+                    "component": meta.get("component"),
+                    "version": meta.get("version"),
+                    "active": entry.path in active
+                })
+        return dirs
+
+    def _measure(self, item):
+        """Bytes used and bytes a delete would free (files with no other hard link), cached while unchanged"""
+        log_file = os.path.join(item["path"], f"{item['name']}-download.log")
+        signature = tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else None
+                          for path in (item["path"], log_file, log_file + LogArchive.SUFFIX))
+        cached = self._sizes.get(item["path"])
+        if cached and cached[0] == signature and not item["active"]:
+            return cached[1]
+        used = reclaimable = 0
+        last_used = 0.0
+        stack = [item["path"]]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            st = entry.stat(follow_symlinks=False)
+                            used += st.st_size
+                            if st.st_nlink == 1:
+                                reclaimable += st.st_size
+                            last_used = max(last_used, st.st_atime, st.st_mtime)
+            except OSError:
+                continue
+        sizes = (used, reclaimable, last_used)
+        self._sizes[item["path"]] = (signature, sizes)
+        return sizes
+
+    def plan(self):
+        """Directories the next pass would delete, in order, with the reason for each"""
+        with self.lock:
+            self._load()
+            pins = set(self.state["pins"])
+            access = dict(self.state["access"])
         
-        print(f"Starting monitoring for {download_id}, log file: {log_file}")
+        dirs = self._download_dirs()
+        for item in dirs:
+            item["bytes"], item["reclaimable_bytes"], last_used = self._measure(item)
+            item["last_access"] = max(last_used, access.get(item["path"], 0))
+            item["pinned"] = item["path"] in pins
+        total = sum(item["bytes"] for item in dirs)
         
-        # Monitor process and log file
-        while True:
-            # Check if process has finished
-            if process.poll() is not None:
-                print(f"[{download_id}] Process finished with code {process.returncode}")
-                break
-            # Check log file for completion message and mirror PID
-            if log_file and os.path.exists(log_file):
-                try:
-                    # Get current file size
-                    current_size = os.path.getsize(log_file)
-                    
-                    # Read log content
-                    with open(log_file, 'r') as f:
-                        log_content = f.read()
-                        lines = log_content.strip().split('\n')
-                        last_line = lines[-1] if lines else ""
-                        
-                        print(f"[{download_id}] Last line: {last_line[:100]}")
-                        
-                        # Extract mirror PID if not already captured
-                        if not download.get("mirror_pid"):
-                            import re
-                            pid_match = re.search(r'Image mirroring started.*\(PID:\s*(\d+)\)', log_content)
-                            if pid_match:
-                                with self.lock:
-                                    download["mirror_pid"] = int(pid_match.group(1))
-                                    print(f"Captured mirror PID: {download['mirror_pid']} for {download_id}")
-                        
-                        # Check if log is growing (new activity)
-                        if current_size > last_log_size:
-                            last_activity_time = time.time()
-                            last_log_size = current_size
-                            with self.lock:
-                                if download["status"] != "completed":
-                                    download["status"] = "progressing"
-                                    # Calculate rough progress based on log activity
-                                    download["progress"] = min(95, download.get("progress", 0) + 5)
-                            print(f"[{download_id}] Log growing, status: progressing")
-                        
-                        # Check for error in last line
-                        if "error: one or more errors occurred" in last_line.lower():
-                            print(f"[{download_id}] ERROR DETECTED in last line!")
-                            with self.lock:
-                                if download["status"] != "failed":
-                                    download["status"] = "failed"
-                                    download["end_time"] = datetime.now().isoformat()
-                                    print(f"Download {download_id} marked as failed")
-                                    
-                                    # Generate summary report for failed download
-                                    self._generate_summary_report(download)
-                                    
-                                    # Add to history immediately
-                                    download_history.append({
-                                        "id": download_id,
-                                        "component": download["component"],
-                                        "version": download["version"],
-                                        "name": download["name"],
-                                        "filter": download.get("filter"),
-                                        "status": "failed",
-                                        "start_time": download["start_time"],
-                                        "end_time": download["end_time"],
-                                        "home_dir": download.get("home_dir"),
-                                        "final_registry": download.get("final_registry"),
-                                        "registry_auth_file": download.get("registry_auth_file"),
-                                        "entitlement_key": download.get("entitlement_key")
-                                    })
-                                    print(f"Added {download_id} to history as failed")
-                            
-                            # Wait then remove from active downloads
-                            print(f"[{download_id}] Waiting 5 seconds before removal...")
-                            time.sleep(5)
-                            with self.lock:
-                                if download_id in self.downloads:
-                                    del self.downloads[download_id]
-                                    print(f"[{download_id}] Removed from active downloads")
-                            
-                            # Exit monitoring loop
-                            return
-                        
-                        # Check for completion in last line
-                        if "info: mirroring completed" in last_line.lower():
-                            print(f"[{download_id}] COMPLETION DETECTED in last line!")
-                            with self.lock:
-                                if download["status"] != "completed":
-                                    download["status"] = "completed"
-                                    download["progress"] = 100
-                                    download["end_time"] = datetime.now().isoformat()
-                                    print(f"Download {download_id} marked as completed")
-                                    
-                                    # Generate summary report for completed download
-                                    self._generate_summary_report(download)
-                                    
-                                    # Add to history immediately
-                                    download_history.append({
-                                        "id": download_id,
-                                        "component": download["component"],
-                                        "version": download["version"],
-                                        "name": download["name"],
-                                        "filter": download.get("filter"),
-                                        "status": "completed",
-                                        "start_time": download["start_time"],
-                                        "end_time": download["end_time"],
-                                        "home_dir": download.get("home_dir"),
-                                        "final_registry": download.get("final_registry"),
-                                        "registry_auth_file": download.get("registry_auth_file"),
-                                        "entitlement_key": download.get("entitlement_key")
-                                    })
-                                    print(f"Added {download_id} to history")
-                            
-                            # Wait then remove from active downloads
-                            print(f"[{download_id}] Waiting 5 seconds before removal...")
-                            time.sleep(5)
-                            with self.lock:
-                                if download_id in self.downloads:
-                                    del self.downloads[download_id]
-                                    print(f"[{download_id}] Removed from active downloads")
-                            
-                            # Exit monitoring loop
-                            return
-                        
-                except Exception as e:
-                    print(f"Error monitoring {download_id}: {e}")
-            
-            time.sleep(check_interval)  # Check every 30 seconds
+        # Newest versions of each component are kept
+        versions = {}
+        for item in dirs:
+            if item["component"] and item["version"]:
+                versions.setdefault(item["component"], set()).add(item["version"])
+        kept = {component: set(sorted(vs, key=_version_key, reverse=True)[:RETENTION_KEEP_VERSIONS])
+                for component, vs in versions.items()}
         
-        # Process finished - check one last time for completion
-        print(f"[{download_id}] Process loop ended, return code: {process.returncode}")
+        plan, remaining = [], total
+        eligible = [item for item in dirs if not item["active"] and not item["pinned"]]
+        if RETENTION_KEEP_VERSIONS > 0:
+            for item in eligible:
+                if item["component"] in kept and item["version"] not in kept[item["component"]]:
+                    item["reason"] = f"older than the newest {RETENTION_KEEP_VERSIONS} versions of {item['component']}"
+                    plan.append(item)
+                    remaining -= item["bytes"]
+        if RETENTION_QUOTA_BYTES > 0 and remaining > RETENTION_QUOTA_BYTES:
+            for item in sorted((i for i in eligible if "reason" not in i), key=lambda i: i["last_access"]):
+                if remaining <= RETENTION_QUOTA_BYTES:
+                    break
+                item["reason"] = f"over quota of {_format_bytes(RETENTION_QUOTA_BYTES)}, least recently used"
+                plan.append(item)
+                remaining -= item["bytes"]
         
-        # Check if it was a successful dry-run, actual completion, or error
-        if log_file and os.path.exists(log_file):
+        return {
+            "quota_bytes": RETENTION_QUOTA_BYTES or None,
+            "keep_versions": RETENTION_KEEP_VERSIONS or None,
+            "used_bytes": total,
+            "used_after_bytes": remaining,
+            "directories": sorted(dirs, key=lambda i: i["path"]),
+            "delete": [{k: item[k] for k in ("path", "name", "component", "version", "bytes",
+                                             "reclaimable_bytes", "reason")} for item in plan],
+            "pins": sorted(pins)
+        }
+
+    def run_pass(self, dry_run=False):
+        """Delete what the plan selects, one directory at a time; returns the deletions made"""
+        if dry_run:
+            return {"dry_run": True, **self.plan(), "deleted": []}
+        if not self.pass_lock.acquire(blocking=False):
+            return {"error": "A retention pass is already running", "busy": True}
+        try:
+            return self.manager.supervisor.submit(self._run_pass()).result()
+        finally:
+            self.pass_lock.release()
+
+    async def _periodic_pass(self):
+        if not self.pass_lock.acquire(blocking=False):
+            return
+        try:
+            await self._run_pass()
+        finally:
+            self.pass_lock.release()
+
+    async def _run_pass(self):
+        plan = await self.manager.supervisor.run_blocking(self.plan)
+        deleted = []
+        for item in plan["delete"]:
+            home_dir, name = os.path.split(item["path"])
+            with self.manager.lock:
+                # Re-check under the lock: a download or subscriber may have started since the plan was made
+                if item["path"] in self._active_paths():
+                    continue
+                with self.lock:
+                    self.deleting.add(item["path"])
             try:
-                with open(log_file, 'r') as f:
-                    log_content = f.read()
-                    lines = log_content.strip().split('\n')
-                    last_line = lines[-1] if lines else ""
-                    
-                    # Check for error in last line first
-                    if "error: one or more errors occurred" in last_line.lower():
-                        print(f"[{download_id}] Final check: ERROR DETECTED in last line!")
-                        
-                        with self.lock:
-                            if download_id in self.downloads and download["status"] != "failed":
-                                download["status"] = "failed"
-                                download["end_time"] = datetime.now().isoformat()
-                                
-                                # Generate summary report
-                                self._generate_summary_report(download)
-                                
-                                # Add to history with configuration
-                                download_history.append({
-                                    "id": download_id,
-                                    "component": download["component"],
-                                    "version": download["version"],
-                                    "name": download["name"],
-                                    "filter": download.get("filter"),
-                                    "status": "failed",
-                                    "start_time": download["start_time"],
-                                    "end_time": download["end_time"],
-                                    "home_dir": download.get("home_dir"),
-                                    "final_registry": download.get("final_registry"),
-                                    "registry_auth_file": download.get("registry_auth_file"),
-                                    "entitlement_key": download.get("entitlement_key")
-                                })
-                                print(f"[{download_id}] Added to history as failed")
-                        
-                        # Wait then remove
-                        time.sleep(5)
-                        with self.lock:
-                            if download_id in self.downloads:
-                                del self.downloads[download_id]
-                                print(f"[{download_id}] Removed from active downloads")
-                        return
-                    
-                    # Check for completion message OR successful dry-run
-                    is_completed = "info: mirroring completed" in last_line.lower()
-                    is_dry_run = "[dry run]" in log_content.lower() and process.returncode == 0
-                    
-                    if is_completed or is_dry_run:
-                        status_msg = "DRY RUN completed" if is_dry_run else "COMPLETION DETECTED"
-                        print(f"[{download_id}] Final check: {status_msg}!")
-                        
-                        with self.lock:
-                            if download_id in self.downloads and download["status"] != "completed":
-                                download["status"] = "completed"
-                                download["progress"] = 100
-                                download["end_time"] = datetime.now().isoformat()
-                                
-                                # Generate summary report
-                                self._generate_summary_report(download)
-                                
-                                # Add to history with configuration
-                                download_history.append({
-                                    "id": download_id,
-                                    "component": download["component"],
-                                    "version": download["version"],
-                                    "name": download["name"],
-                                    "filter": download.get("filter"),
-                                    "status": "completed",
-                                    "start_time": download["start_time"],
-                                    "end_time": download["end_time"],
-                                    "home_dir": download.get("home_dir"),
-                                    "final_registry": download.get("final_registry"),
-                                    "registry_auth_file": download.get("registry_auth_file"),
-                                    "entitlement_key": download.get("entitlement_key")
-                                })
-                                print(f"[{download_id}] Added to history as completed")
-                        
-                        # Wait then remove
-                        time.sleep(5)
-                        with self.lock:
-                            if download_id in self.downloads:
-                                del self.downloads[download_id]
-                                print(f"[{download_id}] Removed from active downloads")
-                        return
-            except Exception as e:
-                print(f"Error in final check for {download_id}: {e}")
-        
-        # If not completed and exit code is non-zero, mark as failed
-        if process.returncode != 0:
-            print(f"[{download_id}] Process ended with error code {process.returncode}")
-            with self.lock:
-                if download_id in self.downloads:
-                    download["status"] = "failed"
-                    download["end_time"] = datetime.now().isoformat()
-                    
-                    # Generate summary report for failed download
-                    self._generate_summary_report(download)
-                    
-                    download_history.append({
-                        "id": download_id,
-                        "component": download["component"],
-                        "version": download["version"],
-                        "name": download["name"],
-                        "filter": download.get("filter"),
-                        "status": "failed",
-                        "start_time": download["start_time"],
-                        "end_time": download["end_time"],
-                        "home_dir": download.get("home_dir"),
-                        "final_registry": download.get("final_registry"),
-                        "registry_auth_file": download.get("registry_auth_file"),
-                        "entitlement_key": download.get("entitlement_key")
-                    })
-                    del self.downloads[download_id]
-                    print(f"[{download_id}] Marked as failed and moved to history")
-        else:
-            # Exit code 0 but no completion message - treat as completed
-            print(f"[{download_id}] Process ended successfully (exit code 0)")
-            with self.lock:
-                if download_id in self.downloads:
-                    download["status"] = "completed"
-                    download["progress"] = 100
-                    download["end_time"] = datetime.now().isoformat()
-                    
-                    # Generate summary report
-                    self._generate_summary_report(download)
-                    download_history.append({
-                        "id": download_id,
-                        "component": download["component"],
-                        "version": download["version"],
-                        "name": download["name"],
-                        "filter": download.get("filter"),
-                        "status": "completed",
-                        "start_time": download["start_time"],
-                        "end_time": download["end_time"],
-                        "home_dir": download.get("home_dir"),
-                        "final_registry": download.get("final_registry"),
-                        "registry_auth_file": download.get("registry_auth_file"),
-                        "entitlement_key": download.get("entitlement_key")
-                    })
-                    del self.downloads[download_id]
-                    print(f"[{download_id}] Marked as completed and moved to history")
-        
-        # Process finished - already added to history above in lines 260-273 or 284-297
-        # No need to add again here
-    
-    def dismiss_download(self, download_id):
-        """Remove a download from active list and kill background process"""
+                freed = await self._delete_tree(item["path"])
+                freed += await self.manager.supervisor.run_blocking(
+                    _remove_file, os.path.join(home_dir, f"{name}-summary-report.txt"))
+            except OSError as e:
+                logging.getLogger("cp4i.retention").warning("Could not delete %s: %s", item["path"], e)
+                continue
+            finally:
+                with self.lock:
+                    self.deleting.discard(item["path"])
+                    self._load()
+                    self.state["access"].pop(item["path"], None)
+                self._sizes.pop(item["path"], None)
+            
+            record = self._record_eviction(item, home_dir, name, freed)
+            deleted.append(record)
+            logging.getLogger("cp4i.retention").info(
+                "Deleted %s (%s freed): %s", item["path"], _format_bytes(freed), item["reason"])
         with self.lock:
-            if download_id in self.downloads:
-                download = self.downloads[download_id]
-                
-                # Kill the mirror process (nohup oc image mirror)
-                mirror_pid = download.get("mirror_pid")
-                main_pid = download.get("pid")
-                name = download.get("name")
-                
-                killed_pids = []
-                
-                # Try to kill mirror PID first (this is the actual download process)
-                if mirror_pid:
-                    try:
-                        os.kill(mirror_pid, 9)
-                        killed_pids.append(f"mirror:{mirror_pid}")
-                        print(f"Killed mirror process {mirror_pid} for download {download_id}")
-                    except ProcessLookupError:
-                        print(f"Mirror process {mirror_pid} already terminated")
-                    except Exception as e:
-                        print(f"Error killing mirror process {mirror_pid}: {e}")
-                
-                # Kill main script process and all children
-                if main_pid:
-                    try:
-                        # Kill all child processes first
-                        subprocess.run(
-                            f"pkill -9 -P {main_pid}",
-                            shell=True,
-                            capture_output=True
-                        )
-                        # Then kill main process
-                        os.kill(main_pid, 9)
-                        killed_pids.append(f"main:{main_pid}")
-                        print(f"Killed main process {main_pid} and children for download {download_id}")
-                    except ProcessLookupError:
-                        print(f"Main process {main_pid} already terminated")
-                    except Exception as e:
-                        print(f"Error killing main process {main_pid}: {e}")
-                
-                # Also try to kill any remaining oc image mirror processes for this download
+            self._save()
+        return {"dry_run": False, **plan, "deleted": deleted}
+
+    async def _delete_tree(self, path):
+        """Remove a directory tree in small batches, yielding IO to running mirrors; returns bytes freed"""
+        batches = self._delete_batches(path)
+        freed = 0
+        while True:
+            freed_so_far = await self.manager.supervisor.run_blocking(next, batches, None)
+            if freed_so_far is None:
+                return freed
+            freed = freed_so_far
+            await asyncio.sleep(RETENTION_DELETE_PAUSE)
+
+    def _delete_batches(self, path):
+        """Remove a directory tree, yielding the bytes freed so far after every batch of files"""
+        freed = removed = 0
+        for root, dirs, files in os.walk(path, topdown=False):
+            for filename in files:
+                file_path = os.path.join(root, filename)
                 try:
-                    result = subprocess.run(
-                        f"pkill -9 -f 'oc image mirror.*{name}'",
-                        shell=True,
-                        capture_output=True,
-                        text=True
-                    )
-                    if result.returncode == 0:
-                        print(f"Killed additional oc image mirror processes for {name}")
-                except Exception as e:
-                    print(f"Error killing additional processes: {e}")
-                
-                # Mark as dismissed and add to history
-                download["status"] = "dismissed"
-                download["end_time"] = datetime.now().isoformat()
-                
-                # Generate summary report for dismissed download
-                self._generate_summary_report(download)
-                
-                # Add to history with configuration so logs/reports can be accessed
-                download_history.append({
-                    "id": download_id,
-                    "component": download["component"],
-                    "version": download["version"],
-                    "name": download["name"],
-                    "filter": download.get("filter"),
-                    "status": "dismissed",
-                    "start_time": download["start_time"],
-                    "end_time": download["end_time"],
-                    "home_dir": download.get("home_dir"),
-                    "final_registry": download.get("final_registry"),
-                    "registry_auth_file": download.get("registry_auth_file"),
-                    "entitlement_key": download.get("entitlement_key")
-                })
-                
-                # Remove from active downloads
-                del self.downloads[download_id]
-                
-                pids_msg = f"PIDs killed: {killed_pids}" if killed_pids else "No active processes found"
-                return {"success": True, "message": f"Download dismissed. {pids_msg}"}
-            return {"error": "Download not found"}
-    
-    def get_download_status(self, download_id):
-        """Get status of a specific download"""
+                    st = os.lstat(file_path)
+                    os.unlink(file_path)
+                except FileNotFoundError:
+                    continue
+                if st.st_nlink == 1:
+                    freed += st.st_size
+                removed += 1
+                if removed % RETENTION_DELETE_BATCH == 0:
+                    yield freed
+            for dirname in dirs:
+                try:
+                    os.rmdir(os.path.join(root, dirname))
+                except OSError:
+                    pass
+        os.rmdir(path)
+        yield freed
+
+    def _record_eviction(self, item, home_dir, name, freed):
+        """Add a history entry for a deleted directory and mark older entries as evicted"""
+        now = datetime.now().isoformat()
+        record = {
+            "id": f"{name}-evicted-{int(time.time())}",
+            "component": item.get("component"),
+            "version": item.get("version"),
+            "name": name,
+            "home_dir": home_dir,
+            "status": "evicted",
+            "start_time": now,
+            "end_time": now,
+            "reason": item["reason"],
+            "bytes_freed": freed
+        }
+        with self.manager.lock:
+            for entry in download_history:
+                if entry.get("name") == name and (entry.get("home_dir") or HOME_DIR) == home_dir:
+                    entry["evicted_time"] = now
+            download_history.append(record)
+            self.manager.history_generation += 1
+        self.deletions.append(record)
+        return record
+
+    def status(self):
+        """Configuration, current usage, pins and the next pass's plan"""
+        plan = self.plan()
+        plan["recent_deletions"] = list(self.deletions)
+        plan["interval_seconds"] = RETENTION_INTERVAL
+        return plan
+
+
+retention = RetentionManager(download_manager, RETENTION_STATE_FILE)
+if _serving_process():
+    retention.ensure_started()
+
+
+def _window_occurrence(window, now):
+    """Start of the occurrence of a daily window that contains now, or None when it is closed
+
+    A window whose end is before its start runs overnight; `days` restricts the
+    days it may start on.
+    """
+    start_time = datetime.strptime(window["start"], "%H:%M").time()
+    end_time = datetime.strptime(window["end"], "%H:%M").time()
+    for days_back in (0, 1):
+        day = (now - timedelta(days=days_back)).date()
+        if window.get("days") and WEEKDAYS[day.weekday()] not in window["days"]:
+            continue
+        start = datetime.combine(day, start_time)
+        end = datetime.combine(day, end_time)
+        if end <= start:
+            end += timedelta(days=1)
+        if start <= now < end:
+            return start
+    return None
+
+
+def _parse_not_before(value, now=None):
+    """ISO timestamp for a not_before value: an ISO datetime, or "HH:MM" meaning its next occurrence"""
+    now = now or datetime.now()
+    if re.match(r'^\d{1,2}:\d\d$', value):
+        start = datetime.combine(now.date(), datetime.strptime(value, "%H:%M").time())
+        return (start if start > now else start + timedelta(days=1)).isoformat()
+    return datetime.fromisoformat(value).isoformat()
+
+
+class JobScheduler:
+    """Downloads held until a time or an off-peak window, and prefetch of new catalog versions
+
+    Windows are daily time ranges ("22:00"-"06:00", optionally on given
+    weekdays) with an optional budget of bytes that the downloads started in
+    one occurrence may add up to (by their estimates). A due download whose
+    window is closed or whose budget is spent waits for the next occurrence.
+    With a prefetch policy, a version of a tracked component that is newer
+    than any seen before is scheduled automatically, seeded with copies of
+    the blobs of the newest completed version so only changed layers are
+    fetched.
+    """
+
+    def __init__(self, manager, state_file):
+        self.manager = manager
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.state = None
+        self._watch = None
+        self._catalog = (None, {})  # (mtime, {component: versions}) of CATALOG_FILE
+
+    def _load(self):
+        """Load windows, schedules and the prefetch policy on first use. Caller must hold the lock."""
+        if self.state is not None:
+            return
+        self.state = {"windows": {}, "jobs": {}, "usage": {}, "prefetch": None}
+        try:
+            with open(self.state_file, 'r') as f:
+                self.state.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.getLogger("cp4i.scheduler").warning("Could not load %s: %s", self.state_file, e)
+
+    def _save(self):
+        """Persist the scheduler state; it holds registry credentials, so only the owner may read it.
+        Only the newest SCHEDULE_KEEP_FINISHED finished schedules are kept. Caller must hold the lock."""
+        finished = sorted((j for j in self.state["jobs"].values() if j["status"] in ("started", "failed", "cancelled")),
+                          key=lambda j: j.get("started_time") or j["created_time"])
+        for job in finished[:-SCHEDULE_KEEP_FINISHED or None]:
+            del self.state["jobs"][job["id"]]
+        try:
+            tmp_path = f"{self.state_file}.tmp"
+            with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(tmp_path, self.state_file)
+        except OSError as e:
+            logging.getLogger("cp4i.scheduler").warning("Could not save %s: %s", self.state_file, e)
+
+    def ensure_started(self):
+        """Start the periodic check, once at startup"""
+        if self._watch is None:
+            self._watch = self.manager.supervisor.every(SCHEDULE_CHECK_INTERVAL, self.tick, "scheduler")
+
+    def set_window(self, name, window):
+        """Create or replace a window"""
+        if not isinstance(window, dict):
+            return {"error": "A window must be an object"}
+        try:
+            for key in ("start", "end"):
+                datetime.strptime(window.get(key) or "", "%H:%M")
+        except (TypeError, ValueError):
+            return {"error": "start and end must be HH:MM"}
+        days = window.get("days") or []
+        if not isinstance(days, list) or not all(isinstance(d, str) and d.lower()[:3] in WEEKDAYS for d in days):
+            return {"error": f"days must be a list among {', '.join(WEEKDAYS)}"}
+        days = [d.lower()[:3] for d in days]
+        budget_gb = window.get("budget_gb")
+        if budget_gb is not None:
+            try:
+                if isinstance(budget_gb, bool):
+                    raise TypeError(budget_gb)
+                budget_gb = float(budget_gb)
+            except (TypeError, ValueError):
+                return {"error": "budget_gb must be a number"}
+            if not 0 < budget_gb < float("inf"):
+                return {"error": "budget_gb must be positive"}
+        with self.lock:
+            self._load()
+            self.state["windows"][name] = {
+                "start": window["start"], "end": window["end"], "days": days,
+                "budget_bytes": int(budget_gb * GB) if budget_gb is not None else None
+            }
+            self._save()
+            return dict(self.state["windows"][name], name=name)
+
+    def delete_window(self, name):
+        with self.lock:
+            self._load()
+            if any(j["status"] == "scheduled" and j.get("window") == name for j in self.state["jobs"].values()):
+                return {"error": f"Window {name} still has scheduled downloads"}
+            if self.state["windows"].pop(name, None) is None:
+                return {"error": "Window not found"}
+            self._save()
+            return {"success": True}
+
+    def schedule(self, download_id, request, not_before=None, window=None, prefetch=False, seed_from=None):
+        """Hold a download request until not_before has passed and its window is open"""
+        try:
+            not_before = _parse_not_before(not_before) if not_before else None
+        except (TypeError, ValueError):
+            return {"error": "not_before must be an ISO datetime or HH:MM"}
+        if window is not None and not isinstance(window, str):
+            return {"error": "window must be the name of a window"}
         with self.lock:
-            download = self.downloads.get(download_id)
-            if not download:
-                return {"error": "Download not found"}
-            
-            # Get log tail
-            log_tail = self._get_log_tail(download.get("log_file"))
-            
-            # Get progress if available
-            progress = self._get_progress(download.get("name"))
-            
-            return {
+            self._load()
+            if window and window not in self.state["windows"]:
+                return {"error": f"Unknown window: {window}"}
+            if not not_before and not window:
+                return {"error": "A schedule needs not_before or a window"}
+            self.state["jobs"][download_id] = {
                 "id": download_id,
-                "component": download["component"],
-                "version": download["version"],
-                "name": download["name"],
-                "status": download["status"],
-                "start_time": download["start_time"],
-                "end_time": download.get("end_time"),
-                "pid": download.get("pid"),
-                "log_tail": log_tail,
-                "progress": progress
+                "request": request,
+                "not_before": not_before,
+                "window": window,
+                "prefetch": prefetch,
+                "seed_from": seed_from,
+                "status": "scheduled",
+                "created_time": datetime.now().isoformat()
             }
-    
-    def get_all_downloads(self):
-        """Get status of all downloads"""
+            self._save()
+        job_logger(download_id, "cp4i.scheduler").info(
+            "Scheduled %s v%s (not before %s, window %s)", request["component"], request["version"],
+            not_before or "-", window or "-")
+        return {"success": True, "download_id": download_id, "status": "scheduled", "scheduled": True,
+                "not_before": not_before, "window": window}
+
+    def cancel(self, download_id):
         with self.lock:
-            # Return serializable data only (exclude process object)
+            self._load()
+            job = self.state["jobs"].get(download_id)
+            if not job or job["status"] != "scheduled":
+                return None
+            job["status"] = "cancelled"
+            self._save()
+        return {"success": True}
+
+    def pending(self, download_id):
+        """A download still waiting for its schedule, or None"""
+        with self.lock:
+            self._load()
+            job = self.state["jobs"].get(download_id)
+            return dict(job) if job and job["status"] == "scheduled" else None
+
+    def job_records(self):
+        """Waiting downloads in the shape of DownloadManager.get_all_downloads"""
+        with self.lock:
+            self._load()
+            jobs = [j for j in self.state["jobs"].values() if j["status"] == "scheduled"]
             return [{
-                "id": d["id"],
-                "component": d["component"],
-                "version": d["version"],
-                "name": d["name"],
-                "filter": d.get("filter"),
-                "status": d["status"],
-                "start_time": d["start_time"],
-                "end_time": d.get("end_time"),
-                "pid": d.get("mirror_pid") or d.get("pid"),  # Show mirror PID if available
-                "main_pid": d.get("pid"),
-                "mirror_pid": d.get("mirror_pid"),
-                "return_code": d.get("return_code"),
-                "progress": d.get("progress", 0)
-            } for d in self.downloads.values()]
-    
-    def stop_download(self, download_id):
-        """Stop a running download"""
+                "id": j["id"],
+                "component": j["request"]["component"],
+                "version": j["request"]["version"],
+                "name": j["request"]["name"],
+                "filter": j["request"].get("filter"),
+                "status": "scheduled",
+                "start_time": None,
+                "end_time": None,
+                "progress": 0,
+                "prefetch": j["prefetch"],
+                "status_reason": j.get("waiting_reason") or self._describe(j)
+            } for j in jobs]
+
+    def _describe(self, job):
+        parts = []
+        if job["not_before"]:
+            parts.append(f"after {job['not_before'].replace('T', ' ')[:16]}")
+        if job["window"]:
+            window = self.state["windows"].get(job["window"], {})
+            parts.append(f"in window {job['window']} ({window.get('start')}-{window.get('end')})")
+        return "Scheduled to start " + " ".join(parts)
+
+    def status(self):
         with self.lock:
-            download = self.downloads.get(download_id)
-            if not download:
-                return {"error": "Download not found"}
-            
-            if download["status"] != "running":
-                return {"error": "Download is not running"}
-            
-            try:
-                download["process"].terminate()
-                download["status"] = "stopped"
-                download["end_time"] = datetime.now().isoformat()
-                return {"success": True}
-            except Exception as e:
-                return {"error": str(e)}
-    
-    def _get_log_tail(self, log_file, lines=50):
-        """Get last N lines from log file"""
-        if not log_file or not os.path.exists(log_file):
-            return []
-        
+            self._load()
+            now = datetime.now()
+            windows = []
+            for name, window in sorted(self.state["windows"].items()):
+                occurrence = _window_occurrence(window, now)
+                usage = self.state["usage"].get(name, {})
+                used = usage.get("bytes", 0) if occurrence and usage.get("occurrence") == occurrence.isoformat() else 0
+                windows.append(dict(window, name=name, open=occurrence is not None, used_bytes=used))
+            jobs = [{k: v for k, v in j.items() if k != "request"} | {
+                "component": j["request"]["component"], "version": j["request"]["version"],
+                "name": j["request"]["name"]} for j in self.state["jobs"].values()]
+            prefetch = dict(self.state["prefetch"]) if self.state["prefetch"] else None
+        if prefetch:
+            prefetch.pop("defaults", None)
+        return {"windows": windows, "jobs": jobs, "prefetch": prefetch, "check_interval_seconds": SCHEDULE_CHECK_INTERVAL}
+
+    def set_prefetch(self, policy):
+        """Track components for new catalog versions; the newest versions now known are the baseline"""
+        components = policy.get("components") or []
+        if not components:
+            return {"error": "components is required"}
+        defaults = {key: policy.get(key) for key in ("home_dir", "final_registry", "registry_auth_file",
+                                                     "entitlement_key", "filter", "worker")}
+        if not all([defaults["final_registry"], defaults["registry_auth_file"]]):
+            return {"error": "final_registry and registry_auth_file are required"}
+        window = policy.get("window")
+        with self.lock:
+            self._load()
+            if window and window not in self.state["windows"]:
+                return {"error": f"Unknown window: {window}"}
+            seen = (self.state["prefetch"] or {}).get("seen", {})
+            for component in components:
+                newest = self._newest_known(component)
+                if newest and component not in seen:
+                    seen[component] = newest
+            self.state["prefetch"] = {"components": components, "window": window or None,
+                                      "not_before": policy.get("not_before"), "seen": seen, "defaults": defaults}
+            self._save()
+        return self.status()["prefetch"]
+
+    def disable_prefetch(self):
+        with self.lock:
+            self._load()
+            self.state["prefetch"] = None
+            self._save()
+        return {"success": True}
+
+    def catalog(self):
+        """Known versions per component: the built-in catalog plus CATALOG_FILE when present"""
+        versions = {comp["name"]: list(comp["versions"]) for comp in DEFAULT_COMPONENTS}
         try:
-            with open(log_file, 'r') as f:
-                return f.readlines()[-lines:]
-        except:
-            return []
-    
-    def _get_progress(self, download_id):
-        """Get download progress"""
-        download = self.downloads.get(download_id)
-        if not download:
-            return None
-        
-        name = download.get('name')
-        home_dir = download.get('home_dir', HOME_DIR)
+            mtime = os.path.getmtime(CATALOG_FILE)
+            if self._catalog[0] != mtime:
+                with open(CATALOG_FILE, 'r') as f:
+                    self._catalog = (mtime, json.load(f))
+            for component, extra in self._catalog[1].items():
+                versions.setdefault(component, [])
+                versions[component].extend(v for v in extra if v not in versions[component])
+        except (OSError, ValueError, AttributeError):
+            pass
+        return versions
+
+    def _newest_known(self, component):
+        """Newest catalog, downloaded or scheduled version of a component. Caller must hold the lock."""
+        known = set(self.catalog().get(component, []))
+        known.update(r["version"] for r in run_metrics.all_runs() if r.get("component") == component)
+        known.update(j["request"]["version"] for j in self.state["jobs"].values()
+                     if j["request"]["component"] == component)
+        return max(known, key=_version_key) if known else None
+
+    def _check_prefetch(self):
+        """Schedule downloads of catalog versions newer than any seen for the tracked components"""
+        with self.lock:
+            self._load()
+            policy = self.state["prefetch"]
+            if not policy:
+                return
+            catalog = self.catalog()
+            new = []
+            for component in policy["components"]:
+                versions = catalog.get(component, [])
+                if not versions:
+                    continue
+                newest = max(versions, key=_version_key)
+                seen = policy["seen"].get(component)
+                if seen and _version_key(newest) <= _version_key(seen):
+                    continue
+                policy["seen"][component] = newest
+                if seen:
+                    new.append((component, newest))
+            self._save()
+            defaults = dict(policy["defaults"])
+            window, not_before = policy["window"], policy.get("not_before")
         
-        if not name:
-            return None
+        for component, version in new:
+            name = f"{component}-{version}"
+            request = dict(defaults, component=component, version=version, name=name,
+                           home_dir=defaults.get("home_dir") or HOME_DIR)
+            if not window and not not_before:
+                not_before = datetime.now().isoformat()
+            self.schedule(f"{name}-{int(time.time())}", request, not_before, window, prefetch=True,
+                          seed_from=self._seed_directory(component, request["home_dir"]))
+
+    def _seed_directory(self, component, home_dir):
+        """Directory of the newest completed download of a component, to seed a delta mirror from"""
+        runs = [r for r in run_metrics.all_runs()
+                if r.get("component") == component and r.get("status") == "completed" and not r.get("dry_run")]
+        for run in sorted(runs, key=lambda r: _version_key(r.get("version")), reverse=True):
+            path = os.path.join(run.get("home_dir") or home_dir, run.get("name") or "")
+            if run.get("name") and os.path.isdir(os.path.join(path, "v2")):
+                return path
+        return None
+
+    def tick(self):
+        """Start the scheduled downloads that are due, within their window and budget"""
+        self._check_prefetch()
+        now = datetime.now()
+        with self.lock:
+            self._load()
+            due = []
+            for job in self.state["jobs"].values():
+                if job["status"] != "scheduled":
+                    continue
+                if job["not_before"] and datetime.fromisoformat(job["not_before"]) > now:
+                    continue
+                if job["window"]:
+                    window = self.state["windows"].get(job["window"])
+                    occurrence = _window_occurrence(window, now) if window else None
+                    if occurrence is None:
+                        job["waiting_reason"] = None
+                        continue
+                    estimated_bytes, _ = self.manager.capacity.estimate_bytes(
+                        job["request"]["component"], job["request"]["version"], job["request"].get("filter"),
+                        job["request"].get("dry_run", False))
+                    usage = self.state["usage"].get(job["window"])
+                    if not usage or usage["occurrence"] != occurrence.isoformat():
+                        usage = self.state["usage"][job["window"]] = {"occurrence": occurrence.isoformat(), "bytes": 0}
+                    budget = window.get("budget_bytes")
+                    if budget and usage["bytes"] + estimated_bytes > budget:
+                        job["waiting_reason"] = (
+                            f"Window {job['window']} budget spent: {_format_bytes(usage['bytes'])} of "
+                            f"{_format_bytes(budget)} used, needs {_format_bytes(estimated_bytes)}")
+                        continue
+                    usage["bytes"] += estimated_bytes
+                    job["budget_charge"] = {"occurrence": usage["occurrence"], "bytes": estimated_bytes}
+                job["status"] = "starting"
+                due.append(dict(job))
+            if due:
+                self._save()
         
-        summary_file = f"{home_dir}/{name}/{name}-summary-report.txt"
-        if os.path.exists(summary_file):
+        for job in due:
+            self._start(job)
+
+    def _start(self, job):
+        """Start a due download and record the outcome in its schedule"""
+        request, log = job["request"], job_logger(job["id"], "cp4i.scheduler")
+        if job.get("seed_from"):
+            # Copies, not links: oc may write into the blobs it finds, which must not change the seed's files
+            target = os.path.join(request["home_dir"], request["name"], "v2")
             try:
-                with open(summary_file, 'r') as f:
-                    content = f.read()
-                    # Parse summary for progress info
-                    return {"summary": content}
-            except:
-                pass
-        
+                copied = _hardlink_tree(os.path.join(job["seed_from"], "v2"), target, copy=True)
+                log.info("Seeded %d blobs from %s", copied, job["seed_from"])
+            except OSError as e:
+                log.warning("Cannot seed from %s, mirroring everything: %s", job["seed_from"], e)
+        try:
+            limits = _job_limits({k: request.get(k) for k in ("io_weight", "cpu_limit", "memory_limit")})
+            result = self.manager.start_download(
+                job["id"], request["component"], request["version"], request["name"], request.get("filter"),
+                request.get("dry_run", False), request.get("home_dir"), request.get("final_registry"),
+                request.get("registry_auth_file"), request.get("entitlement_key"),
+                request.get("on_insufficient_space", "queue"), request.get("auto_retry", True),
+                request.get("coalesce", True), limits, request.get("worker"), request.get("dry_run_mode", "auto"))
+        except Exception as e:
+            result = {"error": str(e)}
+        with self.lock:
+            stored = self.state["jobs"][job["id"]]
+            stored["started_time"] = datetime.now().isoformat()
+            charge = stored.pop("budget_charge", None)
+            if "error" in result:
+                stored["status"], stored["error"] = "failed", result["error"]
+                log.error("Could not start scheduled download: %s", result["error"])
+                # Nothing was downloaded: give the bytes back to the window's budget
+                usage = self.state["usage"].get(stored["window"]) if charge else None
+                if usage and usage["occurrence"] == charge["occurrence"]:
+                    usage["bytes"] = max(0, usage["bytes"] - charge["bytes"])
+            else:
+                stored["status"], stored["download_id"] = "started", result.get("download_id", job["id"])
+                log.info("Started scheduled download")
+            self._save()
+
+
+scheduler = JobScheduler(download_manager, SCHEDULE_STATE_FILE)
+if _serving_process():
+    scheduler.ensure_started()
+
+class WorkerAgent:
+    """Announces this server to a coordinator as a worker, with its load and free disk space"""
+
+    def __init__(self, manager, coordinator_url):
+        self.manager = manager
+        self.coordinator_url = coordinator_url.rstrip("/")
+        self._watch = None
+
+    def start(self):
+        if self._watch is None:
+            self.manager.supervisor.submit(self.manager.supervisor.run_blocking(self.heartbeat))
+            self._watch = self.manager.supervisor.every(WORKER_HEARTBEAT_INTERVAL, self.heartbeat, "worker heartbeat")
+
+    def heartbeat(self):
+        with self.manager.lock:
+            statuses = [d["status"] for d in self.manager.downloads.values()]
+            try:
+                fit = self.manager.capacity.check_fit(HOME_DIR, 0)
+            except OSError:
+                fit = {}
+        body = {
+            "name": WORKER_NAME,
+            "url": WORKER_URL,
+            "slots": WORKER_SLOTS,
+            "running": sum(1 for s in statuses if s not in FINISHED_STATUSES and s != "queued"),
+            "queued": statuses.count("queued"),
+            "free_bytes": fit.get("free_bytes"),
+            "available_bytes": fit.get("available_bytes"),
+            "home_dir": HOME_DIR
+        }
+        try:
+            status, result = _http_json("POST", f"{self.coordinator_url}/api/workers/heartbeat", body)
+        except OSError as e:
+            logging.getLogger("cp4i.workers").warning("Coordinator %s unreachable: %s", self.coordinator_url, e)
+            return
+        if status != 200:
+            logging.getLogger("cp4i.workers").warning("Heartbeat rejected by coordinator: %s", result.get("error"))
+
+
+worker_agent = None
+if COORDINATOR_URL and not WORKER_TOKEN:
+    logging.getLogger("cp4i.workers").error(
+        "CP4I_COORDINATOR_URL is set without CP4I_WORKER_TOKEN, not registering as a worker")
+elif COORDINATOR_URL:
+    worker_agent = WorkerAgent(download_manager, COORDINATOR_URL)
+if worker_agent and _serving_process():
+    worker_agent.start()
+
+
+def _job_metric(field):
+    """Build a scrape-time callback exposing one numeric field of each active job"""
+    def collect():
+        with download_manager.lock:
+            jobs = list(download_manager.downloads.values())
+        return [({"download_id": d["id"], "component": d["component"], "version": d["version"]},
+                 d.get(field) or 0) for d in jobs]
+    return collect
+
+
+def _jobs_by_status():
+    """Count active jobs per status for the jobs gauge"""
+    counts = {status: 0 for status in ("queued", "running", "progressing", "paused", "stopped")}
+    with download_manager.lock:
+        for d in download_manager.downloads.values():
+            counts[d["status"]] = counts.get(d["status"], 0) + 1
+    return [({"status": status}, count) for status, count in counts.items()]
+
+
+metrics_registry.register(Gauge(
+    "cp4i_downloads", "Downloads tracked by the manager by status", ("status",), callback=_jobs_by_status))
+metrics_registry.register(Gauge(
+    "cp4i_download_written_bytes", "Bytes written to the download directory",
+    ("download_id", "component", "version"), callback=_job_metric("written_bytes")))
+metrics_registry.register(Gauge(
+    "cp4i_download_estimated_bytes", "Estimated total bytes of the download",
+    ("download_id", "component", "version"), callback=_job_metric("estimated_bytes")))
+metrics_registry.register(Gauge(
+    "cp4i_download_images_mirrored", "Image manifests mirrored so far",
+    ("download_id", "component", "version"), callback=_job_metric("images_mirrored")))
+metrics_registry.register(Gauge(
+    "cp4i_download_throughput_bytes_per_second", "Recent write throughput of the download",
+    ("download_id", "component", "version"), callback=_job_metric("throughput_bytes_per_sec")))
+metrics_registry.register(Gauge(
+    "cp4i_download_process_cpu_percent", "CPU use of the download's process tree at the last /proc sample",
+    ("download_id", "component", "version"), callback=_job_metric("tree_cpu_percent")))
+metrics_registry.register(Gauge(
+    "cp4i_download_process_rss_bytes", "Resident memory of the download's process tree at the last /proc sample",
+    ("download_id", "component", "version"), callback=_job_metric("tree_rss_bytes")))
+metrics_registry.register(Gauge(
+    "cp4i_download_history_entries", "Finished downloads kept in history",
+    callback=lambda: [({}, len(download_history))]))
+
+
+def _accepts_gzip():
+    return "gzip" in request.headers.get("Accept-Encoding", "").lower()
+
+
+def _gzip_response(response):
+    """Compress a large JSON response when the client accepts gzip"""
+    if ("Content-Encoding" in response.headers or response.status_code != 200 or response.direct_passthrough
+            or response.mimetype != "application/json" or not _accepts_gzip()):
+        return response
+    body = response.get_data()
+    if len(body) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(body, GZIP_LEVEL))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+@app.before_request
+def _start_request_timer():
+    request.environ["cp4i.request_started"] = time.perf_counter()
+
+
+@app.after_request
+def _observe_request_latency(response):
+    started = request.environ.get("cp4i.request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                     method=request.method, route=route, status=response.status_code)
+    return response
+
+def _forward_to_worker(download_id, path=""):
+    """Relay a request about a download dispatched to a worker agent; None for local downloads"""
+    if not download_manager.workers.owner(download_id):
         return None
+    query = request.query_string.decode()
+    status, result = download_manager.workers.forward(
+        download_id, request.method, path + (f"?{query}" if query else ""), request.get_json(silent=True))
+    return jsonify(result), status
 
-# Initialize download manager
-download_manager = DownloadManager()
+
+def _worker_proxy(worker, path):
+    """Relay a GET to a worker agent with this request's query string"""
+    query = request.query_string.decode()
+    try:
+        status, result = _http_json("GET", f"{worker['url']}{path}" + (f"?{query}" if query else ""))
+    except OSError as e:
+        return jsonify({"error": f"Worker {worker['name']} unreachable: {e}"}), 502
+    return jsonify(result), status
 
 # Routes
 @app.route('/')
@@ -836,7 +5538,8 @@ def system_info():
         home_dir = request.args.get('home_dir', HOME_DIR)
         
         # Check disk space
-        disk_info = subprocess.run(
+        disk_info = _run_command(
+            "df",
             ['df', '-h', home_dir],
             capture_output=True,
             text=True
@@ -845,7 +5548,8 @@ def system_info():
         # Check prerequisites
         prereqs = {}
         for cmd in ['oc', 'podman', 'curl', 'jq']:
-            result = subprocess.run(
+            result = _run_command(
+                "which",
                 ['which', cmd],
                 capture_output=True,
                 text=True
@@ -853,7 +5557,8 @@ def system_info():
             prereqs[cmd] = result.returncode == 0
         
         # Check oc ibm-pak
-        ibmpak_result = subprocess.run(
+        ibmpak_result = _run_command(
+            "oc",
             ['oc', 'ibm-pak', '--version'],
             capture_output=True,
             text=True
@@ -897,46 +5602,190 @@ def config():
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
+def _submit_download(data):
+    """Validate a download request and start or schedule it; returns (result, HTTP status)"""
+    component = data.get('component')
+    version = data.get('version')
+    name = data.get('name')
+    filter_pattern = data.get('filter')
+    dry_run = data.get('dry_run', False)
+    
+    # Get configuration parameters
+    home_dir = data.get('home_dir')
+    final_registry = data.get('final_registry')
+    registry_auth_file = data.get('registry_auth_file')
+    entitlement_key = data.get('entitlement_key')
+    on_insufficient_space = data.get('on_insufficient_space', 'queue')
+    auto_retry = data.get('auto_retry', True)
+    coalesce = data.get('coalesce', True)
+    worker = data.get('worker')
+    dry_run_mode = data.get('dry_run_mode', 'auto')
+    try:
+        limits = _job_limits({k: data.get(k) for k in ('io_weight', 'cpu_limit', 'memory_limit')})
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    
+    if dry_run_mode not in ('auto', 'fast', 'live'):
+        return {"error": "dry_run_mode must be 'auto', 'fast' or 'live'"}, 400
+    
+    if on_insufficient_space not in ('queue', 'reject'):
+        return {"error": "on_insufficient_space must be 'queue' or 'reject'"}, 400
+    
+    if not all([component, version, name]):
+        return {"error": "Missing required fields"}, 400
+    
+    if filter_pattern:
+        try:
+            re.compile(filter_pattern)
+        except re.error as e:
+            return {"error": f"Invalid filter pattern: {e}"}, 400
+    
+    if not all([home_dir, final_registry, registry_auth_file]):
+        return {"error": "Missing required configuration parameters (home_dir, final_registry, registry_auth_file)"}, 400
+    
+    download_id = f"{name}-{int(time.time())}"
+    schedule = data.get('schedule')
+    if schedule is not None and not isinstance(schedule, dict):
+        return {"error": "schedule must be an object with not_before and/or window"}, 400
+    if schedule:
+        # Held until not_before has passed and its window is open, then started as below
+        result = scheduler.schedule(download_id, {
+            k: data.get(k) for k in ('component', 'version', 'name', 'filter', 'dry_run', 'home_dir',
+                                     'final_registry', 'registry_auth_file', 'entitlement_key',
+                                     'on_insufficient_space', 'auto_retry', 'coalesce', 'worker', 'dry_run_mode',
+                                     'io_weight', 'cpu_limit', 'memory_limit') if data.get(k) is not None
+        }, schedule.get('not_before'), schedule.get('window'))
+        return result, 400 if "error" in result else 200
+    
+    result = download_manager.start_download(
+        download_id, component, version, name, filter_pattern, dry_run,
+        home_dir, final_registry, registry_auth_file, entitlement_key,
+        on_insufficient_space, auto_retry, coalesce, limits, worker, dry_run_mode
+    )
+    
+    if "error" in result:
+        status = 507 if result.get("insufficient_space") else 404 if result.get("mapping_missing") else 400
+        return result, status
+    
+    return result, 200
+
+def _end_download(download_id, action):
+    """Stop or dismiss one download wherever it runs; returns (result, HTTP status)
+
+    One still waiting for its schedule is cancelled by either action.
+    """
+    if scheduler.pending(download_id):
+        cancelled = scheduler.cancel(download_id)
+        if cancelled:
+            return cancelled, 200
+        # It started since; stop or dismiss the running download instead
+    workers = download_manager.workers
+    if workers.owner(download_id):
+        status, result = workers.forward(download_id, "DELETE" if action == "stop" else "PATCH", "")
+        return result, status
+    if action == "stop":
+        result = download_manager.stop_download(download_id)
+    else:
+        result = download_manager.dismiss_download(download_id)
+    return result, 400 if "error" in result else 200
+
+def _retry(download_id, overrides):
+    """Retry one download wherever it ran; returns (result, HTTP status)"""
+    if download_manager.workers.owner(download_id):
+        status, result = download_manager.workers.retry(download_id, overrides)
+        return result, status
+    result = download_manager.retry_download(download_id, overrides)
+    if "error" in result:
+        return result, (404 if result["error"] == "Download not found"
+                        else 507 if result.get("insufficient_space") else 500)
+    return result, 200
+
+def _batch_item(action, item, defaults):
+    """Apply one action of a batch to one download; returns (result, HTTP status)"""
+    if action == "start":
+        return _submit_download(dict(defaults, **item))
+    download_id, overrides = item["id"], dict(defaults, **{k: v for k, v in item.items() if k != "id"})
+    if action == "retry":
+        return _retry(download_id, overrides)
+    return _end_download(download_id, action)
+
+@app.route('/api/downloads:batch', methods=['POST'])
+def downloads_batch():
+    """Start, stop, dismiss or retry many downloads in one call, concurrently, with a result per item"""
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    items = data.get('items')
+    defaults = data.get('defaults') or {}
+    if action not in ('start', 'stop', 'dismiss', 'retry'):
+        return jsonify({"error": "action must be start, stop, dismiss or retry"}), 400
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items must be a non-empty list"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_MAX_ITEMS} items per batch"}), 400
+    if not isinstance(defaults, dict):
+        return jsonify({"error": "defaults must be an object"}), 400
+    
+    # Downloads are named by id, or by name when starting; the same one twice is answered once
+    key = "name" if action == "start" else "id"
+    items = [{"id": item} if isinstance(item, str) else item for item in items]
+    results, seen, todo = [None] * len(items), set(), []
+    for position, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get(key):
+            results[position] = ({"error": f"Each item needs {'a name' if key == 'name' else 'an id'}"}, 400)
+        elif item.get(key) in seen:
+            results[position] = ({"error": f"Duplicate {key} in batch"}, 409)
+        else:
+            seen.add(item.get(key))
+            todo.append(position)
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="cp4i-batch") as pool:
+        futures = {pool.submit(_batch_item, action, items[position], defaults): position for position in todo}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                results[futures[future]] = ({"error": str(e)}, 500)
+    
+    response = []
+    for item, (result, status) in zip(items, results):
+        entry = {key: item.get(key) if isinstance(item, dict) else item, "status_code": status}
+        entry.update(result)
+        response.append(entry)
+    succeeded = sum(1 for _, status in results if status < 300)
+    return jsonify({"action": action, "results": response, "succeeded": succeeded,
+                    "failed": len(results) - succeeded})
+
 @app.route('/api/downloads', methods=['GET', 'POST'])
 def downloads():
     """List or start downloads"""
     if request.method == 'GET':
-        return jsonify({
-            "active": download_manager.get_all_downloads(),
-            "history": download_history
-        })
+        # Answer polls from the versioned feed: 304 when unchanged, or only changes with ?since=
+        version = download_manager.refresh_feed()
+        since = request.args.get('since', type=int)
+        etag = f"{version}" if since is None else f"{version}-since-{since}"
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+        
+        delta = download_manager.feed.delta(since) if since is not None else None
+        if delta is not None:
+            response = jsonify(delta)
+        else:
+            compress = _accepts_gzip()
+            response = app.response_class(download_manager.feed.full_body(compress), mimetype="application/json")
+            if compress:
+                response.headers["Content-Encoding"] = "gzip"
+                response.vary.add("Accept-Encoding")
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return _gzip_response(response)
     
     elif request.method == 'POST':
         try:
             data = request.json
-            component = data.get('component')
-            version = data.get('version')
-            name = data.get('name')
-            filter_pattern = data.get('filter')
-            dry_run = data.get('dry_run', False)
-            
-            # Get configuration parameters
-            home_dir = data.get('home_dir')
-            final_registry = data.get('final_registry')
-            registry_auth_file = data.get('registry_auth_file')
-            entitlement_key = data.get('entitlement_key')
-            
-            if not all([component, version, name]):
-                return jsonify({"error": "Missing required fields"}), 400
-            
-            if not all([home_dir, final_registry, registry_auth_file]):
-                return jsonify({"error": "Missing required configuration parameters (home_dir, final_registry, registry_auth_file)"}), 400
-            
-            download_id = f"{name}-{int(time.time())}"
-            result = download_manager.start_download(
-                download_id, component, version, name, filter_pattern, dry_run,
-                home_dir, final_registry, registry_auth_file, entitlement_key
-            )
-            
-            if "error" in result:
-                return jsonify(result), 400
-            
-            return jsonify(result)
+            result, status = _submit_download(data)
+            return jsonify(result), status
         
         except Exception as e:
             return jsonify({"error": str(e)}), 500
@@ -944,146 +5793,141 @@ def downloads():
 @app.route('/api/downloads/<download_id>', methods=['GET', 'DELETE', 'PATCH'])
 def download_detail(download_id):
     """Get, stop, or dismiss a specific download"""
-    if request.method == 'GET':
-        result = download_manager.get_download_status(download_id)
-        if "error" in result:
-            return jsonify(result), 404
-        return jsonify(result)
+    if request.method in ('DELETE', 'PATCH'):
+        result, status = _end_download(download_id, "stop" if request.method == 'DELETE' else "dismiss")
+        return jsonify(result), status
     
-    elif request.method == 'DELETE':
-        result = download_manager.stop_download(download_id)
-        if "error" in result:
-            return jsonify(result), 400
-        return jsonify(result)
+    pending = scheduler.pending(download_id)
+    if pending:
+        return jsonify(next((r for r in scheduler.job_records() if r["id"] == download_id), pending))
     
-    elif request.method == 'PATCH':
-        # Dismiss download
-        result = download_manager.dismiss_download(download_id)
-        if "error" in result:
-            return jsonify(result), 400
-        return jsonify(result)
+    forwarded = _forward_to_worker(download_id)
+    if forwarded:
+        return forwarded
+    
+    result = download_manager.get_download_status(download_id)
+    if "error" in result:
+        return jsonify(result), 404
+    return jsonify(result)
+
+@app.route('/api/downloads/<download_id>/events', methods=['GET'])
+def download_events(download_id):
+    """Poll the typed event stream parsed from a download's log"""
+    forwarded = _forward_to_worker(download_id, "/events")
+    if forwarded:
+        return forwarded
+    kinds = request.args.get('kind')
+    result = download_manager.get_download_events(
+        download_id,
+        since=request.args.get('since', 0, type=int),
+        kinds=set(kinds.split(',')) if kinds else None
+    )
+    if "error" in result:
+        return jsonify(result), 404
+    return jsonify(result)
+
+@app.route('/api/downloads/<download_id>/errors', methods=['GET'])
+def download_errors(download_id):
+    """Errors and warnings indexed from a download's whole log, grouped by cause"""
+    forwarded = _forward_to_worker(download_id, "/errors")
+    if forwarded:
+        return forwarded
+    severity = request.args.get('severity')
+    if severity not in (None, "error", "warning"):
+        return jsonify({"error": "severity must be error or warning"}), 400
+    limit = request.args.get('limit', 100, type=int)
+    if limit < 0:
+        return jsonify({"error": "limit must not be negative"}), 400
+    result = download_manager.get_download_errors(
+        download_id,
+        severity=severity,
+        cause=request.args.get('cause', type=int),
+        failure_class=request.args.get('class'),
+        since=request.args.get('since', 0, type=int),
+        limit=min(limit, ERROR_INDEX_MAX_ENTRIES),
+        context=max(0, min(request.args.get('context', 0, type=int), ERROR_CONTEXT_MAX_LINES))
+    )
+    if "error" in result:
+        return jsonify(result), 404
+    return jsonify(result)
+
+@app.route('/api/downloads/<download_id>/profile', methods=['GET'])
+def download_profile(download_id):
+    """Time series of a download's process tree: CPU, memory, IO and stalls"""
+    forwarded = _forward_to_worker(download_id, "/profile")
+    if forwarded:
+        return forwarded
+    result = download_manager.get_download_profile(download_id, since=request.args.get('since'))
+    if "error" in result:
+        return jsonify(result), 404
+    return jsonify(result)
 
 @app.route('/api/downloads/<download_id>/retry', methods=['POST'])
 def retry_download(download_id):
     """Retry a failed download using the script's --retry flag"""
-    global download_history
-    
     try:
-        # Get download info from either active downloads or history
-        download = download_manager.downloads.get(download_id)
-        if not download:
-            # Check history
-            for hist in download_history:
-                if hist['id'] == download_id:
-                    download = hist
-                    break
-        
-        if not download:
-            return jsonify({"error": "Download not found"}), 404
-        
-        # Get configuration from request body (user can modify) or fall back to stored values
-        data = request.json or {}
-        home_dir = data.get('home_dir') or download.get('home_dir', HOME_DIR)
-        final_registry = data.get('final_registry') or download.get('final_registry', 'registry.example.com:5000')
-        registry_auth_file = data.get('registry_auth_file') or download.get('registry_auth_file', '/root/.docker/config.json')
-        entitlement_key = data.get('entitlement_key') or download.get('entitlement_key')
-        
-        print(f"[RETRY] Using configuration: home_dir={home_dir}, final_registry={final_registry}")
-        
-        # Build retry command using the script's --retry flag
-        cmd = [
-            "bash", SCRIPT_PATH,
-            "--component", download['component'],
-            "--version", download['version'],
-            "--name", download['name'],
-            "--retry"  # Use the script's built-in retry mechanism
-        ]
-        
-        if download.get('filter'):
-            cmd.extend(["--filter", download['filter']])
-        
-        # Build environment variables
-        env = os.environ.copy()
-        env["HOME_DIR"] = home_dir
-        env["FINAL_REGISTRY"] = final_registry
-        env["REGISTRY_AUTH_FILE"] = registry_auth_file
-        if entitlement_key:
-            env["ENTITLEMENT_KEY"] = entitlement_key
-        
-        # Start retry process
-        try:
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                env=env
-            )
-            
-            new_download_id = f"{download['name']}-retry-{int(time.time())}"
-            
-            # Remove any existing downloads and history entries for this name to avoid duplicates
-            with download_manager.lock:
-                # Remove from active downloads
-                to_remove = [did for did, d in download_manager.downloads.items()
-                            if d.get('name') == download['name']]
-                for did in to_remove:
-                    del download_manager.downloads[did]
-                    print(f"Removed old download {did} before retry")
-                
-                # Remove from history to avoid showing old failed/dismissed entries
-                download_history = [h for h in download_history
-                                   if h.get('name') != download['name']]
-                print(f"Cleaned history for {download['name']}")
-                
-                download_manager.downloads[new_download_id] = {
-                    "id": new_download_id,
-                    "component": download['component'],
-                    "version": download['version'],
-                    "name": download['name'],
-                    "filter": download.get('filter'),
-                    "process": process,
-                    "home_dir": home_dir,
-                    "final_registry": final_registry,
-                    "registry_auth_file": registry_auth_file,
-                    "status": "running",
-                    "start_time": datetime.now().isoformat(),
-                    "pid": process.pid,
-                    "mirror_pid": None,  # Will be captured from log
-                    "log_file": f"{home_dir}/{download['name']}/{download['name']}-download.log"
-                }
-                
-                # Start monitoring thread
-                threading.Thread(
-                    target=download_manager._monitor_download,
-                    args=(new_download_id,),
-                    daemon=True
-                ).start()
-            
-            return jsonify({"success": True, "download_id": new_download_id, "pid": process.pid})
-        
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-    
+        # Configuration in the request body overrides the stored values
+        result, status = _retry(download_id, request.json or {})
+        return jsonify(result), status
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/logs/<name>', methods=['GET'])
 def get_logs(name):
-    """Get log file for a download"""
+    """Get log file for a download, or its last lines (tail) or a byte range (offset, length)"""
     try:
         # Get home_dir from query parameter or use default
         home_dir = request.args.get('home_dir', HOME_DIR)
         log_file = f"{home_dir}/{name}/{name}-download.log"
-        if not os.path.exists(log_file):
+        archive = LogArchive(log_file)
+        if not archive.exists():
+            worker = download_manager.workers.worker_for_name(name, request.args.get('home_dir'))
+            if worker:
+                return _worker_proxy(worker, f"/api/logs/{name}")
             return jsonify({"error": "Log file not found"}), 404
         
-        with open(log_file, 'r') as f:
-            return jsonify({"logs": f.read()})
+        tail = request.args.get('tail', type=int)
+        offset = request.args.get('offset', type=int)
+        length = request.args.get('length', type=int)
+        if (tail is not None and tail < 1) or (offset is not None and offset < 0) or (length is not None and length < 0):
+            return jsonify({"error": "tail must be positive, offset and length must not be negative"}), 400
+        
+        retention.touch(home_dir, name)
+        size = archive.size()
+        result = {"size": size, "archived": archive.archived}
+        if tail is not None:
+            logs = "".join(archive.tail(tail))
+        elif offset is not None or length is not None:
+            offset = offset or 0
+            data = archive.read(offset, min(length if length is not None else LOG_RANGE_MAX_BYTES,
+                                            LOG_RANGE_MAX_BYTES))
+            logs = data.decode('utf-8', errors='replace')
+            result.update(offset=offset, next_offset=offset + len(data))
+        else:
+            logs = archive.read().decode('utf-8', errors='replace')
+        LOG_READ_BYTES.inc(len(logs), reader="api")
+        result["logs"] = logs
+        return jsonify(result)
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/server-logs', methods=['GET'])
+def get_server_logs():
+    """Query the server's in-memory structured log buffer"""
+    try:
+        records = log_buffer.query(
+            level=request.args.get('level'),
+            download_id=request.args.get('download_id'),
+            logger_name=request.args.get('logger'),
+            contains=request.args.get('q'),
+            since=request.args.get('since', 0, type=int),
+            limit=request.args.get('limit', 200, type=int)
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"logs": records, "last_seq": log_buffer.seq, "capacity": log_buffer.records.maxlen})
+
 @app.route('/api/reports/<name>', methods=['GET'])
 def get_report(name):
     """Get summary report for a download"""
@@ -1094,71 +5938,217 @@ def get_report(name):
         # Report is stored directly in home_dir with format: {name}-summary-report.txt
         report_file = f"{home_dir}/{name}-summary-report.txt"
         
-        print(f"[REPORT] Looking for report at: {report_file}")
+        logging.getLogger("cp4i.api").debug("Looking for report at: %s", report_file)
         
         if not os.path.exists(report_file):
+            worker = download_manager.workers.worker_for_name(name, request.args.get('home_dir'))
+            if worker:
+                return _worker_proxy(worker, f"/api/reports/{name}")
             return jsonify({
                 "error": f"Report not found. The download may not have completed yet.",
                 "path": report_file
             }), 404
         
+        retention.touch(home_dir, name)
         with open(report_file, 'r') as f:
             return jsonify({"report": f.read()})
     
     except Exception as e:
-        print(f"[REPORT] Error: {e}")
+        logging.getLogger("cp4i.api").exception("Error reading report: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/components', methods=['GET'])
 def get_components():
     """Get list of CP4I components"""
-    # Return default hardcoded components
-    components = [
-        {
-            "name": "ibm-integration-platform-navigator",
-            "description": "Platform Navigator",
-            "typical_size": "~15GB",
-            "versions": ["7.3.2", "7.3.1", "7.3.0"]
-        },
-        {
-            "name": "ibm-apiconnect",
-            "description": "API Connect",
-            "typical_size": "~25GB",
-            "versions": ["10.0.8", "10.0.7", "10.0.6"]
-        },
-        {
-            "name": "ibm-mq",
-            "description": "MQ Advanced",
-            "typical_size": "~8GB",
-            "versions": ["9.3.5", "9.3.4", "9.3.3"]
-        },
-        {
-            "name": "ibm-eventstreams",
-            "description": "Event Streams",
-            "typical_size": "~12GB",
-            "versions": ["11.4.0", "11.3.2", "11.3.1"]
-        },
-        {
-            "name": "ibm-app-connect",
-            "description": "App Connect Enterprise",
-            "typical_size": "~10GB",
-            "versions": ["12.0.11", "12.0.10", "12.0.9"]
-        },
-        {
-            "name": "ibm-datapower-operator",
-            "description": "DataPower Gateway",
-            "typical_size": "~5GB",
-            "versions": ["1.11.0", "1.10.3", "1.10.2"]
-        }
-    ]
+    # Return default hardcoded components, with size estimates for the latest version
+    components = []
+    for comp in DEFAULT_COMPONENTS:
+        estimated_bytes, source = download_manager.capacity.estimate_bytes(comp["name"], comp["versions"][0])
+        components.append(dict(comp, estimated_bytes=estimated_bytes, estimate_source=source))
     
     return jsonify({"components": components, "source": "default"})
 
+@app.route('/api/capacity', methods=['GET'])
+def get_capacity():
+    """Get disk capacity, reservations and an optional admission preview"""
+    try:
+        result = download_manager.get_capacity(
+            home_dir=request.args.get('home_dir', HOME_DIR),
+            component=request.args.get('component'),
+            version=request.args.get('version'),
+            filter_pattern=request.args.get('filter'),
+            dry_run=request.args.get('dry_run', 'false').lower() == 'true'
+        )
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/plan', methods=['POST'])
+def plan_download():
+    """Preview the images a component/version/filter would mirror, with size and duration estimates"""
+    data = request.json or {}
+    component = data.get('component')
+    version = data.get('version')
+    if not component or not version:
+        return jsonify({"error": "component and version are required"}), 400
+    
+    home_dir = data.get('home_dir') or HOME_DIR
+    result = mirror_planner.plan(component, version, data.get('filter'), home_dir, data.get('final_registry'))
+    if "error" in result:
+        return jsonify(result), 404 if result.get("mapping_missing") else 400
+    
+    with download_manager.lock:
+        try:
+            result["capacity"] = download_manager.capacity.check_fit(home_dir, result["estimated_bytes"])
+        except OSError as e:
+            result["capacity"] = {"error": str(e)}
+    return jsonify(result)
+
+@app.route('/api/retention', methods=['GET'])
+def get_retention():
+    """Get retention settings, download directory usage, pins and what the next pass would delete"""
+    try:
+        return jsonify(retention.status())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/retention/run', methods=['POST'])
+def run_retention():
+    """Run a retention pass now, or preview it with dry_run"""
+    data = request.json or {}
+    result = retention.run_pass(dry_run=bool(data.get('dry_run', False)))
+    if "error" in result:
+        return jsonify(result), 409
+    return jsonify(result)
+
+@app.route('/api/retention/pins/<name>', methods=['PUT', 'DELETE'])
+def retention_pin(name):
+    """Pin a download directory so retention never deletes it, or unpin it"""
+    home_dir = request.args.get('home_dir', HOME_DIR)
+    if not name or "/" in name or name.startswith("."):
+        return jsonify({"error": "Invalid download name"}), 400
+    return jsonify(retention.pin(home_dir, name, pinned=request.method == 'PUT'))
+
+@app.route('/api/registry/sessions', methods=['GET', 'DELETE'])
+def registry_sessions():
+    """List the shared registry logins, or drop them all so the next jobs log in again"""
+    if request.method == 'DELETE':
+        return jsonify(download_manager.sessions.clear())
+    return jsonify(download_manager.sessions.status())
+
+@app.route('/api/notifications', methods=['GET'])
+def notifications_status():
+    """Notification settings, queue and recent deliveries"""
+    return jsonify(download_manager.notifier.status())
+
+@app.route('/api/notifications/test', methods=['POST'])
+def notifications_test():
+    """Queue a test notification through the configured channels"""
+    if not download_manager.notifier.enabled:
+        return jsonify({"error": "No webhook or email configured (CP4I_WEBHOOK_URL, CP4I_NOTIFICATION_EMAIL)"}), 400
+    download_manager.notifier.notify("test", f"test-{int(time.time())}", {"name": "test"},
+                                     "Test notification from the CP4I download manager", force=True)
+    return jsonify({"success": True, "batch_window_seconds": NOTIFY_BATCH_WINDOW})
+
+@app.route('/api/schedule', methods=['GET'])
+def schedule_status():
+    """Windows, scheduled downloads and the prefetch policy"""
+    return jsonify(scheduler.status())
+
+@app.route('/api/schedule/windows/<name>', methods=['PUT', 'DELETE'])
+def schedule_window(name):
+    """Create, replace or delete an off-peak window"""
+    if request.method == 'PUT':
+        result = scheduler.set_window(name, request.json or {})
+    else:
+        result = scheduler.delete_window(name)
+    if "error" in result:
+        return jsonify(result), 404 if result["error"] == "Window not found" else 400
+    return jsonify(result)
+
+@app.route('/api/schedule/jobs/<download_id>', methods=['DELETE'])
+def cancel_scheduled(download_id):
+    """Cancel a download that has not started yet"""
+    result = scheduler.cancel(download_id)
+    if result is None:
+        return jsonify({"error": "No scheduled download with that id"}), 404
+    return jsonify(result)
+
+@app.route('/api/schedule/prefetch', methods=['PUT', 'DELETE'])
+def schedule_prefetch():
+    """Enable or disable prefetch of new versions of tracked components"""
+    if request.method == 'DELETE':
+        return jsonify(scheduler.disable_prefetch())
+    result = scheduler.set_prefetch(request.json or {})
+    if "error" in result:
+        return jsonify(result), 400
+    return jsonify(result)
+
+@app.route('/api/workers', methods=['GET'])
+def list_workers():
+    """Registered worker agents with their load, free disk space and dispatched downloads"""
+    return jsonify({"workers": download_manager.workers.list_workers(),
+                    "coordinator_runs_jobs": COORDINATOR_RUNS_JOBS})
+
+@app.route('/api/workers/heartbeat', methods=['POST'])
+def worker_heartbeat():
+    """Register or refresh a worker agent"""
+    if not WORKER_TOKEN:
+        return jsonify({"error": "Worker registration is disabled, set CP4I_WORKER_TOKEN to enable it"}), 403
+    if not hmac.compare_digest(request.headers.get("X-CP4I-Worker-Token", ""), WORKER_TOKEN):
+        return jsonify({"error": "Invalid worker token"}), 403
+    result = download_manager.workers.heartbeat(request.json or {})
+    if "error" in result:
+        return jsonify(result), 400
+    return jsonify(result)
+
+@app.route('/api/workers/<name>', methods=['PATCH'])
+def update_worker(name):
+    """Drain a worker so no new downloads are placed on it, or undrain it"""
+    result = download_manager.workers.set_draining(name, bool((request.json or {}).get('draining', True)))
+    if "error" in result:
+        return jsonify(result), 404
+    return jsonify(result)
+
+@app.route('/api/metrics/history', methods=['GET'])
+def metrics_history():
+    """Aggregate recorded run metrics (duration percentiles, throughput trend)"""
+    try:
+        bucket = request.args.get('bucket', 'day')
+        if bucket not in ('day', 'week', 'month'):
+            return jsonify({"error": "bucket must be one of day, week, month"}), 400
+        
+        result = run_metrics.aggregate(
+            component=request.args.get('component'),
+            version=request.args.get('version'),
+            status=request.args.get('status', 'completed'),
+            since=request.args.get('since'),
+            bucket=bucket,
+            include_dry_run=request.args.get('include_dry_run', 'false').lower() == 'true'
+        )
+        
+        if request.args.get('include_runs', 'false').lower() == 'true':
+            limit = request.args.get('limit', 100, type=int)
+            runs = [r for r in run_metrics.all_runs()
+                    if (not request.args.get('component') or r.get('component') == request.args.get('component'))
+                    and (not request.args.get('version') or r.get('version') == request.args.get('version'))]
+            result["recent_runs"] = runs[-limit:]
+        
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Expose server metrics in the Prometheus text format"""
+    return metrics_registry.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
 @app.route('/api/validate', methods=['POST'])
 def validate_prerequisites():
     """Validate system prerequisites"""
     try:
-        result = subprocess.run(
+        result = _run_command(
+            "script",
             ['bash', SCRIPT_PATH, '--help'],
             capture_output=True,
             text=True,
@@ -1178,6 +6168,6 @@ if __name__ == '__main__':
     os.makedirs(HOME_DIR, exist_ok=True)
     
     # Run the app
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=SERVER_PORT, debug=True)
 
 # Made with Bob
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""Load test for the CP4I download manager, with stub oc/podman instead of IBM registries
+
+Runs the real cp4i_downloader.sh for every job, with bench/stub first on PATH,
+so the script, the supervisor, log following and the API are all exercised.
+Two scenarios:
+
+  api      the web app in a child process, N downloads started through the
+           API and M clients polling it the way the web interface does
+  manager  DownloadManager driven in this process, without HTTP
+
+Reports request latency percentiles, server CPU and memory, memory per job and
+the delay between the end of each mirror and the server reporting its final
+status. With --baseline, exits 1 when a metric regressed beyond --tolerance.
+
+    python bench/run_bench.py --jobs 20 --clients 10 --images 50
+    python bench/run_bench.py --json results.json
+    python bench/run_bench.py --baseline results.json --tolerance 0.25
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUB_DIR = os.path.join(BENCH_DIR, "stub")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+FINISHED = ("completed", "failed", "stopped", "dismissed")
+
+# Serves the app with the threaded werkzeug server, without the debug reloader
+SERVER_CODE = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import app
+from werkzeug.serving import make_server
+app.MONITOR_INTERVAL = float(sys.argv[3])
+make_server("127.0.0.1", int(sys.argv[2]), app.app, threaded=True).serve_forever()
+"""
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers"""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = (len(values) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def summarize(values, scale=1.0):
+    """count, p50, p95, p99 and max of a list of measurements"""
+    if not values:
+        return {"count": 0}
+    return {"count": len(values),
+            **{f"p{p}": round(percentile(values, p) * scale, 2) for p in (50, 95, 99)},
+            "max": round(max(values) * scale, 2)}
+
+
+class Latencies:
+    """Thread-safe latency samples per operation"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, operation, seconds, ok=True):
+        with self.lock:
+            self.samples.setdefault(operation, []).append(seconds)
+            if not ok:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def timed(self, operation, fn, *args):
+        started = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception:
+            self.record(operation, time.perf_counter() - started, ok=False)
+            raise
+        self.record(operation, time.perf_counter() - started)
+        return result
+
+    def report(self):
+        with self.lock:
+            return {op: dict(summarize(samples, 1000), errors=self.errors.get(op, 0))
+                    for op, samples in sorted(self.samples.items())}
+
+
+class ProcessSampler:
+    """Samples CPU time and resident memory of a process and, separately, of its descendants"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.rss = []
+        self.children_rss = []
+        self.cpu_start = self._cpu_seconds()
+        self.cpu_end = self.cpu_start
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+    @staticmethod
+    def _rss_bytes(pid):
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                return int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            return 0
+
+    def _descendants(self):
+        parents = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        parents.setdefault(int(f.read().rsplit(")", 1)[1].split()[1]), []).append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    continue
+        found, todo = [], [self.pid]
+        while todo:
+            children = parents.get(todo.pop(), [])
+            found.extend(children)
+            todo.extend(children)
+        return found
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.cpu_end = self._cpu_seconds()
+            except OSError:
+                return
+            self.rss.append(self._rss_bytes(self.pid))
+            self.children_rss.append(sum(self._rss_bytes(pid) for pid in self._descendants()))
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def bench_env(args, work_dir):
+    """Environment of the server and its jobs: stubs first on PATH, all state under work_dir"""
+    env = dict(os.environ)
+    env.update({
+        "PATH": f"{STUB_DIR}:{env.get('PATH', '')}",
+        "CP4I_METRICS_FILE": os.path.join(work_dir, "run-metrics.jsonl"),
+        "CP4I_IMAGE_SIZE_CACHE": os.path.join(work_dir, "image-sizes.json"),
+        "CP4I_RETENTION_STATE": os.path.join(work_dir, "retention.json"),
+        "CP4I_SCHEDULE_STATE": os.path.join(work_dir, "schedule.json"),
+        "CP4I_REGISTRY_SESSION_DIR": os.path.join(work_dir, "sessions"),
+        "CP4I_CATALOG_FILE": os.path.join(work_dir, "versions.json"),
+        "CP4I_CGROUP_ROOT": os.path.join(work_dir, "cgroup"),
+        "BENCH_IMAGES": str(args.images),
+        "BENCH_BLOBS": str(args.blobs),
+        "BENCH_BLOB_MB": str(args.blob_mb),
+        "BENCH_IMAGE_SECONDS": str(args.image_seconds),
+        "BENCH_FAIL_PERCENT": str(args.fail_percent),
+        "BENCH_FAIL_STYLE": args.fail_style,
+        "BENCH_LOGIN_SECONDS": str(args.login_seconds),
+    })
+    for key in ("CP4I_WEBHOOK_URL", "CP4I_NOTIFICATION_EMAIL", "CP4I_COORDINATOR_URL"):
+        env.pop(key, None)
+    return env
+
+
+def job_requests(args, home_dir):
+    auth_file = os.path.join(home_dir, "auth.json")
+    with open(auth_file, "w") as f:
+        f.write("{}")
+    return [{
+        "component": "ibm-mq",
+        "version": f"9.3.{i % args.versions}",
+        "name": f"bench-{i}",
+        "home_dir": home_dir,
+        "final_registry": "registry.bench:5000",
+        "registry_auth_file": auth_file,
+        "entitlement_key": "bench-key",
+        "coalesce": False,
+        "auto_retry": False
+    } for i in range(args.jobs)]
+
+
+def detection_delays(home_dir, seen):
+    """Seconds from each mirror's end, as marked by the oc stub, to its final status being seen"""
+    delays = []
+    for name, seen_at in seen.items():
+        try:
+            with open(os.path.join(home_dir, name, ".bench-mirror-done")) as f:
+                delays.append(seen_at - float(f.read()))
+        except (OSError, ValueError):
+            continue
+    return delays
+
+
+def http(method, url, body=None, headers=None, timeout=30):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method,
+                                 headers=dict({"Content-Type": "application/json"}, **(headers or {})))
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            raw = response.read()
+            return response.status, (json.loads(raw) if raw else None), response.headers
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return 304, None, e.headers
+        raise
+
+
+def run_api(args, work_dir):
+    """Web app in a child process, jobs started over HTTP and polled by M clients"""
+    home_dir = os.path.join(work_dir, "home")
+    os.makedirs(home_dir)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    base = f"http://127.0.0.1:{port}"
+    server_log = open(os.path.join(work_dir, "server.log"), "w")
+    server = subprocess.Popen([sys.executable, "-c", SERVER_CODE, REPO_DIR, str(port), str(args.monitor_interval)],
+                              env=bench_env(args, work_dir), stdout=server_log, stderr=subprocess.STDOUT,
+                              start_new_session=True)
+    latencies, seen, seen_lock, done = Latencies(), {}, threading.Lock(), threading.Event()
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                http("GET", f"{base}/api/downloads")
+                break
+            except OSError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise SystemExit(f"Server did not start, see {server_log.name}")
+                time.sleep(0.2)
+        sampler = ProcessSampler(server.pid).start()
+        baseline_rss = ProcessSampler._rss_bytes(server.pid)
+        requests = job_requests(args, home_dir)
+        names = {r["name"] for r in requests}
+
+        def client():
+            version, etag, active, iteration = None, None, [], 0
+            while not done.is_set():
+                iteration += 1
+                query = f"?since={version}" if version is not None else ""
+                status, body, headers = latencies.timed(
+                    "GET /api/downloads", http, "GET", f"{base}/api/downloads{query}", None,
+                    {"If-None-Match": etag} if etag else None)
+                if status == 200:
+                    etag, version = headers.get("ETag"), body["version"]
+                    now = time.time()
+                    active = [d for d in body.get("active", []) if d["status"] not in FINISHED] or active
+                    finished = [d for d in body.get("active", []) + body.get("history", [])
+                                if d["status"] in FINISHED and d["name"] in names]
+                    with seen_lock:
+                        for d in finished:
+                            seen.setdefault(d["name"], now)
+                if active and iteration % 3 == 0:
+                    d = random.choice(active)
+                    for operation, path in (("GET /api/downloads/<id>", f"/api/downloads/{d['id']}"),
+                                            ("GET /api/logs/<name>", f"/api/logs/{d['name']}?tail=50&home_dir={home_dir}")):
+                        try:
+                            latencies.timed(operation, http, "GET", f"{base}{path}")
+                        except urllib.error.HTTPError:
+                            pass  # finished between polls
+                done.wait(args.poll_interval)
+
+        clients = [threading.Thread(target=client, daemon=True) for _ in range(args.clients)]
+        started = time.time()
+        if args.batch:
+            latencies.timed("POST /api/downloads:batch", http, "POST", f"{base}/api/downloads:batch",
+                            {"action": "start", "items": requests}, None, 300)
+        for thread in clients:
+            thread.start()
+        if not args.batch:
+            for body in requests:
+                latencies.timed("POST /api/downloads", http, "POST", f"{base}/api/downloads", body)
+
+        while len(seen) < len(requests) and time.time() - started < args.timeout:
+            time.sleep(0.2)
+        wall = time.time() - started
+        done.set()
+        for thread in clients:
+            thread.join()
+        sampler.stop()
+        _, body, _ = http("GET", f"{base}/api/downloads")
+        if len(seen) < len(requests):
+            unfinished = [d["id"] for d in body["active"] if d["status"] not in FINISHED]
+            http("POST", f"{base}/api/downloads:batch", {"action": "dismiss", "items": unfinished})
+        statuses = [h["status"] for h in body["history"] if h["name"] in names]
+        return report(args, latencies, sampler, baseline_rss, detection_delays(home_dir, seen), statuses, wall)
+    finally:
+        done.set()
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+        server_log.close()
+
+
+def run_manager(args, work_dir):
+    """DownloadManager in this process: start_download, then M threads polling the feed and job list"""
+    home_dir = os.path.join(work_dir, "home")
+    os.makedirs(home_dir)
+    os.environ.update(bench_env(args, work_dir))
+    sys.path.insert(0, REPO_DIR)
+    import app  # after the environment is set, state file locations are read at import
+    app.MONITOR_INTERVAL = args.monitor_interval
+    app.logging.getLogger("cp4i").setLevel(app.logging.WARNING)
+
+    manager, latencies, done = app.download_manager, Latencies(), threading.Event()
+    seen, seen_lock = {}, threading.Lock()
+    requests = job_requests(args, home_dir)
+    names = {r["name"] for r in requests}
+
+    def poller():
+        while not done.is_set():
+            latencies.timed("refresh_feed", manager.refresh_feed)
+            downloads = latencies.timed("get_all_downloads", manager.get_all_downloads)
+            if downloads:
+                latencies.timed("get_download_status", manager.get_download_status, random.choice(downloads)["id"])
+            now = time.time()
+            with manager.lock:
+                finished = [h["name"] for h in app.download_history if h["name"] in names]
+            with seen_lock:
+                for name in finished:
+                    seen.setdefault(name, now)
+            done.wait(args.poll_interval)
+
+    sampler = ProcessSampler(os.getpid()).start()
+    baseline_rss = ProcessSampler._rss_bytes(os.getpid())
+    started = time.time()
+    for r in requests:
+        latencies.timed("start_download", manager.start_download, f"{r['name']}-{int(started)}", r["component"],
+                        r["version"], r["name"], None, False, r["home_dir"], r["final_registry"],
+                        r["registry_auth_file"], r["entitlement_key"], "queue", False, False)
+    pollers = [threading.Thread(target=poller, daemon=True) for _ in range(args.clients)]
+    for thread in pollers:
+        thread.start()
+    while len(seen) < len(requests) and time.time() - started < args.timeout:
+        time.sleep(0.2)
+    wall = time.time() - started
+    done.set()
+    for thread in pollers:
+        thread.join()
+    sampler.stop()
+    for download in manager.get_all_downloads():
+        if download["status"] not in FINISHED:
+            manager.dismiss_download(download["id"])
+    with manager.lock:
+        statuses = [h["status"] for h in app.download_history if h["name"] in names]
+    return report(args, latencies, sampler, baseline_rss, detection_delays(home_dir, seen), statuses, wall)
+
+
+def report(args, latencies, sampler, baseline_rss, delays, statuses, wall):
+    peak_rss = max(sampler.rss, default=baseline_rss)
+    return {
+        "scenario": args.scenario,
+        "settings": {k: v for k, v in vars(args).items() if k not in ("json", "baseline", "keep")},
+        "wall_seconds": round(wall, 2),
+        "jobs": {"completed": statuses.count("completed"), "failed": statuses.count("failed"),
+                 "unfinished": args.jobs - len(statuses)},
+        "latency_ms": latencies.report(),
+        "detection_delay_s": summarize(delays),
+        "server": {
+            "cpu_seconds": round(sampler.cpu_end - sampler.cpu_start, 2),
+            "cpu_percent": round(100 * (sampler.cpu_end - sampler.cpu_start) / wall, 1) if wall else None,
+            "peak_rss_mb": round(peak_rss / 2**20, 1),
+            "rss_per_job_kb": round((peak_rss - baseline_rss) / args.jobs / 1024, 1)
+        },
+        "job_processes": {
+            "peak_rss_mb": round(max(sampler.children_rss, default=0) / 2**20, 1),
+            "peak_rss_per_job_mb": round(max(sampler.children_rss, default=0) / args.jobs / 2**20, 1)
+        }
+    }
+
+
+def regressions(result, baseline, tolerance):
+    """Metrics worse than the baseline by more than tolerance (a fraction)"""
+    checks = [(f"{op} p95 ms", stats.get("p95"), baseline["latency_ms"].get(op, {}).get("p95"))
+              for op, stats in result["latency_ms"].items()]
+    checks += [("detection delay p95 s", result["detection_delay_s"].get("p95"),
+                baseline["detection_delay_s"].get("p95")),
+               ("server cpu seconds", result["server"]["cpu_seconds"], baseline["server"]["cpu_seconds"]),
+               ("server rss per job kb", result["server"]["rss_per_job_kb"], baseline["server"]["rss_per_job_kb"])]
+    return [f"{name}: {value} vs {before}" for name, value, before in checks
+            if value is not None and before and value > before * (1 + tolerance)]
+
+
+def print_report(result):
+    print(f"\n{result['scenario']}: {result['settings']['jobs']} jobs, {result['settings']['clients']} clients, "
+          f"{result['wall_seconds']}s; completed {result['jobs']['completed']}, failed {result['jobs']['failed']}, "
+          f"unfinished {result['jobs']['unfinished']}")
+    print(f"\n{'operation':<32}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    for op, stats in result["latency_ms"].items():
+        print(f"{op:<32}{stats['count']:>7}{stats.get('p50', '-'):>10}{stats.get('p95', '-'):>10}"
+              f"{stats.get('p99', '-'):>10}{stats.get('max', '-'):>10}{stats['errors']:>8}")
+    delay = result["detection_delay_s"]
+    print(f"\nstatus detection delay: p50 {delay.get('p50', '-')}s, p95 {delay.get('p95', '-')}s, "
+          f"max {delay.get('max', '-')}s ({delay['count']} jobs)")
+    server, jobs = result["server"], result["job_processes"]
+    print(f"server: {server['cpu_seconds']} CPU s ({server['cpu_percent']}%), peak RSS {server['peak_rss_mb']} MB, "
+          f"{server['rss_per_job_kb']} KB per job")
+    print(f"job processes: peak RSS {jobs['peak_rss_mb']} MB, {jobs['peak_rss_per_job_mb']} MB per job")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenario", choices=("api", "manager"), default="api")
+    parser.add_argument("--jobs", type=int, default=10, help="concurrent downloads")
+    parser.add_argument("--clients", type=int, default=5, help="polling clients")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between polls per client")
+    parser.add_argument("--batch", action="store_true", help="start jobs with one POST /api/downloads:batch")
+    parser.add_argument("--images", type=int, default=20, help="images per download")
+    parser.add_argument("--blobs", type=int, default=4, help="blobs per image")
+    parser.add_argument("--blob-mb", type=int, default=50, help="size of each (sparse) blob")
+    parser.add_argument("--image-seconds", type=float, default=0.5, help="mirror time per image")
+    parser.add_argument("--fail-percent", type=int, default=0, help="images failing with manifest unknown")
+    parser.add_argument("--fail-style", choices=("image", "generic"), default="image",
+                        help="per-image errors and oc's summary, or unclassified errors and only the exit code")
+    parser.add_argument("--login-seconds", type=float, default=0.2, help="time per podman login")
+    parser.add_argument("--versions", type=int, default=3, help="distinct versions among the jobs")
+    parser.add_argument("--monitor-interval", type=float, default=10, help="server log follow interval")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for all jobs")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression against the baseline")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="cp4i-bench-")
+    try:
+        result = (run_api if args.scenario == "api" else run_manager)(args, work_dir)
+    finally:
+        if args.keep:
+            print(f"Work directory: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            worse = regressions(result, json.load(f), args.tolerance)
+        for line in worse:
+            print(f"REGRESSION {line}")
+        return 1 if worse else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
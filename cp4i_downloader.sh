@@ -42,7 +42,7 @@ WEBHOOK_URL="${CP4I_WEBHOOK_URL:-}"
 NOTIFICATION_EMAIL="${CP4I_NOTIFICATION_EMAIL:-}"
 
 # ========= GLOBAL VARIABLES =========
-COMPONENT="" VERSION="" NAME="" FILTER=""
+COMPONENT="" VERSION="" NAME="" FILTER="" RETRY_MAPPING_FILE=""
 DRYRUN=false RETRY=false FORCE_RETRY=false
 VERBOSE=false CONFIG_MODE=false
 START_TIME=$(date +%s)
@@ -185,6 +185,12 @@ retry_with_backoff() {
 
 # ========= AUTHENTICATION =========
 authenticate_registry() {
+  # The web server hands over an auth file with a login it has already validated
+  if [[ "${CP4I_REGISTRY_SESSION:-}" == "true" ]]; then
+    log_info "Using registry session from $REGISTRY_AUTH_FILE"
+    return 0
+  fi
+  
   log_info "Authenticating to IBM registry..."
   
   # Always authenticate, even in dry-run mode (needed for manifest generation)
@@ -236,11 +242,36 @@ stop_progress_monitor() {
   fi
 }
 
+# ========= MAPPING PROVENANCE =========
+# Digest of the CASE a mapping file is generated from: the sha256 of the
+# sha256sum listing of its files, by path relative to the CASE directory in
+# byte order. The web app computes the same digest to tell whether a cached
+# mapping file still matches.
+case_digest() {
+  local case_dir="$IBMPAK_HOME/.ibm-pak/data/cases/$COMPONENT/$VERSION"
+  [[ -d "$case_dir" ]] || return 1
+  (cd "$case_dir" && find . -type f -print0 | LC_ALL=C sort -z | xargs -0 -r sha256sum) | sha256sum | cut -d' ' -f1
+}
+
+# Record the filter and CASE digest next to a freshly generated mapping file
+write_mapping_source() {
+  local source_file
+  source_file="$(dirname "$MAPPING_FILE")/mapping-source.json"
+  local digest filter="${FILTER//\\/\\\\}"
+  filter="${filter//\"/\\\"}"
+  digest=$(case_digest) || digest=""
+  printf '{"filter": "%s", "case_digest": "%s", "generated": "%s"}\n' "$filter" "$digest" "$(date -Iseconds)" \
+    > "$source_file.tmp" && mv "$source_file.tmp" "$source_file"
+}
+
 # ========= NOTIFICATION SUPPORT =========
 send_notification() {
   local status="$1"
   local message="$2"
   
+  # Under the web server its dispatcher sends (and batches) notifications instead
+  [[ "${CP4I_NOTIFY_VIA_SERVER:-}" == "true" ]] && return 0
+  
   # Webhook notification
   if [[ -n "$WEBHOOK_URL" ]]; then
     local payload=$(jq -n \
@@ -362,6 +393,7 @@ parse_arguments() {
       --dry-run)       DRYRUN=true; shift ;;
       --retry)         RETRY=true; shift ;;
       --force-retry)   FORCE_RETRY=true; shift ;;
+      --mapping-file)  RETRY_MAPPING_FILE="$2"; shift 2 ;;
       --verbose)       VERBOSE=true; shift ;;
       --create-config) create_sample_config; exit 0 ;;
       --help)
@@ -381,6 +413,7 @@ Optional Options:
   --dry-run                 Show what would be done without executing
   --retry                   Resume previous download
   --force-retry             Force retry from mapping file
+  --mapping-file <path>     Mapping file to resume from (with --retry), e.g. only failed images
   --verbose                 Enable verbose logging
   --create-config           Create sample configuration file
   --help                    Show this help message
@@ -455,6 +488,7 @@ main() {
   
   # ========= RETRY MODES =========
   if $FORCE_RETRY || $RETRY; then
+    [[ -n "$RETRY_MAPPING_FILE" ]] && MAPPING_FILE="$RETRY_MAPPING_FILE"
     if [[ -f "$MAPPING_FILE" ]]; then
       log_info "Resuming mirror from: $MAPPING_FILE"
       DOWNLOAD_START_TIME=$(date +%s)
@@ -468,13 +502,18 @@ main() {
         send_notification "RESUMED" "Download resumed for $COMPONENT v$VERSION"
         
         # Run in foreground
-        oc image mirror -f "$MAPPING_FILE" \
+        if oc image mirror -f "$MAPPING_FILE" \
           --filter-by-os '.*' -a "$REGISTRY_AUTH_FILE" \
           --insecure --skip-multiple-scopes --max-per-registry="$MAX_PARALLEL_DOWNLOADS" \
-          --dir "$LOCAL_DIR" >> "${LOCAL_DIR}/${NAME}-download.log" 2>&1
-        
-        log_info "info: Mirroring completed"
-        send_notification "COMPLETED" "Download completed for $COMPONENT v$VERSION"
+          --dir "$LOCAL_DIR" >> "${LOCAL_DIR}/${NAME}-download.log" 2>&1; then
+          log_info "info: Mirroring completed"
+          send_notification "COMPLETED" "Download completed for $COMPONENT v$VERSION"
+        else
+          local mirror_rc=$?
+          log_error "oc image mirror failed with exit code $mirror_rc"
+          send_notification "FAILED" "Download failed for $COMPONENT v$VERSION"
+          exit "$mirror_rc"
+        fi
       fi
       exit 0
     else
@@ -505,6 +544,7 @@ main() {
   # Always generate manifests, even in dry-run mode
   if retry_with_backoff "$MAX_RETRIES" eval "$GEN_CMD"; then
     log_success "Manifests generated successfully"
+    write_mapping_source || log_warn "Could not record the mapping file's filter and CASE digest"
   else
     abort "Manifest generation failed"
   fi
@@ -540,13 +580,18 @@ main() {
     send_notification "STARTED" "Download started for $COMPONENT v$VERSION"
     
     # Run in foreground so we can monitor properly
-    oc image mirror -f "$MAPPING_FILE" \
+    if oc image mirror -f "$MAPPING_FILE" \
       --filter-by-os '.*' -a "$REGISTRY_AUTH_FILE" \
       --insecure --skip-multiple-scopes --max-per-registry="$MAX_PARALLEL_DOWNLOADS" \
-      --dir "$LOCAL_DIR" >> "${LOCAL_DIR}/${NAME}-download.log" 2>&1
-    
-    log_info "info: Mirroring completed"
-    send_notification "COMPLETED" "Download completed for $COMPONENT v$VERSION"
+      --dir "$LOCAL_DIR" >> "${LOCAL_DIR}/${NAME}-download.log" 2>&1; then
+      log_info "info: Mirroring completed"
+      send_notification "COMPLETED" "Download completed for $COMPONENT v$VERSION"
+    else
+      local mirror_rc=$?
+      log_error "oc image mirror failed with exit code $mirror_rc"
+      send_notification "FAILED" "Download failed for $COMPONENT v$VERSION"
+      exit "$mirror_rc"
+    fi
   fi
   
   log_success "Setup complete. Download running."
@@ -7,6 +7,7 @@ const API_BASE = '/api';
 let components = [];
 let activeDownloads = [];
 let downloadHistory = [];
+let downloadsVersion = null;
 let refreshInterval = null;
 
 // Initialize app
@@ -209,14 +210,39 @@ async function startDownload(event) {
     }
 }
 
-// Load Downloads
+// Apply changed records and removed ids from a delta response to a list
+function mergeRecords(records, changed, removedIds) {
+    const removed = new Set(removedIds);
+    const updates = new Map(changed.map(record => [record.id, record]));
+    const merged = records
+        .filter(record => !removed.has(record.id))
+        .map(record => {
+            const update = updates.get(record.id);
+            updates.delete(record.id);
+            return update || record;
+        });
+    return merged.concat([...updates.values()]);
+}
+
+// Load Downloads (only the changes since the last poll once the full list is loaded)
 async function loadDownloads() {
     try {
-        const response = await fetch(`${API_BASE}/downloads`);
+        const query = downloadsVersion === null ? '' : `?since=${downloadsVersion}`;
+        const response = await fetch(`${API_BASE}/downloads${query}`);
         const data = await response.json();
         
-        activeDownloads = data.active || [];
-        downloadHistory = data.history || [];
+        if (data.delta) {
+            const unchanged = !data.active.length && !data.history.length &&
+                !data.removed.active.length && !data.removed.history.length;
+            downloadsVersion = data.version;
+            if (unchanged) return;
+            activeDownloads = mergeRecords(activeDownloads, data.active, data.removed.active);
+            downloadHistory = mergeRecords(downloadHistory, data.history, data.removed.history);
+        } else {
+            activeDownloads = data.active || [];
+            downloadHistory = data.history || [];
+            downloadsVersion = data.version;
+        }
         
         renderActiveDownloads();
         renderHistory();
@@ -250,8 +276,15 @@ function renderActiveDownloads() {
                 <div><i class="fas fa-folder"></i> <strong>Name:</strong> ${download.name}</div>
                 <div><i class="fas fa-clock"></i> <strong>Started:</strong> ${formatDateTime(download.start_time)}</div>
                 <div><i class="fas fa-hashtag"></i> <strong>PID:</strong> ${download.pid || 'N/A'}</div>
+                ${download.worker ? `<div><i class="fas fa-server"></i> <strong>Worker:</strong> ${download.worker}</div>` : ''}
             </div>
             
+            ${download.status_reason ? `
+                <p style="font-size: 0.85rem; color: var(--text-secondary); margin-top: 5px;">
+                    <i class="fas ${download.status === 'scheduled' ? 'fa-calendar' : 'fa-hdd'}"></i> ${download.status_reason}
+                </p>
+            ` : ''}
+            
             ${download.status === 'running' ? `
                 <div class="progress-bar">
                     <div class="progress-fill" style="width: ${download.progress || 50}%"></div>
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+# State files of the app go to a scratch directory, not HOME_DIR
+_state_dir = tempfile.mkdtemp(prefix="cp4i-tests-")
+for _var, _name in (("CP4I_METRICS_FILE", "run-metrics.jsonl"), ("CP4I_IMAGE_SIZE_CACHE", "image-sizes.json"),
+                    ("CP4I_RETENTION_STATE", "retention.json"), ("CP4I_SCHEDULE_STATE", "schedule.json"),
+                    ("CP4I_REGISTRY_SESSION_DIR", "sessions"), ("CP4I_CATALOG_FILE", "versions.json"),
+                    ("CP4I_CGROUP_ROOT", "cgroup")):
+    os.environ.setdefault(_var, os.path.join(_state_dir, _name))
+# No background retention passes over the real download directories
+os.environ["CP4I_RETENTION_INTERVAL"] = "0"
+for _var in ("CP4I_WEBHOOK_URL", "CP4I_NOTIFICATION_EMAIL", "CP4I_COORDINATOR_URL"):
+    os.environ.pop(_var, None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,50 @@
+"""Failure classification and the records behind automatic retries"""
+import pytest
+
+import app
+from app import FailureClass
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("error: unable to retrieve source image cp.icr.io/cp/x: manifest unknown: manifest unknown",
+     FailureClass.MANIFEST_MISSING),
+    ("name unknown: repository name not known to registry", FailureClass.MANIFEST_MISSING),
+    ("GET https://cp.icr.io/v2/cp/x/manifests/1.0: 404 Not Found", FailureClass.MANIFEST_MISSING),
+    ("error: file not found: /root/.docker/config.json", FailureClass.UNKNOWN),
+    ("stat /opt/cp4i/x/v2: no such file or directory, path not found", FailureClass.UNKNOWN),
+    ("error: unauthorized: authentication required", FailureClass.AUTH),
+    ("write /opt/cp4i/x/blob: no space left on device", FailureClass.DISK_FULL),
+    ("error: Get https://cp.icr.io/v2/: net/http: TLS handshake timeout", FailureClass.TRANSIENT_NETWORK),
+    ("received unexpected HTTP status: 503 Service Unavailable", FailureClass.TRANSIENT_NETWORK),
+])
+def test_classify_failure_message(message, expected):
+    assert app.classify_failure_message(message) == expected
+
+
+def _record(dry_run):
+    return {"component": "ibm-mq", "version": "9.3.5", "name": "mq", "filter": None, "dry_run": dry_run,
+            "home_dir": "/tmp/cp4i", "final_registry": "r:5000", "registry_auth_file": "/tmp/auth.json",
+            "log_file": "/nonexistent/mq-download.log", "status": "retrying",
+            "next_mapping_file": "/tmp/cp4i/mq/.retry-mapping-1.txt"}
+
+
+def test_auto_retry_resumes_a_mirror():
+    cmd, _ = app.download_manager._prepare_auto_retry(_record(dry_run=False))
+    assert "--retry" in cmd
+    assert cmd[cmd.index("--mapping-file") + 1] == "/tmp/cp4i/mq/.retry-mapping-1.txt"
+
+
+def test_auto_retry_reruns_a_dry_run_without_retry_flag():
+    cmd, _ = app.download_manager._prepare_auto_retry(_record(dry_run=True))
+    assert "--dry-run" in cmd
+    assert "--retry" not in cmd
+    assert "--mapping-file" not in cmd
+
+
+def test_failed_spawn_is_not_classified_from_the_previous_attempt():
+    download = dict(_record(dry_run=False), log_follower=None, spawn_error="[Errno 2] No such file: 'bash'",
+                    attempts=[{"attempt": 1, "status": "failed", "failure_class": FailureClass.TRANSIENT_NETWORK}])
+    delay = app.download_manager._conclude_attempt("mq-1", download, "failed", app.job_logger("mq-1"))
+    assert delay is None
+    assert download["attempts"][-1]["failure_class"] == FailureClass.UNKNOWN
+    assert download["attempts"][-1]["error"] == "[Errno 2] No such file: 'bash'"
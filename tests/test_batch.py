@@ -0,0 +1,51 @@
+"""Batch operations answer each item as the single-download endpoints would"""
+import threading
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize("action,method", [("stop", "delete"), ("dismiss", "patch")])
+def test_unknown_download_matches_single_route(client, action, method):
+    single = getattr(client, method)("/api/downloads/nope-1")
+    batch = client.post("/api/downloads:batch", json={"action": action, "items": ["nope-1"]}).get_json()
+
+    assert batch["results"][0]["status_code"] == single.status_code == 400
+
+
+@pytest.mark.parametrize("action", ["stop", "dismiss"])
+def test_scheduled_download_is_cancelled(client, monkeypatch, tmp_path, action):
+    scheduler = app.JobScheduler(app.download_manager, str(tmp_path / "schedule.json"))
+    monkeypatch.setattr(app, "scheduler", scheduler)
+    scheduler.schedule("mq-1", {"component": "ibm-mq", "version": "9.3.5", "name": "mq"},
+                       not_before="2999-01-01T00:00:00")
+
+    batch = client.post("/api/downloads:batch", json={"action": action, "items": ["mq-1"]}).get_json()
+
+    assert batch["results"][0]["status_code"] == 200
+    assert scheduler.state["jobs"]["mq-1"]["status"] == "cancelled"
+
+
+def test_dismissals_write_their_reports_concurrently(client, monkeypatch, tmp_path):
+    manager = app.download_manager
+    ids = [f"test-dismiss-{i}" for i in range(4)]
+    # Each report waits for all the others: this only passes when none is written under the lock
+    together = threading.Barrier(len(ids), timeout=5)
+    monkeypatch.setattr(manager, "_generate_summary_report", lambda download, parser=None: together.wait())
+    with manager.lock:
+        for download_id in ids:
+            manager.downloads[download_id] = manager._new_download(
+                download_id, "ibm-mq", "9.3.5", download_id, None, False, str(tmp_path), "r:5000", None, None,
+                0, "default", None)
+
+    batch = client.post("/api/downloads:batch", json={"action": "dismiss", "items": ids}).get_json()
+    app.download_history[:] = [h for h in app.download_history if h["id"] not in ids]
+
+    assert [result["status_code"] for result in batch["results"]] == [200] * len(ids)
+    assert not any(download_id in manager.downloads for download_id in ids)
@@ -0,0 +1,103 @@
+"""Disk space admission: reservations, the queue, and pausing on low space"""
+import concurrent.futures
+import signal
+
+import pytest
+
+import app
+
+GB = app.GB
+
+
+@pytest.fixture
+def disk(tmp_path, monkeypatch):
+    """Manager with a settable free space, 10 GB jobs, and launches recorded instead of spawned"""
+    manager = app.download_manager
+    state = {"free": 0, "launched": [], "signals": []}
+    monkeypatch.setattr(app, "DISK_HEADROOM_BYTES", 0)
+    monkeypatch.setattr(app, "DISK_PAUSE_FREE_BYTES", 2 * GB)
+    monkeypatch.setattr(app, "DISK_RESUME_FREE_BYTES", 8 * GB)
+    monkeypatch.setattr(manager.capacity, "free_bytes", lambda home_dir: state["free"])
+    monkeypatch.setattr(manager.capacity, "estimate_bytes", lambda *args: (10 * GB, "test"))
+    monkeypatch.setattr(manager, "_ensure_capacity_watcher", lambda: None)
+
+    def launch(download_id):
+        manager.downloads[download_id]["status"] = "running"
+        state["launched"].append(download_id)
+        spawned = concurrent.futures.Future()
+        spawned.set_result(1)
+        return spawned
+
+    def signal_download(download, sig):
+        state["signals"].append((download["id"], sig))
+        return True
+
+    monkeypatch.setattr(manager, "_launch_download", launch)
+    monkeypatch.setattr(manager, "_signal_download", signal_download)
+    state["home_dir"] = str(tmp_path)
+    yield state
+    with manager.lock:
+        for download_id in [d for d in manager.downloads if d.startswith("test-")]:
+            del manager.downloads[download_id]
+
+
+def _start(disk, download_id, **kwargs):
+    return app.download_manager.start_download(download_id, "ibm-mq", "9.3.5", download_id, home_dir=disk["home_dir"],
+                                               coalesce=False, worker="local", **kwargs)
+
+
+def test_job_is_queued_until_space_is_freed(disk):
+    disk["free"] = 5 * GB
+    result = _start(disk, "test-a")
+
+    assert result["status"] == "queued" and not disk["launched"]
+    assert "Waiting for disk space" in app.download_manager.downloads["test-a"]["queued_reason"]
+
+    app.download_manager._capacity_tick()
+    assert not disk["launched"]
+
+    disk["free"] = 20 * GB
+    app.download_manager._capacity_tick()
+    assert disk["launched"] == ["test-a"]
+
+
+def test_reject_instead_of_queueing(disk):
+    disk["free"] = 5 * GB
+    result = _start(disk, "test-a", on_insufficient_space="reject")
+
+    assert result["insufficient_space"] and result["capacity"]["required_bytes"] == 10 * GB
+    assert "test-a" not in app.download_manager.downloads
+
+
+def test_running_jobs_reserve_their_outstanding_bytes(disk):
+    disk["free"] = 15 * GB
+    assert _start(disk, "test-a")["status"] == "running"
+    result = _start(disk, "test-b")
+
+    assert result["status"] == "queued"
+    assert result["capacity"]["reserved_bytes"] == 10 * GB
+
+    # The first job finishing releases its reservation
+    with app.download_manager.lock:
+        del app.download_manager.downloads["test-a"]
+    app.download_manager._capacity_tick()
+    assert disk["launched"] == ["test-a", "test-b"]
+
+
+def test_low_space_pauses_and_resumes(disk):
+    disk["free"] = 15 * GB
+    _start(disk, "test-a")
+    download = app.download_manager.downloads["test-a"]
+
+    disk["free"] = 1 * GB
+    app.download_manager._capacity_tick()
+    assert download["status"] == "paused" and "Low disk space" in download["paused_reason"]
+
+    disk["free"] = 5 * GB
+    app.download_manager._capacity_tick()
+    assert download["status"] == "paused"
+
+    disk["free"] = 10 * GB
+    app.download_manager._capacity_tick()
+    assert download["status"] == "running" and "paused_reason" not in download
+    assert disk["signals"] == [("test-a", signal.SIGSTOP), ("test-a", signal.SIGCONT)]
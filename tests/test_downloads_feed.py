@@ -0,0 +1,90 @@
+"""GET /api/downloads: ETags, ?since= deltas and gzip from the versioned feed"""
+import gzip
+import json
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app.download_manager, "feed", app.DownloadsFeed())
+    yield app.app.test_client()
+    _set_history([h for h in app.download_history if not h["id"].startswith("test-")])
+
+
+def _set_history(entries):
+    with app.download_manager.lock:
+        app.download_history[:] = entries
+        app.download_manager.history_generation += 1
+
+
+def _entry(download_id, **fields):
+    return dict({"id": download_id, "name": download_id, "component": "ibm-mq", "version": "9.3.5",
+                 "status": "completed"}, **fields)
+
+
+def test_unchanged_feed_answers_304(client):
+    first = client.get("/api/downloads")
+    etag = first.headers["ETag"]
+
+    again = client.get("/api/downloads", headers={"If-None-Match": etag})
+
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+
+
+def test_changed_feed_gets_a_new_etag(client):
+    etag = client.get("/api/downloads").headers["ETag"]
+    _set_history(app.download_history + [_entry("test-new")])
+
+    response = client.get("/api/downloads", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_delta_has_changed_records_and_removed_ids(client):
+    _set_history(app.download_history + [_entry("test-kept"), _entry("test-gone")])
+    version = client.get("/api/downloads").get_json()["version"]
+
+    _set_history([h for h in app.download_history if h["id"] != "test-gone"] + [_entry("test-added")])
+    body = client.get(f"/api/downloads?since={version}").get_json()
+
+    assert body["delta"] is True and body["since"] == version and body["version"] > version
+    assert [h["id"] for h in body["history"]] == ["test-added"]
+    assert body["removed"]["history"] == ["test-gone"]
+    assert body["removed"]["active"] == []
+
+
+def test_delta_from_before_the_oldest_is_answered_in_full(client):
+    feed = app.download_manager.feed
+    body = client.get(f"/api/downloads?since={feed.oldest_delta - 1}").get_json()
+
+    assert body["delta"] is False
+    assert "removed" not in body
+    assert "active" in body and "history" in body
+
+
+def test_forgotten_removals_move_the_oldest_delta(client, monkeypatch):
+    monkeypatch.setattr(app, "DOWNLOADS_FEED_MAX_REMOVED", 1)
+    feed = app.download_manager.feed
+    feed.refresh([], [_entry("test-a"), _entry("test-b")], 1)
+    version = feed.version
+
+    feed.refresh([], [], 2)
+
+    assert feed.oldest_delta > version
+    assert feed.delta(version) is None
+
+
+def test_full_body_is_gzipped_when_accepted(client):
+    _set_history(app.download_history + [_entry(f"test-{i}") for i in range(50)])
+
+    response = client.get("/api/downloads", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    body = json.loads(gzip.decompress(response.get_data()))
+    assert {f"test-{i}" for i in range(50)} <= {h["id"] for h in body["history"]}
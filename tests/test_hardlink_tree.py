@@ -0,0 +1,57 @@
+"""Materialising coalesced downloads with hard links"""
+import os
+
+import pytest
+
+import app
+
+
+def _source(tmp_path):
+    src = tmp_path / "src"
+    (src / "v2" / "blobs").mkdir(parents=True)
+    (src / "v2" / "blobs" / "sha256-a").write_text("layer")
+    (src / "v2" / "blobs" / "sha256-b").write_text("layer")
+    (src / "src-download.log").write_text("log")
+    (src / "src-download.log.errors.json").write_text("{}")
+    return src
+
+
+def test_links_tree_and_renames_log(tmp_path):
+    src = _source(tmp_path)
+    dst = tmp_path / "dst"
+
+    linked = app._hardlink_tree(str(src), str(dst), ("src-download.log", "dst-download.log"))
+
+    assert linked == 4
+    assert sorted(os.listdir(dst)) == ["dst-download.log", "dst-download.log.errors.json", "v2"]
+    assert os.path.samefile(src / "v2" / "blobs" / "sha256-a", dst / "v2" / "blobs" / "sha256-a")
+
+
+def test_failure_removes_partial_tree(tmp_path, monkeypatch):
+    src = _source(tmp_path)
+    dst = tmp_path / "parent" / "dst"
+    real_link = os.link
+    calls = []
+
+    def failing_link(source, target, **kwargs):
+        calls.append(target)
+        if len(calls) == 3:
+            raise OSError(18, "Invalid cross-device link")
+        return real_link(source, target, **kwargs)
+
+    monkeypatch.setattr(app.os, "link", failing_link)
+    with pytest.raises(OSError):
+        app._hardlink_tree(str(src), str(dst))
+
+    assert not (tmp_path / "parent").exists()
+    assert sorted(os.listdir(src / "v2" / "blobs")) == ["sha256-a", "sha256-b"]
+
+
+def test_existing_files_are_kept(tmp_path):
+    src = _source(tmp_path)
+    dst = tmp_path / "dst"
+    dst.mkdir()
+    (dst / "src-download.log").write_text("own log")
+
+    assert app._hardlink_tree(str(src), str(dst)) == 3
+    assert (dst / "src-download.log").read_text() == "own log"
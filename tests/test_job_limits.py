@@ -0,0 +1,26 @@
+"""Validation of per-job resource limits"""
+import pytest
+
+import app
+
+
+def test_defaults_and_strings():
+    limits = app._job_limits({"io_weight": "200", "cpu_limit": "1.5", "memory_limit": "2GB"})
+    assert limits == {"io_weight": 200, "cpu_limit": 1.5, "memory_limit": 2 * 1024**3}
+
+
+@pytest.mark.parametrize("overrides", [
+    {"io_weight": [1]},
+    {"io_weight": True},
+    {"io_weight": "heavy"},
+    {"io_weight": 0},
+    {"cpu_limit": {"cores": 2}},
+    {"cpu_limit": "nan"},
+    {"cpu_limit": -1},
+    {"memory_limit": ["1G"]},
+    {"memory_limit": "1.2.3G"},
+    {"memory_limit": "lots"},
+])
+def test_invalid_values_raise_value_error(overrides):
+    with pytest.raises(ValueError):
+        app._job_limits(overrides)
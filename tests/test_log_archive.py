@@ -0,0 +1,35 @@
+"""Archiving finished logs while new runs restore them"""
+import app
+
+
+def _log(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "LOG_ARCHIVE_MIN_BYTES", 0)
+    log_file = tmp_path / "mq-download.log"
+    log_file.write_text("".join(f"[2024-01-01 10:00:00] [INFO] line {i}\n" for i in range(100)))
+    return log_file
+
+
+def test_archive_replaces_log(tmp_path, monkeypatch):
+    log_file = _log(tmp_path, monkeypatch)
+    content = log_file.read_bytes()
+
+    app.download_manager._archive_finished_log("d1", {"log_file": str(log_file)})
+
+    assert not log_file.exists()
+    assert app.LogArchive(str(log_file)).read() == content
+
+
+def test_restore_during_archiving_keeps_log(tmp_path, monkeypatch):
+    log_file = _log(tmp_path, monkeypatch)
+    content = log_file.read_bytes()
+    archive_log = app._archive_log
+
+    def archive_then_restore(path):
+        result = archive_log(path)
+        app._restore_log(path)  # A new run of the same directory starts meanwhile
+        return result
+
+    monkeypatch.setattr(app, "_archive_log", archive_then_restore)
+    app.download_manager._archive_finished_log("d1", {"log_file": str(log_file)})
+
+    assert log_file.read_bytes() == content
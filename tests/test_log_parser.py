@@ -0,0 +1,144 @@
+"""LogEventParser on download logs as written by cp4i_downloader.sh and oc image mirror"""
+import os
+
+import pytest
+
+import app
+from app import EventKind, FailureClass, LogEventParser
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "logs")
+
+
+def parse(name, chunk_size=None):
+    """Feed a fixture through a parser, in chunks that split lines when chunk_size is given"""
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        data = f.read()
+    parser = LogEventParser()
+    events = []
+    step = chunk_size or len(data)
+    for start in range(0, len(data), step):
+        events.extend(parser.feed(data[start:start + step]))
+    events.extend(parser.finish())
+    return parser, events
+
+
+def kinds(events):
+    return [event.kind for event in events]
+
+
+def test_completed_mirror():
+    parser, events = parse("completed.log")
+    assert parser.mirror_completed
+    assert parser.fatal_error is None
+    assert not parser.dry_run
+    assert parser.phase == "mirror"
+    assert len(parser.images_planned) == 2
+    assert parser.images_finished == 2
+    assert parser.blobs_copied == 3
+    assert parser.bytes_copied == int(80.1 * 1024**2) + int(1.2 * 1024) + 12 * 1024**2
+    assert parser.warnings == 2  # the script's WARN line and oc's klog warning
+    assert parser.errors == 0
+    assert kinds(events).count(EventKind.MIRROR_COMPLETED) == 1
+    assert [phase for phase, _ in parser.phase_boundaries if phase] == [
+        "prerequisites", "authentication", "ibm_pak_get", "manifest_generation", "mirror"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_chunked_feed_matches_whole_file(chunk_size):
+    whole, whole_events = parse("completed.log")
+    chunked, chunked_events = parse("completed.log", chunk_size)
+    assert kinds(chunked_events) == kinds(whole_events)
+    assert [e.offset for e in chunked_events] == [e.offset for e in whole_events]
+    assert chunked.state() == whole.state()
+
+
+def test_event_offsets_point_at_their_lines():
+    with open(os.path.join(FIXTURES, "completed.log"), "rb") as f:
+        data = f.read()
+    _, events = parse("completed.log")
+    for event in events:
+        line = data[event.offset:data.index(b"\n", event.offset)].decode()
+        assert event.message.strip() in line
+
+
+def test_generic_oc_error_is_not_completion():
+    # Older scripts log "info: Mirroring completed" even when oc failed
+    parser, events = parse("generic_error.log")
+    assert not parser.mirror_completed
+    assert parser.fatal_error and "permission denied" in parser.fatal_error
+    assert EventKind.MIRROR_COMPLETED not in kinds(events)
+    assert EventKind.FATAL_ERROR in kinds(events)
+
+
+def test_oc_exit_code_is_fatal():
+    parser, events = parse("exit_code.log")
+    assert not parser.mirror_completed
+    assert parser.fatal_error == "oc image mirror failed with exit code 137"
+    assert kinds(events)[-1] == EventKind.FATAL_ERROR
+
+
+def test_image_failures():
+    parser, events = parse("image_failures.log")
+    assert not parser.mirror_completed
+    assert parser.fatal_error.startswith("error: one or more errors occurred")
+    assert list(parser.failed_images) == ["cp.icr.io/cp/ibm-mqadvanced-server-integration"]
+    assert parser.images_finished == 1
+    failure_class, images = app.classify_failure(parser)
+    assert failure_class == FailureClass.MANIFEST_MISSING
+    assert images == {"cp.icr.io/cp/ibm-mqadvanced-server-integration": FailureClass.MANIFEST_MISSING}
+
+
+def test_dry_run():
+    parser, events = parse("dry_run.log")
+    assert parser.dry_run
+    assert parser.mirror_completed
+    assert parser.phase == "mirror"
+    assert len(parser.images_planned) == 2
+    assert parser.images_finished == 0
+    assert "mirror" in parser.phase_durations()
+
+
+def test_retry_resumes_in_mirror_phase():
+    parser, _ = parse("retry.log")
+    assert parser.phase == "mirror"
+    assert parser.mirror_completed
+    assert parser.images_finished == 1
+
+
+def test_errors_before_the_mirror_do_not_fail_it():
+    parser = LogEventParser()
+    parser.feed(b"[2026-10-19 10:00:04] [INFO] Fetching operator: ibm-mq v9.3.5\n"
+                b"error: unable to fetch the CASE index, retrying\n"
+                b"[2026-10-19 10:00:25] [INFO] Starting image mirror process...\n"
+                b"[2026-10-19 10:01:27] [INFO] info: Mirroring completed\n")
+    assert parser.errors == 1
+    assert parser.mirror_completed
+    assert parser.fatal_error is None
+
+
+def test_base_offset_and_partial_line():
+    parser = LogEventParser(base_offset=100)
+    assert parser.feed(b"[2026-10-19 10:00:25] [INFO] Starting image mirror") == []
+    events = parser.feed(b" process...\n")
+    assert events[0].kind == EventKind.PHASE and events[0].offset == 100
+    assert parser.offset == 100 + len(b"[2026-10-19 10:00:25] [INFO] Starting image mirror process...\n")
+
+
+def test_error_index_overflow_is_mixed(monkeypatch):
+    monkeypatch.setattr(app, "ERROR_INDEX_MAX_CAUSES", 2)
+    index = app.ErrorIndex()
+    messages = ["error: unauthorized: authentication required", "error: manifest unknown",
+                "write /opt/cp4i/x/blob: no space left on device", "error: something else"]
+    for seq, message in enumerate(messages, 1):
+        index.add(app.LogEvent(EventKind.ERROR, seq * 100, message, seq=seq))
+
+    other = index.causes["other errors"]
+    assert other["failure_class"] == app.ErrorIndex.MIXED
+    assert other["failure_classes"] == {FailureClass.DISK_FULL: 1, FailureClass.UNKNOWN: 1}
+    assert "no space left" not in other["example"]
+    assert [e["failure_class"] for e in index.entries[2:]] == [FailureClass.DISK_FULL, FailureClass.UNKNOWN]
+    assert index.distinct_causes()[-1] is other
+
+    parser = LogEventParser()
+    parser.error_index = index
+    assert app.classify_failure(parser)[0] == FailureClass.DISK_FULL
@@ -0,0 +1,70 @@
+"""Whether a cached mapping file stands in for a live dry run"""
+import json
+import os
+import subprocess
+
+import pytest
+
+import app
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cp4i_downloader.sh")
+
+
+@pytest.fixture
+def home(tmp_path):
+    case_dir = tmp_path / ".ibm-pak" / "data" / "cases" / "ibm-mq" / "9.3.5"
+    (case_dir / "charts").mkdir(parents=True)
+    (case_dir / "ibm-mq-9.3.5.tgz").write_bytes(b"case archive")
+    (case_dir / "charts" / "a b.yaml").write_text("chart")
+    mapping = tmp_path / ".ibm-pak" / "data" / "mirror" / "ibm-mq" / "9.3.5" / "images-mapping-to-filesystem.txt"
+    mapping.parent.mkdir(parents=True)
+    mapping.write_text("cp.icr.io/cp/ibm-mq/qm@sha256:1=file://integration/cp/ibm-mq/qm:9.3.5\n")
+    return tmp_path
+
+
+def _record(home, filter_pattern):
+    """Write mapping-source.json with the script's own functions"""
+    functions = subprocess.run(["sed", "-n", "/^case_digest() {/,/^}/p;/^write_mapping_source() {/,/^}/p", SCRIPT],
+                               capture_output=True, text=True, check=True).stdout
+    mapping = app._mapping_file_path(str(home), "ibm-mq", "9.3.5")
+    subprocess.run(["bash", "-c", functions + "\nwrite_mapping_source"], check=True, env=dict(
+        os.environ, IBMPAK_HOME=str(home), COMPONENT="ibm-mq", VERSION="9.3.5", FILTER=filter_pattern,
+        MAPPING_FILE=mapping))
+    with open(os.path.join(os.path.dirname(mapping), app.MAPPING_SOURCE_FILE)) as f:
+        return json.load(f)
+
+
+def _source(home, filter_pattern=None):
+    return app.mirror_planner.mapping_source(app._mapping_file_path(str(home), "ibm-mq", "9.3.5"), str(home),
+                                             "ibm-mq", "9.3.5", filter_pattern)
+
+
+def test_script_and_server_agree_on_case_digest(home):
+    recorded = _record(home, '.*\\.qm"')
+    assert recorded["filter"] == '.*\\.qm"'
+    assert recorded["case_digest"] == app._case_digest(str(home), "ibm-mq", "9.3.5")
+    assert _source(home, '.*\\.qm"')["mismatch"] is None
+
+
+def test_other_filter_or_case_does_not_match(home):
+    _record(home, "")
+    assert _source(home)["mismatch"] is None
+    assert "filter" in _source(home, ".*qm.*")["mismatch"]
+
+    (home / ".ibm-pak" / "data" / "cases" / "ibm-mq" / "9.3.5" / "ibm-mq-9.3.5.tgz").write_bytes(b"republished")
+    assert "CASE has changed" in _source(home)["mismatch"]
+
+
+def test_unrecorded_mapping_falls_back_to_live(home):
+    assert _source(home)["mismatch"]
+    result = app.download_manager.start_download("mq-1", "ibm-mq", "9.3.5", "mq", dry_run=True, home_dir=str(home),
+                                                 dry_run_mode="fast")
+    assert result["mapping_missing"]
+
+
+def test_recorded_mapping_serves_fast_dry_run(home):
+    _record(home, "")
+    result = app.download_manager.start_download("mq-2", "ibm-mq", "9.3.5", "mq", dry_run=True, home_dir=str(home),
+                                                 dry_run_mode="fast")
+    assert result["dry_run_source"] == "cache"
+    assert result["plan"]["images_matched"] == 1
@@ -0,0 +1,98 @@
+"""Batched webhook delivery against a local HTTP sink"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import app
+
+
+class Sink(BaseHTTPRequestHandler):
+    """Records webhook payloads; answers 500 while `failures` is positive"""
+    payloads = []
+    failures = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if Sink.failures > 0:
+            Sink.failures -= 1
+            self.send_response(500)
+        else:
+            Sink.payloads.append(json.loads(body))
+            self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def sink():
+    Sink.payloads, Sink.failures = [], 0
+    server = HTTPServer(("127.0.0.1", 0), Sink)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/hook"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def dispatcher(sink, monkeypatch):
+    monkeypatch.setattr(app, "NOTIFY_BATCH_WINDOW", 0.2)
+    monkeypatch.setattr(app, "NOTIFY_RETRY_BASE_DELAY", 0.2)
+    return app.NotificationDispatcher(app.AsyncSupervisor(workers=1), webhook_url=sink, email=None)
+
+
+def _download(name):
+    return {"component": "ibm-mq", "version": "9.3.5", "name": name}
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_events_in_one_window_are_one_call(dispatcher):
+    for i in range(3):
+        dispatcher.notify("started", f"d{i}", _download(f"mq-{i}"), "Started")
+    dispatcher.notify("started", "d0", _download("mq-0"), "Started again")
+
+    assert _wait_for(lambda: Sink.payloads)
+    time.sleep(0.3)
+    assert len(Sink.payloads) == 1
+    payload = Sink.payloads[0]
+    assert payload["status"] == "BATCH" and payload["count"] == 3
+    assert payload["notifications"][0]["repeats"] == 2
+
+
+def test_failed_delivery_is_retried(dispatcher):
+    Sink.failures = 1
+    dispatcher.notify("completed", "d1", _download("mq"), "Completed")
+
+    assert _wait_for(lambda: len(dispatcher.status()["recent"]) == 2)
+    assert Sink.payloads[0]["status"] == "COMPLETED"
+    assert [r["result"] for r in dispatcher.status()["recent"]] == ["sent", "retried"]
+
+
+def test_events_queued_while_sending_wait_for_the_window(dispatcher, monkeypatch):
+    deliver = dispatcher._deliver
+    scheduled = []
+
+    def deliver_and_notify(delivery):
+        deliver(delivery)
+        dispatcher.notify("failed", "d2", _download("mq-2"), "Failed")
+
+    monkeypatch.setattr(dispatcher, "_deliver", deliver_and_notify)
+    dispatcher.notify("started", "d1", _download("mq-1"), "Started")
+    monkeypatch.setattr(dispatcher, "_schedule", lambda at: scheduled.append(at - time.time()))
+    dispatcher.flush()
+
+    assert Sink.payloads[0]["status"] == "STARTED"
+    assert scheduled and min(scheduled) > 0.1
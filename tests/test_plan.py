@@ -0,0 +1,64 @@
+"""POST /api/plan: images, counts and size estimates from a cached mapping file"""
+import pytest
+
+import app
+
+MAPPING = """cp.icr.io/cp/ibm-mq/qm@sha256:1=file://integration/cp/ibm-mq/qm:9.3.5-1
+cp.icr.io/cp/ibm-mq/operator@sha256:2=file://integration/cp/ibm-mq/operator:9.3.5-2
+cp.icr.io/cp/ibm-mq/web@sha256:3=file://integration/cp/ibm-mq/web:9.3.5-3
+"""
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    mapping = app._mapping_file_path(str(tmp_path), "ibm-mq", "9.3.5")
+    (tmp_path / ".ibm-pak" / "data" / "mirror" / "ibm-mq" / "9.3.5").mkdir(parents=True)
+    with open(mapping, "w") as f:
+        f.write(MAPPING)
+    sizes = app.ImageSizeCache(str(tmp_path / "image-sizes.json"))
+    sizes.update({"integration/cp/ibm-mq/qm": 300, "integration/cp/ibm-mq/operator": 100}, {})
+    metrics = app.RunMetricsStore(str(tmp_path / "run-metrics.jsonl"))
+    metrics.record({"component": "ibm-mq", "version": "9.3.4", "status": "completed",
+                    "throughput_bytes_per_sec": 100})
+    monkeypatch.setattr(app, "mirror_planner", app.MirrorPlanner(metrics, sizes))
+    return app.app.test_client()
+
+
+def _plan(client, tmp_path, **fields):
+    return client.post("/api/plan", json=dict({"component": "ibm-mq", "version": "9.3.5",
+                                               "home_dir": str(tmp_path)}, **fields))
+
+
+def test_filter_selects_images_with_cached_sizes(client, tmp_path):
+    response = _plan(client, tmp_path, filter="qm|operator", final_registry="registry.example.com:5000")
+    plan = response.get_json()
+
+    assert response.status_code == 200
+    assert plan["images_total"] == 3 and plan["images_matched"] == 2
+    assert plan["estimated_bytes"] == 400 and plan["sizes_cached"] == 2
+    assert plan["estimated_seconds"] == 4 and plan["throughput_source"] == "component"
+    assert [image["target"] for image in plan["images"]] == [
+        "registry.example.com:5000/cp/ibm-mq/qm:9.3.5-1", "registry.example.com:5000/cp/ibm-mq/operator:9.3.5-2"]
+    assert "capacity" in plan
+
+
+def test_unknown_sizes_use_the_average(client, tmp_path):
+    plan = _plan(client, tmp_path).get_json()
+
+    assert plan["images_matched"] == 3
+    assert plan["estimated_bytes"] == 300 + 100 + 200
+    assert any("no cached size" in warning for warning in plan["warnings"])
+
+
+def test_invalid_filter_is_a_bad_request(client, tmp_path):
+    response = _plan(client, tmp_path, filter="qm(")
+
+    assert response.status_code == 400
+    assert response.get_json()["invalid_filter"]
+
+
+def test_missing_mapping_is_not_found(client, tmp_path):
+    response = _plan(client, tmp_path, version="9.9.9")
+
+    assert response.status_code == 404
+    assert response.get_json()["mapping_missing"]
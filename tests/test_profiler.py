@@ -0,0 +1,37 @@
+"""Process tree sampling without a cgroup"""
+import os
+import subprocess
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def job():
+    process = subprocess.Popen(["sh", "-c", "sleep 30 & sleep 30 & wait"], start_new_session=True)
+    time.sleep(0.2)
+    yield process
+    os.killpg(process.pid, 9)
+    process.wait()
+
+
+def test_tree_is_followed_without_scanning_proc(job, monkeypatch):
+    listed = []
+    listdir = os.listdir
+    monkeypatch.setattr(app.os, "listdir", lambda path: listed.append(path) or listdir(path))
+    profiler = app.ProcessTreeProfiler(interval=10, hung_timeout=0)
+    profiler.attach(job.pid)
+
+    sample = profiler.sample()
+
+    assert sample["processes"] == 3
+    assert "/proc" not in listed
+
+
+def test_sample_on_a_tick_as_long_as_the_interval_is_due():
+    profiler = app.ProcessTreeProfiler(interval=app.MONITOR_INTERVAL, hung_timeout=0)
+    profiler._last_time = time.time() - app.MONITOR_INTERVAL + 0.5
+
+    assert profiler.due()
@@ -0,0 +1,60 @@
+"""The /metrics endpoint in the Prometheus text format"""
+import re
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.fixture
+def job(tmp_path):
+    manager = app.download_manager
+    download_id = 'test-"odd"\\id'
+    download = manager._new_download(download_id, "ibm-mq", "9.3.5", "mq", None, False, str(tmp_path), "r:5000",
+                                     None, None, 0, "default", None)
+    download["written_bytes"] = 12345
+    with manager.lock:
+        manager.downloads[download_id] = download
+    yield download
+    with manager.lock:
+        manager.downloads.pop(download_id, None)
+
+
+def _samples(text, name):
+    """{series: value} of the samples of one metric name"""
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+            for line in text.splitlines() if line.startswith(name) and not line.startswith("#")}
+
+
+def test_route_histogram_is_cumulative(client):
+    for _ in range(3):
+        client.get("/api/downloads")
+
+    text = client.get("/metrics").get_data(as_text=True)
+
+    assert "# TYPE cp4i_http_request_duration_seconds histogram" in text
+    labels = 'method="GET",route="/api/downloads",status="200"'
+    series = _samples(text, "cp4i_http_request_duration_seconds")
+    buckets = [(key, value) for key, value in series.items()
+               if key.startswith("cp4i_http_request_duration_seconds_bucket{" + labels)]
+    counts = [value for _, value in buckets]
+    assert counts == sorted(counts)
+    assert buckets[-1][0].endswith('le="+Inf"}')
+    assert counts[-1] == series[f"cp4i_http_request_duration_seconds_count{{{labels}}}"] >= 3
+    assert re.search(r'le="0\.001"', buckets[0][0])
+
+
+def test_scrape_time_gauge_escapes_labels(client, job):
+    response = client.get("/metrics")
+    text = response.get_data(as_text=True)
+
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    series = _samples(text, "cp4i_download_written_bytes")
+    assert series['cp4i_download_written_bytes{download_id="test-\\"odd\\"\\\\id",component="ibm-mq",'
+                  'version="9.3.5"}'] == 12345
+    assert _samples(text, "cp4i_downloads{")['cp4i_downloads{status="queued"}'] >= 1
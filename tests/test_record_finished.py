@@ -0,0 +1,37 @@
+"""Finished downloads are reported and recorded outside the manager lock"""
+import pytest
+
+import app
+
+
+@pytest.fixture
+def reports(monkeypatch):
+    """Whether the manager lock was held each time a summary report was written"""
+    manager, held = app.download_manager, []
+    monkeypatch.setattr(manager, "_generate_summary_report",
+                        lambda download, parser=None: held.append(manager.lock.locked()))
+    yield held
+    app.download_history[:] = [h for h in app.download_history if not h["id"].startswith("test-")]
+
+
+def _download(tmp_path, download_id, status="running"):
+    manager = app.download_manager
+    download = manager._new_download(download_id, "ibm-mq", "9.3.5", download_id, None, False, str(tmp_path),
+                                     "r:5000", None, None, 0, "default", None)
+    download["status"] = status
+    with manager.lock:
+        manager.downloads[download_id] = download
+    return download
+
+
+def test_finished_download_is_recorded_without_the_lock(reports, tmp_path):
+    manager = app.download_manager
+    download = _download(tmp_path, "test-finished")
+    generation = manager.history_generation
+
+    manager._finish_monitored("test-finished", download, "completed", app.job_logger("test-finished"))
+    manager.downloads.pop("test-finished", None)
+
+    assert reports == [False]
+    assert any(h["id"] == "test-finished" for h in app.download_history)
+    assert manager.history_generation > generation
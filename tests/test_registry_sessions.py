@@ -0,0 +1,33 @@
+"""Shared registry logins on the supervisor"""
+import threading
+import time
+
+import app
+
+
+def test_waiters_do_not_hold_pool_threads(tmp_path, monkeypatch):
+    supervisor = app.AsyncSupervisor(workers=2)
+    cache = app.RegistrySessionCache(str(tmp_path / "sessions"))
+    release = threading.Event()
+    finished = []
+
+    def slow_login(fingerprint, entitlement_key, auth_file, source_mtime):
+        release.wait(5)
+        finished.append("login")
+        return {"auth_file": str(tmp_path / "session.json"), "expires": time.time() + 60,
+                "source_mtime": source_mtime, "uses": 1}
+
+    monkeypatch.setattr(cache, "_login", slow_login)
+    logins = [supervisor.submit(cache.acquire("key", "/nonexistent/auth.json", supervisor.run_blocking))
+              for _ in range(3)]
+
+    async def other_work():
+        return await supervisor.run_blocking(lambda: finished.append("other"))
+
+    # Only the owner's login takes a pool thread, so other blocking work still runs meanwhile
+    supervisor.submit(other_work()).result(timeout=2)
+    assert finished == ["other"]
+
+    release.set()
+    assert {login.result(timeout=5) for login in logins} == {str(tmp_path / "session.json")}
+    assert finished == ["other", "login"]
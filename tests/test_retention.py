@@ -0,0 +1,43 @@
+"""Retention passes: batched deletion and protection of active directories"""
+import os
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def planned(tmp_path, monkeypatch):
+    """A download directory the next pass plans to delete"""
+    path = tmp_path / "old"
+    (path / "v2").mkdir(parents=True)
+    for i in range(5):
+        (path / "v2" / f"blob-{i}").write_text("x" * 10)
+    (path / "old-download.log").write_text("log")
+    (tmp_path / "old-summary-report.txt").write_text("report")
+    item = {"path": str(path), "name": "old", "component": "ibm-mq", "version": "9.3.0", "bytes": 53,
+            "reclaimable_bytes": 53, "reason": "test"}
+    monkeypatch.setattr(app.retention, "plan", lambda: {"delete": [item]})
+    monkeypatch.setattr(app, "RETENTION_DELETE_BATCH", 2)
+    monkeypatch.setattr(app, "RETENTION_DELETE_PAUSE", 0)
+    return path
+
+
+def test_pass_deletes_in_batches(planned):
+    result = app.retention.run_pass()
+
+    assert not planned.exists()
+    assert not (planned.parent / "old-summary-report.txt").exists()
+    assert result["deleted"][0]["bytes_freed"] == 59
+
+
+def test_pass_skips_coalesce_subscribers(planned, monkeypatch):
+    subscriber = {"id": "sub", "name": "old", "home_dir": str(planned.parent), "start_time": ""}
+    monkeypatch.setitem(app.download_manager.downloads, "primary", {
+        "id": "primary", "name": "new", "home_dir": str(planned.parent), "status": "running",
+        "subscribers": [subscriber]})
+
+    result = app.retention.run_pass()
+
+    assert os.path.isdir(planned)
+    assert result["deleted"] == []
@@ -0,0 +1,67 @@
+"""Run metrics percentiles per component/version and the throughput trend"""
+import json
+
+import pytest
+
+import app
+
+DAYS = ["2026-01-05", "2026-01-06", "2026-01-06", "2026-01-12", "2026-02-02"]
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = tmp_path / "run-metrics.jsonl"
+    runs = [{"id": f"mq-{i}", "component": "ibm-mq", "version": "9.3.5", "status": "completed",
+             "end_time": f"{day}T10:00:00", "duration_seconds": 10 * (i + 1), "bytes": 1000,
+             "throughput_bytes_per_sec": 100 * (i + 1), "phases": {"mirror": float(i + 1)}}
+            for i, day in enumerate(DAYS)]
+    runs += [
+        {"id": "mq-old", "component": "ibm-mq", "version": "9.3.4", "status": "completed",
+         "end_time": "2026-01-05T09:00:00", "duration_seconds": 99, "throughput_bytes_per_sec": 7},
+        {"id": "mq-failed", "component": "ibm-mq", "version": "9.3.5", "status": "failed",
+         "end_time": "2026-01-05T11:00:00", "duration_seconds": 1000},
+        {"id": "mq-dry", "component": "ibm-mq", "version": "9.3.5", "status": "completed", "dry_run": True,
+         "end_time": "2026-01-05T12:00:00", "duration_seconds": 1},
+    ]
+    path.write_text("".join(json.dumps(run) + "\n" for run in runs) + "not json\n")
+    return app.RunMetricsStore(str(path))
+
+
+def test_percentiles_per_component_version(store):
+    result = store.aggregate()
+
+    assert result["runs"] == 6
+    assert [(g["component"], g["version"], g["runs"]) for g in result["by_component_version"]] == [
+        ("ibm-mq", "9.3.4", 1), ("ibm-mq", "9.3.5", 5)]
+    group = result["by_component_version"][1]
+    assert group["duration_seconds"] == {"p50": 30, "p95": 48}
+    assert group["throughput_bytes_per_sec"] == {"p50": 300, "p95": 480}
+    assert group["phases"]["mirror"] == {"p50": 3.0, "p95": 4.8}
+    assert group["latest"]["id"] == "mq-4" and group["latest"]["duration_vs_p50"] == 50 / 30
+
+
+@pytest.mark.parametrize("bucket, periods", [
+    ("day", [("2026-01-05", 2), ("2026-01-06", 2), ("2026-01-12", 1), ("2026-02-02", 1)]),
+    ("week", [("2026-W02", 4), ("2026-W03", 1), ("2026-W06", 1)]),
+    ("month", [("2026-01", 5), ("2026-02", 1)]),
+])
+def test_trend_buckets(store, bucket, periods):
+    trend = store.aggregate(bucket=bucket)["trend"]
+    assert [(t["period"], t["runs"]) for t in trend] == periods
+
+
+def test_filters_and_dry_runs(store):
+    assert store.aggregate(version="9.3.5", status="all")["runs"] == 6
+    assert store.aggregate(version="9.3.5", include_dry_run=True)["runs"] == 6
+    assert store.aggregate(since="2026-01-12")["runs"] == 2
+
+
+def test_history_endpoint(store, monkeypatch):
+    monkeypatch.setattr(app, "run_metrics", store)
+    client = app.app.test_client()
+
+    body = client.get("/api/metrics/history?bucket=month&version=9.3.5&include_runs=true&limit=2").get_json()
+
+    assert [t["period"] for t in body["trend"]] == ["2026-01", "2026-02"]
+    assert [r["id"] for r in body["recent_runs"]] == ["mq-failed", "mq-dry"]
+    assert client.get("/api/metrics/history?bucket=year").status_code == 400
@@ -0,0 +1,67 @@
+"""Schedule windows, budgets and the scheduler's state file"""
+import pytest
+
+import app
+
+
+@pytest.fixture
+def scheduler(tmp_path):
+    return app.JobScheduler(app.download_manager, str(tmp_path / "schedule.json"))
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize("window", [
+    {"start": "22:00", "end": "06:00", "budget_gb": "lots"},
+    {"start": "22:00", "end": "06:00", "budget_gb": [1]},
+    {"start": "22:00", "end": "06:00", "budget_gb": 0},
+    {"start": "22:00", "end": "06:00", "days": "mon"},
+    {"start": 2200, "end": "06:00"},
+])
+def test_invalid_window_is_rejected(client, window):
+    assert client.put("/api/schedule/windows/night", json=window).status_code == 400
+
+
+def test_schedule_must_be_an_object(client):
+    response = client.post("/api/downloads", json={
+        "component": "ibm-mq", "version": "9.3.5", "name": "mq", "home_dir": "/tmp/cp4i",
+        "final_registry": "r:5000", "registry_auth_file": "/tmp/auth.json", "schedule": "22:00"})
+    assert response.status_code == 400
+
+
+def test_failed_start_refunds_budget(scheduler, monkeypatch):
+    monkeypatch.setattr(app.download_manager, "start_download", lambda *args: {"error": "boom"})
+    scheduler.set_window("always", {"start": "00:00", "end": "00:00", "budget_gb": 1000})
+    scheduler.schedule("mq-1", {"component": "ibm-mq", "version": "9.3.5", "name": "mq", "home_dir": "/tmp/x"},
+                       window="always")
+
+    scheduler.tick()
+
+    assert scheduler.state["jobs"]["mq-1"]["status"] == "failed"
+    assert scheduler.state["usage"]["always"]["bytes"] == 0
+
+
+def test_finished_schedules_are_pruned(scheduler, monkeypatch):
+    monkeypatch.setattr(app, "SCHEDULE_KEEP_FINISHED", 2)
+    for i in range(4):
+        scheduler.schedule(f"mq-{i}", {"component": "ibm-mq", "version": "9.3.5", "name": f"mq-{i}"},
+                           not_before="2099-01-01T00:00:00")
+        scheduler.cancel(f"mq-{i}")
+    scheduler.schedule("mq-pending", {"component": "ibm-mq", "version": "9.3.5", "name": "mq-pending"},
+                       not_before="2099-01-01T00:00:00")
+
+    assert sorted(scheduler.state["jobs"]) == ["mq-2", "mq-3", "mq-pending"]
+
+
+def test_seed_copies_files(tmp_path):
+    src = tmp_path / "old" / "v2"
+    src.mkdir(parents=True)
+    (src / "blob").write_text("layer")
+    dst = tmp_path / "new" / "v2"
+
+    assert app._hardlink_tree(str(src), str(dst), copy=True) == 1
+    (dst / "blob").write_text("rewritten")
+    assert (src / "blob").read_text() == "layer"
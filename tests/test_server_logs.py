@@ -0,0 +1,83 @@
+"""Rate limiting of repeated log messages and the in-memory server log buffer"""
+import logging
+
+import pytest
+
+import app
+
+
+def _record(msg="Polling %s", created=1000.0, level=logging.INFO, download_id="d1", name="cp4i.manager", args=("x",)):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.created = created
+    if download_id:
+        record.download_id = download_id
+    return record
+
+
+def test_repeats_are_suppressed_within_the_window():
+    limit = app.RateLimitFilter(60)
+
+    assert limit.filter(_record(created=1000))
+    assert not limit.filter(_record(created=1010, args=("y",)))
+    assert not limit.filter(_record(created=1059))
+    reopened = _record(created=1061)
+    assert limit.filter(reopened)
+    assert reopened.suppressed == 2
+
+
+def test_other_downloads_templates_and_errors_are_not_suppressed():
+    limit = app.RateLimitFilter(60)
+
+    assert limit.filter(_record())
+    assert limit.filter(_record(download_id="d2"))
+    assert limit.filter(_record(msg="Other %s"))
+    assert limit.filter(_record(level=logging.ERROR))
+    assert limit.filter(_record(level=logging.ERROR))
+
+
+def test_decision_is_shared_between_handlers():
+    limit = app.RateLimitFilter(60)
+    limit.filter(_record(created=1000))
+    repeat = _record(created=1001)
+
+    assert not limit.filter(repeat)
+    assert not limit.filter(repeat)
+    assert limit.last_seen[("cp4i.manager", "d1", "Polling %s")] == (1000, 1)
+
+
+@pytest.fixture
+def buffer():
+    handler = app.RingBufferHandler(3)
+    for i in range(5):
+        handler.handle(_record(msg=f"message {i}", level=logging.WARNING if i % 2 else logging.INFO,
+                               download_id=f"d{i % 2}", args=()))
+    return handler
+
+
+def test_ring_keeps_the_newest_records(buffer):
+    records = buffer.query()
+
+    assert buffer.seq == 5
+    assert [r["seq"] for r in records] == [3, 4, 5]
+    assert [r["message"] for r in records] == ["message 2", "message 3", "message 4"]
+
+
+def test_query_pages_by_sequence_and_filters(buffer):
+    assert [r["seq"] for r in buffer.query(since=4)] == [5]
+    assert [r["seq"] for r in buffer.query(limit=2)] == [4, 5]
+    assert [r["seq"] for r in buffer.query(level="warning")] == [4]
+    assert [r["seq"] for r in buffer.query(download_id="d0")] == [3, 5]
+    assert [r["seq"] for r in buffer.query(contains="MESSAGE 3")] == [4]
+    with pytest.raises(ValueError):
+        buffer.query(level="loud")
+
+
+def test_server_logs_endpoint(monkeypatch, buffer):
+    monkeypatch.setattr(app, "log_buffer", buffer)
+    client = app.app.test_client()
+
+    body = client.get("/api/server-logs?since=3&limit=10").get_json()
+
+    assert [r["seq"] for r in body["logs"]] == [4, 5]
+    assert body["last_seq"] == 5 and body["capacity"] == 3
+    assert client.get("/api/server-logs?level=loud").status_code == 400
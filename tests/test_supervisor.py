@@ -0,0 +1,76 @@
+"""Downloads driven by the asyncio supervisor, and its periodic tasks"""
+import concurrent.futures
+import os
+import time
+
+import pytest
+
+import app
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    """Supervise a shell command as a download; returns its history entry once finished"""
+    monkeypatch.setattr(app, "REGISTRY_SESSIONS_ENABLED", False)
+    manager, started = app.download_manager, []
+
+    def supervise(download_id, script):
+        download = manager._new_download(download_id, "ibm-mq", "9.3.5", download_id, None, False, str(tmp_path),
+                                         "r:5000", str(tmp_path / "auth.json"), None, 0, "default", None)
+        download.update(status="starting", auto_retry=False)
+        (tmp_path / download_id).mkdir()
+        with manager.lock:
+            manager.downloads[download_id] = download
+        started.append(download_id)
+        spawned = concurrent.futures.Future()
+        manager.supervisor.submit(manager._supervise(
+            download_id, download, ["bash", "-c", script], dict(os.environ), spawned))
+        assert spawned.result(timeout=5) > 0
+        assert _wait_for(lambda: any(h["id"] == download_id for h in app.download_history))
+        return download, next(h for h in app.download_history if h["id"] == download_id)
+
+    yield supervise
+    with manager.lock:
+        for download_id in started:
+            manager.downloads.pop(download_id, None)
+    app.download_history[:] = [h for h in app.download_history if h["id"] not in started]
+
+
+def test_script_exiting_cleanly_completes(run):
+    download, entry = run("test-ok", "echo working; exit 0")
+
+    assert entry["status"] == "completed"
+    assert download["return_code"] == 0
+    assert _wait_for(lambda: list(download.get("output_tail", ())) == ["working"])
+
+
+def test_script_failing_is_recorded_with_its_exit_code(run):
+    download, entry = run("test-fail", "exit 3")
+
+    assert entry["status"] == "failed"
+    assert download["return_code"] == 3
+    assert len(entry["attempts"]) == 1
+
+
+def test_periodic_task_stops_when_cancelled():
+    supervisor = app.AsyncSupervisor(workers=1)
+    ticks = []
+    task = supervisor.every(0.02, lambda: ticks.append(time.time()), "test ticker")
+    assert _wait_for(lambda: len(ticks) >= 3, timeout=5)
+
+    task.cancel()
+    time.sleep(0.1)
+    count = len(ticks)
+    time.sleep(0.2)
+
+    assert task.cancelled()
+    assert len(ticks) == count
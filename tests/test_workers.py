@@ -0,0 +1,82 @@
+"""Worker registration and dispatch on the coordinator"""
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def _heartbeat(client, name="w1", token=None):
+    headers = {"X-CP4I-Worker-Token": token} if token else {}
+    return client.post("/api/workers/heartbeat", json={"name": name, "url": "http://w1:5000"}, headers=headers)
+
+
+def test_heartbeat_refused_without_configured_token(client, monkeypatch):
+    monkeypatch.setattr(app, "WORKER_TOKEN", None)
+    assert _heartbeat(client).status_code == 403
+
+
+def test_heartbeat_needs_matching_token(client, monkeypatch):
+    monkeypatch.setattr(app, "WORKER_TOKEN", "secret")
+    monkeypatch.setattr(app.download_manager.workers, "workers", {})
+    assert _heartbeat(client, token="wrong").status_code == 403
+    assert _heartbeat(client, name="local", token="secret").status_code == 400
+    assert _heartbeat(client, token="secret").status_code == 200
+
+
+def test_dispatch_does_not_send_entitlement_key(monkeypatch):
+    pool = app.WorkerPool(app.download_manager)
+    pool.workers["w1"] = {"name": "w1", "url": "http://w1:5000"}
+    sent = {}
+
+    def fake_http_json(method, url, body=None, timeout=None):
+        sent.update(body)
+        return 200, {"success": True, "download_id": "remote-1", "status": "running"}
+
+    monkeypatch.setattr(app, "_http_json", fake_http_json)
+    result = pool.dispatch("w1", "d1", {"component": "ibm-mq", "version": "9.3.5", "name": "mq",
+                                        "entitlement_key": "secret-key"})
+
+    assert result["remote_id"] == "remote-1"
+    assert "entitlement_key" not in sent
+    assert "entitlement_key" not in pool.jobs["d1"]["request"]
+
+
+@pytest.fixture
+def finished_runs():
+    """Two dispatched runs of the same name in history, on different workers"""
+    runs = [{"id": "test-mq-1", "name": "mq", "worker": "w1", "remote_id": "remote-1", "status": "failed"},
+            {"id": "test-mq-2", "name": "mq", "worker": "w2", "remote_id": "remote-2", "status": "failed"}]
+    app.download_history.extend(runs)
+    yield runs
+    app.download_history[:] = [h for h in app.download_history if not h["id"].startswith("test-")]
+
+
+def _pool_answering(monkeypatch, status, answer):
+    pool = app.WorkerPool(app.download_manager)
+    pool.workers.update(w1={"name": "w1", "url": "http://w1:5000"}, w2={"name": "w2", "url": "http://w2:5000"})
+    monkeypatch.setattr(app, "_http_json", lambda method, url, body=None, timeout=None: (status, answer))
+    return pool
+
+
+def test_retry_replaces_only_the_retried_run(monkeypatch, finished_runs):
+    pool = _pool_answering(monkeypatch, 200, {"success": True, "download_id": "remote-3"})
+
+    status, result = pool.retry("test-mq-1")
+
+    assert status == 200 and result["remote_id"] == "remote-3"
+    ids = [h["id"] for h in app.download_history]
+    assert "test-mq-1" not in ids and "test-mq-2" in ids
+
+
+@pytest.mark.parametrize("status, answer", [(200, {"success": True}), (200, ["not", "a", "dict"]), (204, None)])
+def test_invalid_retry_response_is_a_bad_gateway(monkeypatch, finished_runs, status, answer):
+    pool = _pool_answering(monkeypatch, status, answer)
+
+    status, result = pool.retry("test-mq-1")
+
+    assert status == 502 and "error" in result
+    assert "test-mq-1" in [h["id"] for h in app.download_history]